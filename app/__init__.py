@@ -1,28 +1,156 @@
+import os
+
 from flask import Flask, session
 
+import assets
+import cache
+import database
+import instrumentation
+import sessions
+import templating
+from accrual import accrue_interest
+from analytics import rebuild as rebuild_analytics
+from api import api
+from jobs import jobs
+from lazy_commands import LazyCommand
+from ledger import open_accounts
+from money import format_currency
 from routes import main
 from forms import form
 from models import db
 
 
 # Creates and configures the Flask object which controls the web app
-def create_app():
+# - config holds settings which replace the defaults below (e.g. in the tests)
+def create_app(config=None):
     # Initialize Flask object
     app = Flask(__name__)
 
     # Register routing blueprint so that routes in other files (namely routes.py) can be recognized
     app.register_blueprint(main)
     app.register_blueprint(form)
+    app.register_blueprint(api)
 
     # Configuration settings
     app.config["SECRET_KEY"] = "microlend2021"
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///db.sqlite3"  # Sets the name and location of the sqlite3 database
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  # Turns off unnecessary warning message
+    app.config["BCRYPT_LOG_ROUNDS"] = 12  # bcrypt work factor for new password hashes (see passwords.py)
+    app.config["PASSWORD_HASHING_WORKERS"] = 4  # Number of threads used for password hashing
+    app.config["SQL_STATEMENT_COUNT"] = False  # Set to True to count the SQL statements run by each request
+    app.config["PERFORMANCE_METRICS"] = os.environ.get("PERFORMANCE_METRICS") == "1"  # Serves /metrics when on
+    app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN")  # Lets a scraper read /metrics without logging in
+    app.config["SLOW_QUERY_THRESHOLD"] = None  # Seconds; slower statements are logged (e.g. 0.25; None is off)
+    app.config["SLOW_QUERY_LOG"] = os.environ.get("SLOW_QUERY_LOG")  # Optional file for the slow query log
+    app.config["CACHE_REDIS_URL"] = os.environ.get("CACHE_REDIS_URL")  # Optional shared cache server (see cache.py)
+    # Number of worker processes serving the app (set by gunicorn.conf.py, and read by uvicorn --workers too)
+    app.config["WORKER_PROCESSES"] = int(os.environ.get("WEB_CONCURRENCY", 1))
+    app.config["JINJA_BYTECODE_CACHE_DIR"] = os.environ.get("JINJA_BYTECODE_CACHE_DIR")  # See templating.py
+    app.config["FRAGMENT_CACHE"] = True  # Serve unchanged template fragments from cache (see templating.py)
+    app.config["FINGERPRINTED_ASSETS"] = True  # Link to the built static assets once they exist (see assets.py)
+    app.config["SESSION_BACKEND"] = os.environ.get("SESSION_BACKEND", "sql")  # Session store (see sessions.py)
+    app.config["SESSION_REDIS_URL"] = os.environ.get("SESSION_REDIS_URL")  # Server for the "redis" session backend
+    app.config["ASGI_THREADS"] = int(os.environ.get("ASGI_THREADS", 32))  # Requests in flight per process (see asgi.py)
+
+    # Background job queue (see jobs.py) and automatic loan decisions (see loan_decisions.py)
+    # Queue an automatic decision for every new loan request; only turn this on where "flask jobs work" is running,
+    # since nothing else runs the queued jobs
+    app.config["LOAN_DECISION_QUEUE"] = False
+    app.config["JOB_QUEUE_MAX_DEPTH"] = 10000  # New jobs are refused while this many are waiting
+    app.config["JOB_MAX_ATTEMPTS"] = 3
+    app.config["JOB_TIMEOUT"] = 300  # Seconds before a job left running by a dead worker is queued again
+    app.config["LOAN_AUTO_APPROVE_MAX_POOL_SHARE"] = 0.5  # Largest share of a pool that is approved automatically
+    app.config["LOAN_AUTO_APPROVE_MAX_DEBT"] = 1000000  # Most a user can owe (in cents) after an automatic approval
+    app.config["LOAN_AUTO_INTEREST_RATE"] = 2.0
+    app.config["LOAN_AUTO_TERM_DAYS"] = 365
+
+    if config:
+        app.config.update(config)
+
+    # Sets up the caches (see cache.py)
+    cache.init_app(app)
+
+    # Sets up the template bytecode and fragment caches (see templating.py)
+    templating.init_app(app)
+
+    # Serves the fingerprinted static assets and adds asset_url() to the templates (see assets.py)
+    assets.init_app(app)
+
+    # Keeps sessions on the server, with only the session id in the cookie (see sessions.py)
+    sessions.init_app(app)
+
+    # Sets up optional request instrumentation (see instrumentation.py)
+    instrumentation.init_app(app)
+
+    # Reads the database backend and connection pool settings from the environment (see database.py)
+    database.configure(app)
 
     # Initializes the database and associates it with the Flask app
     db.init_app(app)
-    with app.app_context():
-        db.create_all()
+    database.init_app(app)
+
+    # Registers the versioned migrations (usage: flask db <command>, see migrations/), which only the flask command
+    # needs; the schema is created and upgraded by "flask init-db" rather than whenever the app starts (see database.py)
+    if database.loaded_by_flask_command():
+        database.init_migrations(app)
+
+    # Command line interface commands (usage: flask <command>)
+    # init-db: creates the database schema or upgrades it to the latest migration, run before starting the app
+    @app.cli.command("init-db")
+    def init_db_command():
+        database.upgrade_schema()
+        print("The database schema is up to date")
+
+    # accrue-interest: recomputes the interest owed on every loan, meant to be run on a schedule
+    @app.cli.command("accrue-interest")
+    def accrue_interest_command():
+        updated = accrue_interest()
+        print("Accrued interest on " + str(updated) + " loan(s)")
+
+    # loan-schedules: prints the payments expected across every outstanding loan for each of the coming months
+    @app.cli.command("loan-schedules")
+    def loan_schedules_command():
+        from amortization import portfolio_schedule
+
+        loan_ids, schedules = portfolio_schedule()
+        if schedules is None:
+            print("There are no outstanding loans")
+            return
+
+        for month, total in enumerate(schedules["payment"].sum(axis=0), start=1):
+            print("Month " + str(month) + ": " + format_currency(total))
+
+    # open-ledger: writes opening balances to the ledger for accounts and pools created before it existed
+    @app.cli.command("open-ledger")
+    def open_ledger_command():
+        opened = open_accounts()
+        print("Opened " + str(opened) + " account(s) in the ledger")
+
+    # rebuild-analytics: recomputes the running totals used by the bank analytics page
+    @app.cli.command("rebuild-analytics")
+    def rebuild_analytics_command():
+        rebuild_analytics()
+        print("Analytics rebuilt")
+
+    # purge-sessions: deletes expired server-side sessions (see sessions.py)
+    app.cli.add_command(sessions.purge_sessions_command)
+
+    # bulk: imports and exports rows in bulk (see bulk.py)
+    app.cli.add_command(LazyCommand("bulk", "bulk:bulk",
+                                    "Bulk import and export of users, accounts, pools, contributions and loans."))
+
+    # check-query-plans: fails if a hot query would read a whole table instead of using an index (see query_plans.py)
+    app.cli.add_command(LazyCommand("check-query-plans", "query_plans:check_query_plans_command",
+                                    "Check that hot queries use indexes (see query_plans.py)."))
+
+    # jobs: runs the background job queue's workers and prints its metrics (see jobs.py)
+    app.cli.add_command(jobs)
+
+    # assets: builds the fingerprinted and precompressed static assets (see assets.py)
+    app.cli.add_command(assets.assets)
+
+    # benchmark: measures the throughput of the app (see benchmark.py)
+    app.cli.add_command(LazyCommand("benchmark", "benchmark:benchmark",
+                                    "Benchmarks and load tests (see benchmark.py)."))
 
     return app
 
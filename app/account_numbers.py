@@ -0,0 +1,80 @@
+import hashlib
+import os
+import threading
+
+'''
+Account numbers are handed out from a counter which is run through a keyed Feistel permutation, so that consecutive
+accounts still get numbers that look random. Because the permutation is a one-to-one mapping, two different counter
+values can never produce the same account number, so no lookup is needed to check if a number is already taken.
+
+Counter values are reserved from the database in blocks (see AccountNumberSequence in models.py), so most accounts
+are numbered without touching the database at all and several worker processes can allocate numbers at the same
+time without handing out the same value twice.
+'''
+
+# Account numbers are in the range 5000000000 to 5999999999
+ACCOUNT_NUMBER_BASE = 5000000000
+ACCOUNT_NUMBER_SPACE = 1000000000
+
+# The permutation works on 30 bit values (the smallest power of two above ACCOUNT_NUMBER_SPACE), split into two
+# 15 bit halves
+HALF_BITS = 15
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+
+# The key must never change once accounts have been created, otherwise new numbers could collide with old ones
+PERMUTATION_KEY = b"flask-bank-account-numbers"
+
+
+def _round_function(round_number, value):
+    digest = hashlib.blake2b(value.to_bytes(2, "big"), digest_size=4, key=PERMUTATION_KEY,
+                             salt=round_number.to_bytes(16, "big")).digest()
+    return int.from_bytes(digest, "big") & HALF_MASK
+
+
+def _feistel(value):
+    left = value >> HALF_BITS
+    right = value & HALF_MASK
+    for round_number in range(ROUNDS):
+        left, right = right, left ^ _round_function(round_number, right)
+    return (left << HALF_BITS) | right
+
+
+# Maps a counter value in [0, ACCOUNT_NUMBER_SPACE) to a unique account number
+# - The Feistel network permutes all 30 bit values, so results outside of the account number space are fed back
+#   through it ("cycle walking") until they land inside it, which keeps the mapping one-to-one
+def permute(counter):
+    if not 0 <= counter < ACCOUNT_NUMBER_SPACE:
+        raise ValueError("The account number space has been exhausted")
+
+    value = _feistel(counter)
+    while value >= ACCOUNT_NUMBER_SPACE:
+        value = _feistel(value)
+
+    return ACCOUNT_NUMBER_BASE + value
+
+
+class AccountNumberAllocator:
+    # reserve_block is called with a block size and must return the first counter value of a newly reserved block
+    def __init__(self, reserve_block, block_size=100):
+        self.reserve_block = reserve_block
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+        self._pid = None
+
+    # Returns a new, unique account number
+    def allocate(self):
+        with self._lock:
+            # A block reserved before the process forked must not be used by the child process too, since the parent
+            # (or another child) would hand out the same numbers
+            if self._pid != os.getpid() or self._next >= self._end:
+                self._next = self.reserve_block(self.block_size)
+                self._end = self._next + self.block_size
+                self._pid = os.getpid()
+
+            counter = self._next
+            self._next += 1
+
+        return permute(counter)
@@ -0,0 +1,76 @@
+import time
+
+from sqlalchemy import Integer, and_, cast, func
+
+import analytics
+import summary
+from models import db, Loan
+
+'''
+The accrual engine adds the interest owed on every loan in the database at once. It is meant to be run on a schedule
+(cron, systemd timer, etc.) through the "accrue-interest" CLI command rather than from a page view, so that the
+dashboard only has to read the values that were stored here.
+
+Accrual is incremental: each loan's last_accrued_at records the time up to which interest has been added, and a run
+only adds simple daily interest on the principal still outstanding for the whole days since then. Interest is only
+added in whole cents; what is left over is kept in interest_remainder and added on later runs. Payments (see
+banking.make_loan_payment) accrue the loan up to the time of payment first, so interest after a payment is charged on
+the reduced principal.
+'''
+
+SECONDS_PER_DAY = 86400
+
+
+# Builds the UPDATE statement which accrues interest on loans up to current_time
+def _accrual_statement(current_time, loan_id=None):
+    # Interest has been added up to the watermark (or nothing has been added since the loan was approved)
+    watermark = func.coalesce(Loan.last_accrued_at, Loan.date_approved)
+
+    # Whole days since the watermark
+    days = cast((current_time - watermark) / SECONDS_PER_DAY, Integer)
+
+    # Interest = outstanding principal * (interest rate / 365 / 100) * days, plus the fraction of a cent left over by
+    # earlier runs; whole cents are added to amount_accrued and the rest is carried over to the next run, so that
+    # loans accruing less than a cent a day still accrue interest
+    outstanding_principal = Loan.principal_amount - Loan.principal_paid
+    exact_interest = outstanding_principal * Loan.interest_rate * days / 36500.0 + \
+        func.coalesce(Loan.interest_remainder, 0)
+    interest = cast(exact_interest, Integer)
+
+    statement = Loan.__table__.update() \
+        .where(and_(watermark <= current_time - SECONDS_PER_DAY, outstanding_principal > 0)) \
+        .values(
+            amount_accrued=Loan.amount_accrued + interest,
+            amount_due=Loan.principal_amount + Loan.amount_accrued + interest - Loan.amount_paid,
+            interest_remainder=exact_interest - interest,
+            # Only whole days are accrued, so the rest of the current day is carried over to the next run
+            last_accrued_at=watermark + days * SECONDS_PER_DAY
+        )
+
+    if loan_id is not None:
+        statement = statement.where(Loan.id == loan_id)
+
+    return statement
+
+
+# Accrues interest on every loan using a single set-based UPDATE statement
+# - Returns the number of loans that were updated
+def accrue_interest(current_time=None):
+    if current_time is None:
+        current_time = int(time.time())
+
+    result = db.session.execute(_accrual_statement(current_time))
+
+    # Amounts due have changed, so the delinquency figures used by the analytics page are recounted too
+    analytics.refresh_delinquency(current_time)
+    db.session.commit()
+
+    # Every borrower's accrued interest and amount due may have changed
+    summary.invalidate_all_summaries()
+
+    return result.rowcount
+
+
+# Accrues interest on one loan up to now, without committing (used before a payment is applied)
+def accrue_loan(loan_id):
+    db.session.execute(_accrual_statement(int(time.time()), loan_id))
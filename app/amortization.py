@@ -0,0 +1,78 @@
+import time
+
+import numpy as np
+
+from models import db, Loan
+
+'''
+Amortization schedules. Schedules are generated for many loans at once with NumPy: every loan is a row and every
+monthly payment a column, so a whole portfolio is worked out with a handful of array operations instead of a Python
+loop per loan and per month.
+
+All amounts are in cents. Each loan is paid off with equal monthly payments (the last payment absorbs rounding).
+'''
+
+SECONDS_PER_MONTH = 30.4375 * 86400
+
+
+# Number of monthly payments between two Unix times (at least one)
+def months_between(start, end):
+    return np.maximum(np.rint((np.asarray(end) - np.asarray(start)) / SECONDS_PER_MONTH), 1).astype(np.int64)
+
+
+# Generates the amortization schedules of many loans at once
+# - principals: amounts still owed (cents), annual_rates: interest rates in percent, months: number of payments
+# - Returns a dictionary of 2D arrays (one row per loan, one column per month, zero after a loan's last payment):
+#   "payment", "interest", "principal" and "balance" (the balance left after each payment), all in whole cents
+def schedule(principals, annual_rates, months):
+    principals = np.asarray(principals, dtype=np.float64)
+    monthly_rates = np.asarray(annual_rates, dtype=np.float64) / 1200.0
+    months = np.asarray(months, dtype=np.int64)
+
+    # Level monthly payment: P * r / (1 - (1 + r)^-n), or P / n for interest free loans
+    interest_free = monthly_rates == 0
+    safe_rates = np.where(interest_free, 1.0, monthly_rates)
+    payments = np.where(
+        interest_free,
+        principals / months,
+        principals * safe_rates / (1 - (1 + safe_rates) ** -months)
+    )
+
+    # Balance after k payments: P(1 + r)^k - payment * ((1 + r)^k - 1) / r (or P - payment * k with no interest)
+    k = np.arange(1, months.max() + 1 if months.size else 1)
+    growth = (1 + monthly_rates[:, None]) ** k
+    balances = np.where(
+        interest_free[:, None],
+        principals[:, None] - payments[:, None] * k,
+        principals[:, None] * growth - payments[:, None] * (growth - 1) / safe_rates[:, None]
+    )
+
+    active = k <= months[:, None]
+    balances = np.where(active, np.rint(np.maximum(balances, 0)), 0)
+    balances[np.arange(len(months)), months - 1] = 0
+
+    # Each payment covers the month's interest on the previous balance, the rest reduces the principal
+    previous_balances = np.concatenate([principals[:, None], balances[:, :-1]], axis=1)
+    principal_portions = np.where(active, previous_balances - balances, 0)
+    interest_portions = np.where(active, np.rint(previous_balances * monthly_rates[:, None]), 0)
+
+    return {
+        "payment": (principal_portions + interest_portions).astype(np.int64),
+        "interest": interest_portions.astype(np.int64),
+        "principal": principal_portions.astype(np.int64),
+        "balance": balances.astype(np.int64)
+    }
+
+
+# Generates the schedules of every loan that still has principal outstanding, from now until each loan's due date
+# - Returns the loan ids and their schedules (see schedule())
+def portfolio_schedule():
+    rows = db.session.query(Loan.id, Loan.principal_amount - Loan.principal_paid, Loan.interest_rate, Loan.date_due) \
+        .filter(Loan.principal_amount > Loan.principal_paid) \
+        .all()
+
+    if not rows:
+        return np.array([], dtype=np.int64), None
+
+    loan_ids, principals, rates, due_dates = (np.array(column) for column in zip(*rows))
+    return loan_ids, schedule(principals, rates, months_between(int(time.time()), due_dates))
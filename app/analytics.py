@@ -0,0 +1,187 @@
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
+from models import db, Pool, PoolContribution, Loan, LoanPayment, PoolStats, UserStats
+
+'''
+Portfolio analytics for bank managers. The figures are read from the pool_stats and user_stats tables, which hold
+running totals that the write paths in banking.py update in the same transaction as the money movement itself. This
+keeps the analytics page at the same cost no matter how many loans and contributions there are.
+
+Delinquency depends on the time as well as on writes, so it is refreshed by every accrual run (see accrual.py).
+If the tables ever get out of step (e.g. after a bulk import), "flask rebuild-analytics" recomputes them from scratch.
+'''
+
+
+# Adds the deltas to the row of model with the given primary key, creating the row if it does not exist yet
+def _increment(model, key_column, key, **deltas):
+    values = {getattr(model, name): getattr(model, name) + delta for name, delta in deltas.items()}
+
+    if model.query.filter(key_column == key).update(values, synchronize_session=False):
+        return
+
+    # The row does not exist yet. Another transaction may create it at the same time, in which case the insert
+    # fails and is rolled back to the savepoint, and the update is made against the row it created instead
+    try:
+        with db.session.begin_nested():
+            db.session.add(model(**{key_column.key: key}, **deltas))
+    except IntegrityError:
+        model.query.filter(key_column == key).update(values, synchronize_session=False)
+
+
+def record_pool_created(pool_id):
+    db.session.add(PoolStats(pool_id=pool_id))
+
+
+def record_contribution(user_id, pool_id, amount):
+    _increment(PoolStats, PoolStats.pool_id, int(pool_id), contributions_total=amount)
+    _increment(UserStats, UserStats.user_id, int(user_id), contribution_count=1, contributions_total=amount)
+
+
+def record_loan(pool_id, principal, count=1):
+    _increment(PoolStats, PoolStats.pool_id, int(pool_id), loan_count=count, principal_lent=principal)
+
+
+def record_payment(pool_id, principal_portion, interest_portion):
+    _increment(PoolStats, PoolStats.pool_id, int(pool_id), principal_repaid=principal_portion,
+               interest_income=interest_portion)
+
+
+# Recounts the loans past their due date in every pool (run after accrual, since amounts due change then)
+def refresh_delinquency(current_time=None):
+    if current_time is None:
+        current_time = int(time.time())
+
+    delinquent = Loan.query.filter(Loan.pool_id == PoolStats.pool_id, Loan.date_due < current_time,
+                                   Loan.amount_due > 0)
+
+    db.session.execute(
+        PoolStats.__table__.update().values(
+            delinquent_count=delinquent.with_entities(func.count(Loan.id)).as_scalar(),
+            delinquent_amount=delinquent.with_entities(func.coalesce(func.sum(Loan.amount_due), 0)).as_scalar()
+        )
+    )
+
+
+# Recomputes both tables from the loan, loan_payment and pool_contribution tables
+def rebuild():
+    PoolStats.query.delete()
+    UserStats.query.delete()
+
+    for (pool_id,) in db.session.query(Pool.id):
+        record_pool_created(pool_id)
+    db.session.flush()
+
+    contributions = db.session.query(PoolContribution.pool_id, func.sum(PoolContribution.amount)) \
+        .group_by(PoolContribution.pool_id)
+    for pool_id, total in contributions:
+        _increment(PoolStats, PoolStats.pool_id, pool_id, contributions_total=total)
+
+    loans = db.session.query(Loan.pool_id, func.count(Loan.id), func.sum(Loan.principal_amount)) \
+        .filter(Loan.pool_id.isnot(None)) \
+        .group_by(Loan.pool_id)
+    for pool_id, count, principal in loans:
+        _increment(PoolStats, PoolStats.pool_id, pool_id, loan_count=count, principal_lent=principal)
+
+    payments = db.session.query(Loan.pool_id, func.sum(LoanPayment.principal_portion),
+                                func.sum(LoanPayment.interest_portion)) \
+        .join(Loan, Loan.id == LoanPayment.loan_id) \
+        .filter(Loan.pool_id.isnot(None)) \
+        .group_by(Loan.pool_id)
+    for pool_id, principal, interest in payments:
+        _increment(PoolStats, PoolStats.pool_id, pool_id, principal_repaid=principal, interest_income=interest)
+
+    db.session.execute(
+        UserStats.__table__.insert().from_select(
+            ["user_id", "contribution_count", "contributions_total"],
+            select([PoolContribution.user_id, func.count(PoolContribution.id), func.sum(PoolContribution.amount)])
+            .group_by(PoolContribution.user_id)
+        )
+    )
+
+    refresh_delinquency()
+    db.session.commit()
+
+
+# Number of pools and contributors listed on the analytics page
+TOP_POOLS = 50
+TOP_CONTRIBUTORS = 20
+
+
+# Gathers every figure shown on the analytics page into a dictionary (which is also returned as JSON)
+def portfolio_analytics():
+    outstanding = PoolStats.principal_lent - PoolStats.principal_repaid
+
+    totals = db.session.query(
+        func.coalesce(func.sum(Pool.amount), 0),
+        func.coalesce(func.sum(outstanding), 0),
+        func.coalesce(func.sum(PoolStats.contributions_total), 0),
+        func.coalesce(func.sum(PoolStats.interest_income), 0),
+        func.coalesce(func.sum(PoolStats.delinquent_count), 0),
+        func.coalesce(func.sum(PoolStats.delinquent_amount), 0)
+    ).join(PoolStats, PoolStats.pool_id == Pool.id).one()
+
+    pools = db.session.query(Pool.id, Pool.name, Pool.category, Pool.amount, outstanding, PoolStats.loan_count,
+                             PoolStats.contributions_total, PoolStats.interest_income, PoolStats.delinquent_count,
+                             PoolStats.delinquent_amount) \
+        .join(PoolStats, PoolStats.pool_id == Pool.id) \
+        .order_by(outstanding.desc()) \
+        .limit(TOP_POOLS) \
+        .all()
+
+    categories = db.session.query(Pool.category, func.sum(Pool.amount), func.sum(outstanding),
+                                  func.sum(PoolStats.interest_income), func.sum(PoolStats.delinquent_count)) \
+        .join(PoolStats, PoolStats.pool_id == Pool.id) \
+        .group_by(Pool.category) \
+        .order_by(Pool.category) \
+        .all()
+
+    contributors = db.session.query(UserStats) \
+        .options(joinedload(UserStats.user)) \
+        .order_by(UserStats.contributions_total.desc()) \
+        .limit(TOP_CONTRIBUTORS) \
+        .all()
+
+    return {
+        "totals": {
+            "available": totals[0],
+            "outstanding_principal": totals[1],
+            "utilization": _utilization(totals[0], totals[1]),
+            "contributions": totals[2],
+            "interest_income": totals[3],
+            "delinquent_loans": totals[4],
+            "delinquent_amount": totals[5]
+        },
+        "pools": [
+            {
+                "id": row[0], "name": row[1], "category": row[2], "available": row[3],
+                "outstanding_principal": row[4], "utilization": _utilization(row[3], row[4]), "loans": row[5],
+                "contributions": row[6], "interest_income": row[7], "delinquent_loans": row[8],
+                "delinquent_amount": row[9]
+            }
+            for row in pools
+        ],
+        "categories": [
+            {
+                "category": row[0], "available": row[1], "outstanding_principal": row[2],
+                "utilization": _utilization(row[1], row[2]), "interest_income": row[3], "delinquent_loans": row[4]
+            }
+            for row in categories
+        ],
+        "contributors": [
+            {
+                "user_id": stats.user_id, "username": stats.user.username, "contributions": stats.contribution_count,
+                "contributions_total": stats.contributions_total
+            }
+            for stats in contributors
+        ]
+    }
+
+
+# Share of a pool's money which is currently lent out
+def _utilization(available, outstanding):
+    total = (available or 0) + (outstanding or 0)
+    return round(outstanding / total, 4) if total else 0
@@ -0,0 +1,420 @@
+import json
+
+from flask import Blueprint, request, current_app
+
+import banking
+import jobs
+import loan_decisions
+from auth import get_current_user
+from models import db, BankAccount, Pool, Loan, LoanRequest
+from summary import get_user_summary
+
+'''
+Versioned JSON API covering the same operations as the form routes in forms.py, for clients that would otherwise have
+to post forms and scrape the flashed messages out of the page they are redirected to.
+
+- The API uses the same login session as the site (log in through /attempt_login first)
+- Amounts of money are sent and returned as whole numbers of cents (see money.py); dates are unix times
+- Errors are returned as {"error": "..."} with a 4xx status instead of being flashed
+- Responses are serialized without whitespace
+- Read endpoints send an ETag, so clients that send it back in If-None-Match get an empty 304 when nothing changed
+- POST /api/v1/batch applies a list of operations in one transaction: either all of them are made or none are
+'''
+
+# Register the blueprint for this file
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+# Maximum number of operations accepted by a single batch request
+MAX_BATCH_OPERATIONS = 1000
+
+# Number of items returned by each page of the paged read endpoints
+PAGE_SIZE = 100
+
+
+# Raised by the handlers below; the message is returned to the client with the given HTTP status
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# Serializes data as compact JSON (jsonify indents its output when the app is in debug mode)
+def _json_response(data, status=200):
+    body = json.dumps(data, separators=(",", ":"))
+    return current_app.response_class(body, status=status, mimetype="application/json")
+
+
+# Serializes the result of a read endpoint and answers with 304 Not Modified if the client already has it
+def _conditional_response(data):
+    response = _json_response(data)
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@api.errorhandler(ApiError)
+def handle_api_error(error):
+    return _json_response({"error": str(error)}, error.status)
+
+
+@api.errorhandler(banking.BankingError)
+def handle_banking_error(error):
+    db.session.rollback()
+    return _json_response({"error": str(error)}, 409)
+
+
+# Returns the logged in user, or stops the request with 401 (or 403 if a bank manager is needed and they are not one)
+def _require_user(bank_manager=False):
+    user = get_current_user()
+    if user is None:
+        raise ApiError("You must be logged in.", 401)
+    if bank_manager and not user.is_bank_manager:
+        raise ApiError("You must be a bank manager.", 403)
+    return user
+
+
+# Returns the JSON object sent with the request
+def _json_body():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise ApiError("The request body must be a JSON object.")
+    return body
+
+
+# Returns a required whole number from params; positive=True also rejects zero and negative numbers
+def _int_param(params, name, positive=False):
+    value = params.get(name)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ApiError("'" + name + "' must be a whole number.")
+    if positive and value <= 0:
+        raise ApiError("'" + name + "' must be greater than zero.")
+    return value
+
+
+# Returns a required, non-empty list of whole numbers from params
+def _int_list_param(params, name):
+    values = params.get(name)
+    if not isinstance(values, list) or not values or \
+            not all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        raise ApiError("'" + name + "' must be a list of whole numbers.")
+    if len(values) > MAX_BATCH_OPERATIONS:
+        raise ApiError("'" + name + "' may contain at most " + str(MAX_BATCH_OPERATIONS) + " items.", 413)
+    return values
+
+
+# Returns the optional "interest_rate" from params (a percentage, 2 if it is not given)
+# - The rate is held to the same bounds as on the forms (see banking.is_valid_interest_rate)
+def _interest_rate_param(params):
+    interest_rate = params.get("interest_rate", 2)
+    if isinstance(interest_rate, bool) or not isinstance(interest_rate, (int, float)) or \
+            not banking.is_valid_interest_rate(interest_rate):
+        raise ApiError("'interest_rate' must be a number from " + str(banking.MIN_INTEREST_RATE) + " to " +
+                       str(banking.MAX_INTEREST_RATE) + " with at most two decimal places.")
+    return float(interest_rate)
+
+
+# Returns a required non-blank string from params
+def _str_param(params, name):
+    value = params.get(name)
+    if not isinstance(value, str) or not value.strip():
+        raise ApiError("'" + name + "' must not be blank.")
+    return value
+
+
+def _bank_account_dict(bank_account):
+    return {"id": bank_account.id, "name": bank_account.account_name, "number": bank_account.account_number,
+            "balance": bank_account.balance}
+
+
+def _pool_dict(pool):
+    return {"id": pool.id, "name": pool.name, "category": pool.category, "amount": pool.amount}
+
+
+def _loan_dict(loan):
+    return {"id": loan.id, "pool_id": loan.pool_id, "principal": loan.principal_amount,
+            "amount_paid": loan.amount_paid, "amount_due": loan.amount_due, "date_due": loan.date_due,
+            "interest_rate": loan.interest_rate}
+
+
+def _loan_request_dict(loan_request):
+    return {"id": loan_request.id, "user_id": loan_request.user_id, "bank_account_id": loan_request.account_id,
+            "pool_id": loan_request.pool_id, "amount": loan_request.amount}
+
+
+'''
+Operations. Each takes the logged in user and the operation's parameters, makes its changes without committing and
+returns the result to send back. They are shared by the single operation endpoints and the batch endpoint.
+'''
+
+
+def _contribute(user, params):
+    pool_id = _int_param(params, "pool_id")
+    amount = _int_param(params, "amount", positive=True)
+    banking.contribute_to_pool(user.id, _int_param(params, "bank_account_id"), pool_id, amount)
+    return {"pool_id": pool_id, "amount": amount}
+
+
+def _request_loan(user, params):
+    bank_account_id = _int_param(params, "bank_account_id")
+    pool_id = _int_param(params, "pool_id")
+    amount = _int_param(params, "amount", positive=True)
+
+    if not BankAccount.query.filter_by(id=bank_account_id, user_id=user.id).count():
+        raise ApiError("That bank account does not exist.", 404)
+
+    pool_amount = Pool.query.with_entities(Pool.amount).filter(Pool.id == pool_id).scalar()
+    if pool_amount is None:
+        raise ApiError("That loan pool does not exist.", 404)
+    if amount > pool_amount:
+        raise ApiError("You attempted to request more than the loan pool contains.", 409)
+
+    loan_request = LoanRequest(user.id, bank_account_id, pool_id, amount)
+    db.session.add(loan_request)
+    db.session.flush()
+
+    if current_app.config["LOAN_DECISION_QUEUE"]:
+        try:
+            loan_decisions.queue_decision(loan_request.id)
+        except jobs.QueueFull:
+            raise ApiError("Too many loan requests are waiting to be decided - please try again later.", 503)
+
+    return _loan_request_dict(loan_request)
+
+
+def _approve_loan_request(user, params):
+    loan = banking.approve_loan_request(_int_param(params, "loan_request_id"), _interest_rate_param(params),
+                                        _int_param(params, "date_due"))
+    db.session.flush()
+    return _loan_dict(loan)
+
+
+def _deny_loan_request(user, params):
+    loan_request_id = _int_param(params, "loan_request_id")
+    if not LoanRequest.query.filter(LoanRequest.id == loan_request_id).delete(synchronize_session=False):
+        raise ApiError("That loan request has already been handled.", 409)
+    return {"loan_request_id": loan_request_id}
+
+
+# Approves every request in "loan_request_ids" with the same interest rate and due date
+def _approve_loan_requests(user, params):
+    loan_request_ids = _int_list_param(params, "loan_request_ids")
+    interest_rate = _interest_rate_param(params)
+    approved = banking.approve_loan_requests(loan_request_ids, interest_rate, _int_param(params, "date_due"))
+    return {"approved": approved}
+
+
+def _deny_loan_requests(user, params):
+    return {"denied": banking.deny_loan_requests(_int_list_param(params, "loan_request_ids"))}
+
+
+def _deposit(user, params):
+    bank_account_id = _int_param(params, "bank_account_id")
+    amount = _int_param(params, "amount", positive=True)
+
+    if not BankAccount.query.filter_by(id=bank_account_id, user_id=user.id).count():
+        raise ApiError("That bank account does not exist.", 404)
+
+    banking.deposit(bank_account_id, amount)
+    return {"bank_account_id": bank_account_id, "amount": amount}
+
+
+def _pay_loan(user, params):
+    amount = _int_param(params, "amount", positive=True)
+    payment = banking.make_loan_payment(user.id, _int_param(params, "loan_id"), _int_param(params, "bank_account_id"),
+                                        amount)
+    return {"loan_id": payment.loan_id, "amount": amount, "interest_portion": payment.interest_portion,
+            "principal_portion": payment.principal_portion}
+
+
+def _create_bank_account(user, params):
+    bank_account = BankAccount(user.id, _str_param(params, "name"), 0)
+    db.session.add(bank_account)
+    db.session.flush()
+    return _bank_account_dict(bank_account)
+
+
+def _create_pool(user, params):
+    amount = params.get("amount", 0)
+    if isinstance(amount, bool) or not isinstance(amount, int) or amount < 0:
+        raise ApiError("'amount' must be a whole number of at least zero.")
+
+    pool = banking.create_pool(_str_param(params, "name"), _str_param(params, "category"), amount)
+    return _pool_dict(pool)
+
+
+# Operation name -> (function, whether a bank manager is needed)
+OPERATIONS = {
+    "contribute": (_contribute, False),
+    "request_loan": (_request_loan, False),
+    "approve_loan_request": (_approve_loan_request, True),
+    "deny_loan_request": (_deny_loan_request, True),
+    "approve_loan_requests": (_approve_loan_requests, True),
+    "deny_loan_requests": (_deny_loan_requests, True),
+    "deposit": (_deposit, False),
+    "pay_loan": (_pay_loan, False),
+    "create_bank_account": (_create_bank_account, False),
+    "create_pool": (_create_pool, True)
+}
+
+
+# Runs one or more operations in a single transaction and commits them
+# - If any of them fails, everything is rolled back and the error is raised (with the index of the failed operation
+#   when there is more than one)
+def _run_operations(operations):
+    user = _require_user()
+
+    results = []
+    for index, (name, params) in enumerate(operations):
+        try:
+            if name not in OPERATIONS:
+                raise ApiError("Unknown operation '" + str(name) + "'.")
+
+            function, bank_manager = OPERATIONS[name]
+            if bank_manager:
+                _require_user(bank_manager=True)
+
+            results.append(function(user, params))
+        except (ApiError, banking.BankingError) as error:
+            db.session.rollback()
+            if len(operations) > 1:
+                error.args = ("Operation " + str(index) + ": " + str(error),)
+            raise
+
+    db.session.commit()
+
+    # A new pool may have added a new category, so the cached category list has to be rebuilt
+    if any(name == "create_pool" for name, params in operations):
+        Pool.invalidate_categories()
+
+    return results
+
+
+# Runs a single operation with the parameters from the request body (plus any taken from the URL)
+def _run_operation(name, **url_params):
+    params = _json_body()
+    params.update(url_params)
+    result, = _run_operations([(name, params)])
+    return _json_response(result, 201)
+
+
+# Applies {"operations": [{"op": "<name>", ...parameters}, ...]} in one transaction
+# - Returns {"results": [...]} in the same order as the operations
+@api.route("/batch", methods=["POST"])
+def batch():
+    operations = _json_body().get("operations")
+    if not isinstance(operations, list) or not operations or not all(isinstance(op, dict) for op in operations):
+        raise ApiError("'operations' must be a list of objects.")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise ApiError("A batch may contain at most " + str(MAX_BATCH_OPERATIONS) + " operations.", 413)
+
+    results = _run_operations([(op.get("op"), op) for op in operations])
+    return _json_response({"results": results})
+
+
+@api.route("/contributions", methods=["POST"])
+def create_contribution():
+    return _run_operation("contribute")
+
+
+@api.route("/loan_requests", methods=["POST"])
+def create_loan_request():
+    return _run_operation("request_loan")
+
+
+@api.route("/loan_requests/<int:loan_request_id>/approve", methods=["POST"])
+def approve_loan_request(loan_request_id):
+    return _run_operation("approve_loan_request", loan_request_id=loan_request_id)
+
+
+@api.route("/loan_requests/<int:loan_request_id>/deny", methods=["POST"])
+def deny_loan_request(loan_request_id):
+    return _run_operation("deny_loan_request", loan_request_id=loan_request_id)
+
+
+# Approves {"loan_request_ids": [...], "date_due": ..., "interest_rate": ...} in one transaction
+@api.route("/loan_requests/approve", methods=["POST"])
+def approve_loan_requests():
+    return _run_operation("approve_loan_requests")
+
+
+@api.route("/loan_requests/deny", methods=["POST"])
+def deny_loan_requests():
+    return _run_operation("deny_loan_requests")
+
+
+@api.route("/accounts", methods=["POST"])
+def create_bank_account():
+    return _run_operation("create_bank_account")
+
+
+@api.route("/accounts/<int:bank_account_id>/deposits", methods=["POST"])
+def create_deposit(bank_account_id):
+    return _run_operation("deposit", bank_account_id=bank_account_id)
+
+
+@api.route("/loans/<int:loan_id>/payments", methods=["POST"])
+def create_loan_payment(loan_id):
+    return _run_operation("pay_loan", loan_id=loan_id)
+
+
+@api.route("/pools", methods=["POST"])
+def create_pool():
+    return _run_operation("create_pool")
+
+
+# Read endpoints
+
+
+@api.route("/accounts")
+def list_bank_accounts():
+    user = _require_user()
+    bank_accounts = BankAccount.query.filter_by(user_id=user.id).order_by(BankAccount.id)
+    return _conditional_response({"accounts": [_bank_account_dict(account) for account in bank_accounts]})
+
+
+@api.route("/loans")
+def list_loans():
+    user = _require_user()
+    loans = Loan.query.filter_by(user_id=user.id).order_by(Loan.id)
+    return _conditional_response({"loans": [_loan_dict(loan) for loan in loans]})
+
+
+@api.route("/summary")
+def user_summary():
+    user = _require_user()
+    return _conditional_response(get_user_summary(user.id))
+
+
+# Pools in id order, optionally filtered by ?category=
+# - Pages are fetched with ?after=<last id of the previous page>; "next" is null on the last page
+@api.route("/pools")
+def list_pools():
+    _require_user()
+
+    query = Pool.query.order_by(Pool.id)
+    if request.args.get("category"):
+        query = query.filter(Pool.category == request.args["category"])
+    if request.args.get("after", type=int) is not None:
+        query = query.filter(Pool.id > request.args.get("after", type=int))
+
+    pools = query.limit(PAGE_SIZE + 1).all()
+    next_after = pools[PAGE_SIZE - 1].id if len(pools) > PAGE_SIZE else None
+
+    return _conditional_response({"pools": [_pool_dict(pool) for pool in pools[:PAGE_SIZE]],
+                                  "next": next_after})
+
+
+# Open loan requests in id order, for bank managers; paged in the same way as /pools
+@api.route("/loan_requests")
+def list_loan_requests():
+    _require_user(bank_manager=True)
+
+    query = LoanRequest.query.order_by(LoanRequest.id)
+    if request.args.get("after", type=int) is not None:
+        query = query.filter(LoanRequest.id > request.args.get("after", type=int))
+
+    loan_requests = query.limit(PAGE_SIZE + 1).all()
+    next_after = loan_requests[PAGE_SIZE - 1].id if len(loan_requests) > PAGE_SIZE else None
+
+    return _conditional_response({"loan_requests": [_loan_request_dict(lr) for lr in loan_requests[:PAGE_SIZE]],
+                                  "next": next_after})
@@ -0,0 +1,26 @@
+from a2wsgi import WSGIMiddleware
+
+from __init__ import create_app
+
+'''
+ASGI serving mode. The app itself stays a synchronous Flask (WSGI) app; this wraps it in an ASGI application which
+runs each request on a pool of ASGI_THREADS threads, so that one worker process has that many requests in flight
+instead of one. A request waiting on something other than the Python interpreter, such as bcrypt (see passwords.py),
+a SQLite lock or a server database, only holds up its own thread, while the event loop goes on accepting connections
+and sending responses. It needs the "a2wsgi" package and an ASGI server such as uvicorn (both in requirements.txt):
+
+    WEB_CONCURRENCY=4 uvicorn --factory asgi:create_asgi_app
+
+(uvicorn takes its number of worker processes from WEB_CONCURRENCY, and so does the app's cache, see cache.py.)
+
+Every thread can hold a database connection at once, so with a server database DATABASE_POOL_SIZE and
+DATABASE_MAX_OVERFLOW should add up to at least ASGI_THREADS (see database.py). "flask benchmark concurrency" compares
+this mode with one request at a time per process (like a synchronous WSGI worker).
+'''
+
+
+# Returns the ASGI application serving the given Flask app, or a new one
+def create_asgi_app(app=None, threads=None):
+    if app is None:
+        app = create_app()
+    return WSGIMiddleware(app, workers=threads or app.config["ASGI_THREADS"])
@@ -0,0 +1,151 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import with_appcontext
+
+'''
+Fingerprinted, precompressed static assets.
+
+Usage:
+    flask assets build        run after changing anything in static/, e.g. as part of deploying
+
+"assets build" copies every file in static/ to static/build/, adding a hash of its content to its name (e.g.
+styles/style.3f2a9c0d1e4b.css), and writes a gzip and, if the optional "brotli" package is installed, a brotli
+compressed copy next to it. It also writes static/build/manifest.json, which maps each file's name to its
+fingerprinted name.
+
+Templates link to assets with asset_url(filename) instead of url_for('static', filename=filename). Once the manifest
+exists, asset_url returns the fingerprinted file's URL under /assets/. These files are served with the precompressed
+copy that the browser accepts (brotli, then gzip), and with headers telling the browser to cache them for a year
+without checking back. A changed file gets a new name, so the browser fetches it on the next page view. Without a
+manifest, or with FINGERPRINTED_ASSETS turned off, asset_url falls back to Flask's static route.
+'''
+
+BUILD_DIRECTORY = "build"
+MANIFEST_FILE = "manifest.json"
+
+# Suffixes of the precompressed copies, in the order they are preferred -> Content-Encoding they are served with
+ENCODINGS = ((".br", "br"), (".gz", "gzip"))
+
+# Text files are worth compressing; images and fonts are already compressed
+COMPRESSED_EXTENSIONS = {".css", ".js", ".svg", ".json", ".txt", ".html"}
+
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Source file name -> fingerprinted file name, loaded from the manifest by init_app()
+_manifest = {}
+
+
+def _build_directory(app):
+    return os.path.join(app.static_folder, BUILD_DIRECTORY)
+
+
+def _fingerprinted_name(name, content):
+    root, extension = os.path.splitext(name)
+    return root + "." + hashlib.sha256(content).hexdigest()[:12] + extension
+
+
+# Writes the fingerprinted and compressed copy of every static file and the manifest, and returns the manifest
+def build(app):
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    build_directory = _build_directory(app)
+    shutil.rmtree(build_directory, ignore_errors=True)
+
+    manifest = {}
+    for directory, directory_names, file_names in os.walk(app.static_folder):
+        if os.path.abspath(directory) == os.path.abspath(build_directory):
+            directory_names.clear()
+            continue
+
+        for file_name in sorted(file_names):
+            path = os.path.join(directory, file_name)
+            name = os.path.relpath(path, app.static_folder).replace(os.sep, "/")
+            with open(path, "rb") as file:
+                content = file.read()
+
+            fingerprinted = manifest[name] = _fingerprinted_name(name, content)
+            output = os.path.join(build_directory, fingerprinted)
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            with open(output, "wb") as file:
+                file.write(content)
+
+            if os.path.splitext(name)[1] not in COMPRESSED_EXTENSIONS:
+                continue
+            # mtime=0 keeps the gzip output the same from one build to the next
+            with open(output + ".gz", "wb") as file:
+                file.write(gzip.compress(content, compresslevel=9, mtime=0))
+            if brotli is not None:
+                with open(output + ".br", "wb") as file:
+                    file.write(brotli.compress(content))
+
+    with open(os.path.join(build_directory, MANIFEST_FILE), "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return manifest
+
+
+# Loads the manifest written by build() and returns it (empty if the assets have not been built)
+def load_manifest(app):
+    global _manifest
+    try:
+        with open(os.path.join(_build_directory(app), MANIFEST_FILE)) as file:
+            _manifest = json.load(file)
+    except FileNotFoundError:
+        _manifest = {}
+    return _manifest
+
+
+# Returns the URL of a static file, fingerprinted if the assets have been built
+def asset_url(filename):
+    fingerprinted = _manifest.get(filename)
+    if fingerprinted is None or not current_app.config.get("FINGERPRINTED_ASSETS", True):
+        return url_for("static", filename=filename)
+    return url_for("asset", filename=fingerprinted)
+
+
+# Serves a fingerprinted file, precompressed if the browser accepts one of the encodings it was compressed with
+def asset_view(filename):
+    build_directory = _build_directory(current_app)
+
+    for suffix, encoding in ENCODINGS:
+        if encoding in request.accept_encodings and os.path.isfile(os.path.join(build_directory, filename + suffix)):
+            # The content type is that of the original file rather than of the compressed copy
+            response = send_from_directory(build_directory, filename + suffix,
+                                           mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream")
+            response.headers["Content-Encoding"] = encoding
+            break
+    else:
+        response = send_from_directory(build_directory, filename)
+
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+@click.group()
+def assets():
+    """Static asset pipeline (see assets.py)."""
+
+
+@assets.command("build")
+@with_appcontext
+def build_command():
+    manifest = build(current_app)
+    load_manifest(current_app)
+    for name, fingerprinted in sorted(manifest.items()):
+        click.echo(name + " -> " + fingerprinted)
+
+
+def init_app(app):
+    load_manifest(app)
+    app.add_url_rule("/assets/<path:filename>", "asset", asset_view)
+    app.add_template_global(asset_url)
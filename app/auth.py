@@ -0,0 +1,50 @@
+from functools import wraps
+
+from flask import g, session, redirect, url_for
+
+from models import User
+
+'''
+Helpers shared by the routes and forms for working with the logged in user.
+'''
+
+
+# Returns the model of the logged in user, or None if nobody is logged in
+# - The user is only queried once per request and then kept on flask.g, so the decorators below and the view itself
+#   share the same model instance
+# - Loader options (e.g. joinedload(User.bank_accounts)) can be passed to load the relationships a view needs in the
+#   same round trip; they only have an effect on the first call in a request
+def get_current_user(*options):
+    if "current_user" not in g:
+        if "user_id" in session:
+            g.current_user = User.query.options(*options).filter_by(id=session["user_id"]).first()
+        else:
+            g.current_user = None
+
+    return g.current_user
+
+
+# Decorator: checks if the user is logged in before allowing them access to a page which requires login
+def login_required(f):
+    @wraps(f)
+    def wrap(*args, **kwargs):
+        if "logged_in" in session:
+            return f(*args, **kwargs)
+        else:
+            return redirect(url_for("main.login"))
+
+    return wrap
+
+
+# Decorator: checks if the user is a bank manager before allowing them access to a page which requires bank
+#            manager status
+def bank_manager_required(f):
+    @wraps(f)
+    def wrap(*args, **kwargs):
+        user = get_current_user()
+        if user and user.is_bank_manager:
+            return f(*args, **kwargs)
+        else:
+            return redirect(url_for("main.index"))
+
+    return wrap
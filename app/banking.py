@@ -0,0 +1,253 @@
+from sqlalchemy import bindparam
+
+import accrual
+import analytics
+import ledger
+import summary
+from models import db, BankAccount, Pool, PoolContribution, LoanRequest, Loan, LoanPayment
+
+'''
+Money movements. Every balance change is made with a single UPDATE statement which does the arithmetic in the
+database (e.g. "balance = balance - :amount") and, where money is taken out, only matches the row if it still holds
+enough (e.g. "WHERE balance >= :amount"). This means two requests running at the same time can never overwrite each
+other's changes or take an account below zero, without having to lock rows while Python works out the new values.
+
+Every movement is also written to the double-entry ledger (see ledger.py), after the balance rows it touches have
+been updated.
+
+The running totals used by the analytics page (see analytics.py) are updated in the same transaction.
+
+Every user whose money is moved is marked with summary.mark_user_changed() so that their cached dashboard summary is
+dropped once the change is committed.
+
+These functions do not commit. The caller commits once all of the movements it needs have been made, so they all
+happen in one transaction, or rolls back if a BankingError is raised.
+'''
+
+
+# Raised when a money movement cannot be made; the message is suitable for showing to the user
+class BankingError(Exception):
+    pass
+
+
+# Interest rates (percentages) a loan can be approved with; the forms and the API both check rates against these
+MIN_INTEREST_RATE = 1
+MAX_INTEREST_RATE = 100
+
+
+# Checks if a loan can be approved with the interest rate: within the bounds above, to at most two decimal places
+def is_valid_interest_rate(interest_rate):
+    return MIN_INTEREST_RATE <= interest_rate <= MAX_INTEREST_RATE and round(interest_rate, 2) == interest_rate
+
+
+# Adds funds to a bank account (without writing to the ledger)
+def _credit_bank_account(bank_account_id, amount):
+    user_id = BankAccount.query.with_entities(BankAccount.user_id).filter(BankAccount.id == bank_account_id).scalar()
+    if user_id is None:
+        raise BankingError("That bank account does not exist.")
+
+    BankAccount.query.filter(BankAccount.id == bank_account_id) \
+        .update({BankAccount.balance: BankAccount.balance + amount}, synchronize_session=False)
+
+    summary.mark_user_changed(user_id)
+
+
+# Adds funds from outside of the bank to a bank account
+def deposit(bank_account_id, amount):
+    _credit_bank_account(bank_account_id, amount)
+    ledger.record_transfer((ledger.EXTERNAL, 0), (ledger.BANK_ACCOUNT, int(bank_account_id)), amount, "Deposit")
+
+
+# Takes funds out of a bank account, as long as the account has enough in it (without writing to the ledger)
+# - The account must also belong to the user; error_message is used if the account cannot be debited
+def _debit_bank_account(bank_account_id, amount, user_id, error_message):
+    query = BankAccount.query.filter(BankAccount.id == bank_account_id, BankAccount.balance >= amount,
+                                     BankAccount.user_id == user_id)
+
+    updated = query.update({BankAccount.balance: BankAccount.balance - amount}, synchronize_session=False)
+
+    if not updated:
+        raise BankingError(error_message)
+
+
+# Moves funds from a user's bank account into a loan pool and records the contribution
+def contribute_to_pool(user_id, bank_account_id, pool_id, amount):
+    _debit_bank_account(bank_account_id, amount, user_id,
+                        "You attempted to contribute more than you have in your bank account!")
+
+    updated = Pool.query.filter(Pool.id == pool_id) \
+        .update({Pool.amount: Pool.amount + amount}, synchronize_session=False)
+
+    if not updated:
+        raise BankingError("That loan pool does not exist.")
+
+    ledger.record_transfer((ledger.BANK_ACCOUNT, int(bank_account_id)), (ledger.POOL, int(pool_id)), amount,
+                           "Pool contribution")
+
+    db.session.add(PoolContribution(user_id, pool_id, amount))
+    analytics.record_contribution(user_id, pool_id, amount)
+    summary.mark_user_changed(user_id)
+
+
+# Approves a loan request: the amount is taken out of the pool and paid into the bank account the requester chose,
+# a loan is created for the requester and the loan request is removed
+# - Deleting the request is conditional too, so the same request can never be approved twice
+def approve_loan_request(loan_request_id, interest_rate, due_date):
+    loan_request = LoanRequest.query.filter_by(id=loan_request_id).first()
+    if not loan_request:
+        raise BankingError("That loan request has already been handled.")
+
+    deleted = LoanRequest.query.filter(LoanRequest.id == loan_request.id).delete(synchronize_session=False)
+    if not deleted:
+        raise BankingError("That loan request has already been handled.")
+
+    updated = Pool.query.filter(Pool.id == loan_request.pool_id, Pool.amount >= loan_request.amount) \
+        .update({Pool.amount: Pool.amount - loan_request.amount}, synchronize_session=False)
+
+    if not updated:
+        raise BankingError("The loan pool does not contain enough to approve this loan.")
+
+    _credit_bank_account(loan_request.account_id, loan_request.amount)
+    ledger.record_transfer((ledger.POOL, loan_request.pool_id), (ledger.BANK_ACCOUNT, loan_request.account_id),
+                           loan_request.amount, "Loan")
+
+    loan = Loan(loan_request.user_id, loan_request.amount, loan_request.amount, due_date, interest_rate,
+                loan_request.pool_id)
+    db.session.add(loan)
+    analytics.record_loan(loan_request.pool_id, loan_request.amount)
+    summary.mark_user_changed(loan_request.user_id)
+
+    return loan
+
+
+# Approves many loan requests at once with the same interest rate and due date, in a fixed number of statements
+# rather than a few per request
+# - Every request must still be open and every pool must hold enough for all of the requests made against it;
+#   otherwise a BankingError is raised and nothing should be committed
+# - Returns the number of loans created
+def approve_loan_requests(loan_request_ids, interest_rate, due_date):
+    loan_request_ids = set(int(loan_request_id) for loan_request_id in loan_request_ids)
+    loan_requests = LoanRequest.query.filter(LoanRequest.id.in_(loan_request_ids)).all()
+
+    deleted = LoanRequest.query.filter(LoanRequest.id.in_(loan_request_ids)).delete(synchronize_session=False)
+    if len(loan_requests) != len(loan_request_ids) or deleted != len(loan_request_ids):
+        raise BankingError("One or more of those loan requests have already been handled.")
+
+    pool_totals = {}
+    pool_counts = {}
+    account_totals = {}
+    for loan_request in loan_requests:
+        pool_totals[loan_request.pool_id] = pool_totals.get(loan_request.pool_id, 0) + loan_request.amount
+        pool_counts[loan_request.pool_id] = pool_counts.get(loan_request.pool_id, 0) + 1
+        account_totals[loan_request.account_id] = account_totals.get(loan_request.account_id, 0) + loan_request.amount
+
+    # Each pool is debited once with the total of its requests, and only if it holds enough for all of them
+    for pool_id, total in pool_totals.items():
+        updated = Pool.query.filter(Pool.id == pool_id, Pool.amount >= total) \
+            .update({Pool.amount: Pool.amount - total}, synchronize_session=False)
+
+        if not updated:
+            raise BankingError("The loan pool does not contain enough to approve these loans.")
+
+    owners = dict(BankAccount.query.with_entities(BankAccount.id, BankAccount.user_id)
+                  .filter(BankAccount.id.in_(account_totals)))
+    if len(owners) != len(account_totals):
+        raise BankingError("That bank account does not exist.")
+
+    # Credits every bank account in one executemany round trip
+    bank_account = BankAccount.__table__
+    db.session.execute(
+        bank_account.update().where(bank_account.c.id == bindparam("account_id"))
+        .values(balance=bank_account.c.balance + bindparam("amount")),
+        [{"account_id": account_id, "amount": total} for account_id, total in account_totals.items()]
+    )
+
+    ledger.record_transfers([((ledger.POOL, loan_request.pool_id), (ledger.BANK_ACCOUNT, loan_request.account_id),
+                              loan_request.amount, "Loan") for loan_request in loan_requests])
+
+    db.session.bulk_insert_mappings(Loan, [{
+        "user_id": loan_request.user_id,
+        "pool_id": loan_request.pool_id,
+        "principal_amount": loan_request.amount,
+        "amount_due": loan_request.amount,
+        "date_due": due_date,
+        "interest_rate": interest_rate
+    } for loan_request in loan_requests])
+
+    for pool_id, total in pool_totals.items():
+        analytics.record_loan(pool_id, total, pool_counts[pool_id])
+
+    for user_id in set(owners.values()) | set(loan_request.user_id for loan_request in loan_requests):
+        summary.mark_user_changed(user_id)
+
+    return len(loan_requests)
+
+
+# Denies many loan requests at once by deleting them
+# - Returns the number of requests that were still open
+def deny_loan_requests(loan_request_ids):
+    ids = [int(loan_request_id) for loan_request_id in loan_request_ids]
+    return LoanRequest.query.filter(LoanRequest.id.in_(ids)).delete(synchronize_session=False)
+
+
+# Creates a new loan pool; its starting amount is recorded in the ledger as money entering the bank
+def create_pool(name, category, amount):
+    pool = Pool(name, category, amount)
+    db.session.add(pool)
+    db.session.flush()
+    analytics.record_pool_created(pool.id)
+
+    if amount:
+        ledger.record_transfer((ledger.EXTERNAL, 0), (ledger.POOL, pool.id), amount, "Opening balance")
+
+    return pool
+
+
+# Pays towards a loan from one of the borrower's bank accounts
+# - Interest is accrued up to now first, then the payment goes towards the interest owed before the principal
+# - The payment is paid back into the pool the loan was taken from
+# - The loan is only updated if no other payment was applied since it was read, so two payments made at the same
+#   time cannot both be split against the same interest
+def make_loan_payment(user_id, loan_id, bank_account_id, amount):
+    accrual.accrue_loan(loan_id)
+
+    loan = Loan.query.populate_existing().filter_by(id=loan_id, user_id=user_id).first()
+    if not loan:
+        raise BankingError("That loan does not exist.")
+
+    if amount > loan.amount_due:
+        raise BankingError("You attempted to pay more than you owe on this loan.")
+
+    interest_owed = loan.amount_accrued - (loan.amount_paid - loan.principal_paid)
+    interest_portion = min(amount, interest_owed)
+    principal_portion = amount - interest_portion
+
+    _debit_bank_account(bank_account_id, amount, user_id,
+                        "You do not have enough in your bank account to make this payment.")
+
+    updated = Loan.query.filter(Loan.id == loan.id, Loan.amount_paid == loan.amount_paid) \
+        .update({
+            Loan.amount_paid: Loan.amount_paid + amount,
+            Loan.principal_paid: Loan.principal_paid + principal_portion,
+            Loan.amount_due: Loan.amount_due - amount
+        }, synchronize_session=False)
+
+    if not updated:
+        raise BankingError("Another payment was made on this loan at the same time - please try again.")
+
+    if loan.pool_id is not None:
+        Pool.query.filter(Pool.id == loan.pool_id) \
+            .update({Pool.amount: Pool.amount + amount}, synchronize_session=False)
+        analytics.record_payment(loan.pool_id, principal_portion, interest_portion)
+        destination = (ledger.POOL, loan.pool_id)
+    else:
+        # Loans approved before loans were linked to pools are paid back out of the bank
+        destination = (ledger.EXTERNAL, 0)
+
+    ledger.record_transfer((ledger.BANK_ACCOUNT, int(bank_account_id)), destination, amount, "Loan payment")
+
+    payment = LoanPayment(loan.id, bank_account_id, amount, interest_portion, principal_portion)
+    db.session.add(payment)
+    summary.mark_user_changed(user_id)
+
+    return payment
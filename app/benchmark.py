@@ -0,0 +1,1157 @@
+import asyncio
+import contextvars
+import json
+import multiprocessing
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import click
+import numpy
+from flask import current_app, render_template, request
+from flask.cli import with_appcontext
+from flask.sessions import SecureCookieSessionInterface
+from sqlalchemy import func
+
+import analytics
+import assets
+import cache
+import ledger
+import sessions
+import synthetic_data
+from accrual import accrue_interest
+from models import db, User, BankAccount, Pool, PoolContribution, Loan, LedgerEntry, BalanceSnapshot
+
+'''
+Benchmarks and load tests, run in-process with Flask's test client so that only the app and the database are measured.
+They create their own data, so point DATABASE_URL at a scratch database (and create its schema with "flask init-db")
+before running them.
+
+Usage:
+    flask benchmark generate --users 10000 --pools 500        fills the database with synthetic data
+    flask benchmark run --requests 500 --processes 4          drives the main routes and reports their latency
+    flask benchmark run --save-baseline baseline.json         ... and keeps the results to compare against later
+    flask benchmark run --baseline baseline.json              ... and fails if any route has got slower
+    flask benchmark api --operations 500 --batch-size 100     compares the JSON API with the form routes
+    flask benchmark render --pools 10000                      times the pool browser template with and without caching
+    flask benchmark assets                                    measures what a page view downloads, before and after
+                                                              "flask assets build"
+    flask benchmark session --requests 5000                   compares the per-request cost of each session backend
+    flask benchmark concurrency --clients 32 --threads 1 --threads 32
+                                                              compares one request in flight per process with the
+                                                              ASGI serving mode (see asgi.py)
+    flask benchmark startup --runs 5                          times starting a new process up to its first response
+    flask benchmark accrual --loans 10000 --loans 100000      compares accruing interest one loan at a time (as the
+                                                              dashboard used to) with the batch accrual engine
+    flask benchmark pools --pools 50000                       times listing and filtering pools in Python (as the pool
+                                                              browser used to) and in SQL, and the pool browser page
+    flask benchmark login --rounds 10 --rounds 12             compares sign-up and login throughput for each bcrypt
+                                                              work factor and number of threads sending requests
+    flask benchmark writes --threads 8                        compares concurrent pool contributions under each SQLite
+                                                              journal mode and synchronous setting
+    flask benchmark ledger --rows 10000000                    times balances and statements read from a ledger of that
+                                                              many entries
+    flask benchmark money --rows 1000000                      compares adding up money as integer cents and as floating
+                                                              point dollars
+    flask benchmark analytics --rows 1000000                  compares the analytics read from running totals with the
+                                                              same figures worked out by GROUP BY
+
+"run" needs the synthetic users created by "generate". Each of its worker processes logs in as a synthetic user and
+sends the given number of requests to each route, timing every request. It reports the 50th, 95th and 99th percentile
+latencies and the throughput of every route. A baseline file holds these figures from an earlier run; a route has
+regressed when its 95th percentile latency is more than --tolerance higher, or its throughput more than --tolerance
+lower, than in the baseline. Results depend on the machine, so baselines should be recorded on the machine they are
+compared on.
+'''
+
+
+@click.group()
+def benchmark():
+    """Benchmarks and load tests (see benchmark.py)."""
+
+
+# Signs up a new bank manager with funds to spend and a pool to spend them on, and returns the pool's id
+def _set_up_client(client):
+    username = "benchmark-" + uuid.uuid4().hex[:12]
+    client.post("/attempt_sign_up", data={"first_name_input": "Bench", "last_name_input": "Mark",
+                                          "username_input": username, "password_input": username})
+    client.get("/adminify")
+
+    bank_account = client.get("/api/v1/accounts").get_json()["accounts"][0]
+    client.post("/api/v1/accounts/" + str(bank_account["id"]) + "/deposits", json={"amount": 10 ** 12})
+    pool = client.post("/api/v1/pools", json={"name": username, "category": "Benchmark", "amount": 0}).get_json()
+
+    return bank_account["id"], pool["id"]
+
+
+# Times run() and prints how many operations per second it made
+def _report(label, operations, run):
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    click.echo(label.ljust(32) + str(round(operations / elapsed)).rjust(8) + " operations/s")
+
+
+# Makes the same number of pool contributions through the form route, the single operation API endpoint and the
+# batch API endpoint
+# - The form route is followed through its redirect, since that is where the client finds out whether it worked
+@benchmark.command("api")
+@click.option("--operations", default=500, help="Number of contributions made through each route.")
+@click.option("--batch-size", default=100, help="Number of contributions sent in each batch request.")
+@with_appcontext
+def api_command(operations, batch_size):
+    client = current_app.test_client()
+    bank_account_id, pool_id = _set_up_client(client)
+
+    def form_route():
+        for _ in range(operations):
+            client.post("/contribute_to_pool", data={"pool_id": pool_id, "bank_account_select": bank_account_id,
+                                                     "amount_to_contribute_input": "1"}, follow_redirects=True)
+
+    def api_endpoint():
+        for _ in range(operations):
+            client.post("/api/v1/contributions", json={"pool_id": pool_id, "bank_account_id": bank_account_id,
+                                                       "amount": 100})
+
+    def api_batch():
+        operation = {"op": "contribute", "pool_id": pool_id, "bank_account_id": bank_account_id, "amount": 100}
+        for start in range(0, operations, batch_size):
+            client.post("/api/v1/batch", json={"operations": [operation] * min(batch_size, operations - start)})
+
+    _report("Form route (with redirect)", operations, form_route)
+    _report("API endpoint", operations, api_endpoint)
+    _report("API batch of " + str(batch_size), operations, api_batch)
+
+
+@benchmark.command("generate")
+@click.option("--users", default=1000, help="Number of users to create.")
+@click.option("--pools", default=100, help="Number of pools to create.")
+@click.option("--contributions", default=5, help="Average number of pool contributions per user.")
+@click.option("--loan-requests", default=1, help="Average number of open loan requests per user.")
+@click.option("--loans", default=2, help="Average number of loans per user.")
+@click.option("--seed", default=0, help="Seed for the random number generator; the same seed gives the same data.")
+@with_appcontext
+def generate_command(users, pools, contributions, loan_requests, loans, seed):
+    created = synthetic_data.generate(users, pools, contributions, loan_requests, loans, seed)
+    for table_name, count in created.items():
+        click.echo("Created " + str(count) + " " + table_name + " row(s)")
+
+
+# Requests made by each scenario; each takes the test client, a random number generator and the worker's context
+# (the ids of the logged in user's first bank account, the pools and the number of synthetic users)
+SCENARIOS = {
+    "dashboard": lambda client, rng, context: client.get("/dashboard"),
+    "pool_browser": lambda client, rng, context: client.get(
+        "/pool_browser", query_string={"category_list": rng.choice(["All"] + synthetic_data.CATEGORIES)}),
+    "bank_management": lambda client, rng, context: client.get("/bank_management"),
+    "contribute_to_pool": lambda client, rng, context: client.post("/contribute_to_pool", data={
+        "pool_id": rng.choice(context["pool_ids"]),
+        "bank_account_select": context["bank_account_id"],
+        "amount_to_contribute_input": "1"
+    }),
+    "attempt_login": lambda client, rng, context: client.post("/attempt_login", data={
+        "username_input": synthetic_data.username(rng.randrange(context["users"])),
+        "password_input": synthetic_data.PASSWORD
+    })
+}
+
+
+# Logs the test client in as a synthetic user (the bank manager for the bank management page) and returns the
+# scenario's context
+def _log_in(client, scenario, rng, users):
+    number = 0 if scenario == "bank_management" else rng.randrange(users)
+    client.post("/attempt_login", data={"username_input": synthetic_data.username(number),
+                                        "password_input": synthetic_data.PASSWORD})
+
+    user_id = User.query.with_entities(User.id).filter_by(username=synthetic_data.username(number)).scalar()
+    bank_account_id = BankAccount.query.with_entities(BankAccount.id).filter_by(user_id=user_id) \
+        .order_by(BankAccount.id).limit(1).scalar()
+
+    # Make sure contributions do not run out of funds part way through
+    client.post("/add_funds_to_bank_account", data={"bank_account_select": bank_account_id,
+                                                    "add_funds_input": "100000"})
+
+    pool_ids = [pool_id for (pool_id,) in Pool.query.with_entities(Pool.id).limit(1000)]
+    return {"bank_account_id": bank_account_id, "pool_ids": pool_ids, "users": users}
+
+
+# Runs one worker's share of a scenario and returns the latency of every request in seconds, the number of responses
+# with an error status and the time taken by the requests (logging in is not counted)
+def _run_worker(scenario, requests, seed, users):
+    client = current_app.test_client()
+    rng = random.Random(seed)
+    context = _log_in(client, scenario, rng, users)
+
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = SCENARIOS[scenario](client, rng, context)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            errors += 1
+
+    return latencies, errors, time.perf_counter() - started
+
+
+# Entry point of the worker processes; the app is inherited from the parent process when it forks, and the results
+# are sent back through the queue
+def _worker_process(app, queue, scenario, requests, seed, users):
+    with app.app_context():
+        db.engine.dispose()
+        queue.put(_run_worker(scenario, requests, seed, users))
+
+
+# Runs the scenario on the given number of processes and returns its results
+def _run_scenario(scenario, requests, processes, seed, users):
+    if processes == 1:
+        results = [_run_worker(scenario, requests, seed, users)]
+    else:
+        db.engine.dispose()
+        app = current_app._get_current_object()
+        context = multiprocessing.get_context("fork")
+        queue = context.Queue()
+        workers = [context.Process(target=_worker_process, args=(app, queue, scenario, requests, seed + number, users))
+                   for number in range(processes)]
+
+        for worker in workers:
+            worker.start()
+        results = [queue.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+    latencies = numpy.concatenate([numpy.array(worker_latencies) for worker_latencies, errors, elapsed in results])
+    p50, p95, p99 = numpy.percentile(latencies, [50, 95, 99]) * 1000
+
+    # The processes run at the same time, so the overall throughput is the sum of theirs
+    throughput = sum(len(worker_latencies) / elapsed for worker_latencies, errors, elapsed in results)
+
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors for worker_latencies, errors, elapsed in results),
+        "throughput": round(throughput, 1),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2)
+    }
+
+
+# Returns a description of every way the results are worse than the baseline by more than the tolerance
+def _regressions(results, baseline, tolerance):
+    found = []
+    for scenario, result in results.items():
+        if scenario not in baseline:
+            continue
+        before = baseline[scenario]
+        if result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            found.append(scenario + ": p95 " + str(before["p95_ms"]) + " ms -> " + str(result["p95_ms"]) + " ms")
+        if result["throughput"] < before["throughput"] * (1 - tolerance):
+            found.append(scenario + ": throughput " + str(before["throughput"]) + " -> " + str(result["throughput"]) +
+                         " requests/s")
+    return found
+
+
+@benchmark.command("run")
+@click.option("--scenario", "scenarios", multiple=True, type=click.Choice(sorted(SCENARIOS)),
+              help="Route to drive (may be repeated; all of them by default).")
+@click.option("--requests", default=200, help="Requests sent to each route by each process.")
+@click.option("--processes", default=1, help="Number of load generating processes (more than one needs fork).")
+@click.option("--seed", default=0, help="Seed for the random choices made by the load generators.")
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False), help="Baseline file to compare against.")
+@click.option("--save-baseline", type=click.Path(dir_okay=False, writable=True), help="File to save the results to.")
+@click.option("--tolerance", default=0.2, help="Fraction by which a route may be worse than the baseline.")
+@with_appcontext
+def run_command(scenarios, requests, processes, seed, baseline, save_baseline, tolerance):
+    users = User.query.filter(User.username.like(synthetic_data.PREFIX + "-%")).count()
+    if not users:
+        raise click.ClickException("There are no synthetic users - run \"flask benchmark generate\" first")
+
+    results = {}
+    click.echo("Route".ljust(22) + "Requests".rjust(10) + "Errors".rjust(8) + "Req/s".rjust(10) +
+               "p50 ms".rjust(10) + "p95 ms".rjust(10) + "p99 ms".rjust(10))
+    for scenario in scenarios or sorted(SCENARIOS):
+        result = results[scenario] = _run_scenario(scenario, requests, processes, seed, users)
+        click.echo(scenario.ljust(22) + str(result["requests"]).rjust(10) + str(result["errors"]).rjust(8) +
+                   str(result["throughput"]).rjust(10) + str(result["p50_ms"]).rjust(10) +
+                   str(result["p95_ms"]).rjust(10) + str(result["p99_ms"]).rjust(10))
+
+    if save_baseline:
+        with open(save_baseline, "w") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+        click.echo("Saved the results to " + save_baseline)
+
+    if baseline:
+        with open(baseline) as file:
+            regressions = _regressions(results, json.load(file), tolerance)
+        for regression in regressions:
+            click.echo("REGRESSION " + regression)
+        if regressions:
+            raise SystemExit(1)
+
+
+# Times loading every template, first compiling them from source and then from the bytecode cache, followed by
+# rendering the pool browser page for the given number of pools with the fragment cache off, cold (every fragment is
+# rendered and stored) and warm (every fragment is served from the cache)
+# - The pools and the user are never added to the session, so nothing is written to the database
+@benchmark.command("render")
+@click.option("--pools", default=10000, help="Number of pools shown on the page.")
+@click.option("--repeat", default=5, help="Number of times each warm render is repeated (the fastest is reported).")
+@with_appcontext
+def render_command(pools, repeat):
+    env = current_app.jinja_env
+    template_names = env.list_templates(filter_func=lambda name: name.endswith(".html"))
+
+    def load_templates():
+        env.cache.clear()
+        start = time.perf_counter()
+        for name in template_names:
+            env.get_template(name)
+        return time.perf_counter() - start
+
+    bytecode_cache = env.bytecode_cache
+    env.bytecode_cache = None
+    compile_seconds = load_templates()
+    env.bytecode_cache = bytecode_cache
+    if bytecode_cache is not None:
+        load_templates()  # Makes sure every template is in the bytecode cache
+        cached_seconds = load_templates()
+
+    user = User("Bench", "Mark", "benchmark", "")
+    user.is_bank_manager = True
+
+    rng = random.Random(0)
+    pool_list = []
+    for index in range(1, pools + 1):
+        pool = Pool("Pool " + str(index), rng.choice(synthetic_data.CATEGORIES), rng.randint(0, 10 ** 8))
+        pool.id = index
+        pool_list.append(pool)
+
+    def render():
+        with current_app.test_request_context("/pool_browser"):
+            start = time.perf_counter()
+            render_template("pool_browser.html", categories=synthetic_data.CATEGORIES, pools=pool_list, user=user,
+                            chosen_category="All", sort="name", page=1, has_next_page=False)
+            return time.perf_counter() - start
+
+    fragment_cache_enabled = env.fragment_cache_enabled
+    try:
+        env.fragment_cache_enabled = False
+        render()  # Leaves the template compiled and loaded, so that only rendering is timed
+        uncached_seconds = min(render() for _ in range(repeat))
+
+        env.fragment_cache_enabled = True
+        cache.fragment_cache.clear()
+        cold_seconds = render()
+        warm_seconds = min(render() for _ in range(repeat))
+    finally:
+        env.fragment_cache_enabled = fragment_cache_enabled
+
+    click.echo("Loading " + str(len(template_names)) + " templates")
+    click.echo("  compiled from source".ljust(36) + str(round(compile_seconds * 1000, 1)).rjust(10) + " ms")
+    if bytecode_cache is not None:
+        click.echo("  from the bytecode cache".ljust(36) + str(round(cached_seconds * 1000, 1)).rjust(10) + " ms")
+    click.echo("Rendering pool_browser.html with " + str(pools) + " pools")
+    click.echo("  fragment cache off".ljust(36) + str(round(uncached_seconds * 1000, 1)).rjust(10) + " ms")
+    click.echo("  fragment cache cold".ljust(36) + str(round(cold_seconds * 1000, 1)).rjust(10) + " ms")
+    click.echo("  fragment cache warm".ljust(36) + str(round(warm_seconds * 1000, 1)).rjust(10) + " ms")
+
+
+ASSET_PAGES = ("/dashboard", "/pool_browser", "/account", "/bank_management")
+
+# Links to static files in a page (stylesheets, scripts and images)
+ASSET_LINK = re.compile(r'(?:href|src)="(/(?:static|assets)/[^"]+)"')
+
+
+# Size of a response as sent over HTTP/1.1: the status line, the headers and the body
+def _wire_bytes(response):
+    headers = "".join(name + ": " + value + "\r\n" for name, value in response.headers.items())
+    return len("HTTP/1.1 " + response.status + "\r\n" + headers + "\r\n") + len(response.get_data())
+
+
+# Returns the [requests, bytes] needed to view a page with an empty browser cache, and then again with the responses
+# from the first view cached
+# - A cached asset is only requested again (conditionally) if it was sent without a max-age
+def _page_view(client, page):
+    browser_headers = {"Accept-Encoding": "gzip, deflate, br"}
+    response = client.get(page, headers=browser_headers)
+    first = [1, _wire_bytes(response)]
+    repeat = [1, _wire_bytes(response)]
+
+    # A page can link to the same file more than once (e.g. from an included template), but it is only fetched once
+    for url in dict.fromkeys(ASSET_LINK.findall(response.get_data(as_text=True))):
+        asset = client.get(url, headers=browser_headers)
+        first[0] += 1
+        first[1] += _wire_bytes(asset)
+
+        if not asset.cache_control.max_age:
+            revalidated = client.get(url, headers=dict(browser_headers, **{"If-None-Match": asset.headers["ETag"]}))
+            repeat[0] += 1
+            repeat[1] += _wire_bytes(revalidated)
+
+    return first, repeat
+
+
+# Views each page with the fingerprinted assets turned off (Flask's static route) and on, and compares the number of
+# requests and bytes on the wire for a first and a repeat view
+@benchmark.command("assets")
+@with_appcontext
+def assets_command():
+    if not assets.load_manifest(current_app):
+        raise click.ClickException("The assets have not been built - run \"flask assets build\" first")
+
+    client = current_app.test_client()
+    _set_up_client(client)
+
+    fingerprinted_assets = current_app.config.get("FINGERPRINTED_ASSETS", True)
+    results = {}
+    try:
+        for label, enabled in (("before", False), ("after", True)):
+            current_app.config["FINGERPRINTED_ASSETS"] = enabled
+            results[label] = {page: _page_view(client, page) for page in ASSET_PAGES}
+    finally:
+        current_app.config["FINGERPRINTED_ASSETS"] = fingerprinted_assets
+
+    click.echo("Page".ljust(18) + "View".ljust(8) + "Requests before/after".rjust(24) + "Bytes before/after".rjust(24))
+    for page in ASSET_PAGES:
+        for index, view in enumerate(("first", "repeat")):
+            before = results["before"][page][index]
+            after = results["after"][page][index]
+            click.echo(page.ljust(18) + view.ljust(8) + (str(before[0]) + " / " + str(after[0])).rjust(24) +
+                       (str(before[1]) + " / " + str(after[1])).rjust(24))
+
+
+# What a session holds just after a form succeeds: the logged in user and a flashed message
+BENCHMARK_SESSION = {
+    "user_id": 1,
+    "logged_in": True,
+    "_flashes": [("add_funds_success", "You have added $1,250.00 to Checking [5801024570]. It's balance is now "
+                                       "$10,831.75!")]
+}
+
+# What each request does with the session: nothing (e.g. a stylesheet), reads the logged in user, or changes it
+SESSION_SCENARIOS = {
+    "unused": lambda session: None,
+    "read": lambda session: session.get("user_id"),
+    "write": lambda session: session.__setitem__("temp_pool_id", 1)
+}
+
+
+# Returns the value of the session cookie which the interface sets for a session holding the given data
+def _session_cookie(interface, data):
+    app = current_app._get_current_object()
+    with app.test_request_context("/"):
+        session = interface.open_session(app, request)
+        session.update(data)
+        response = app.response_class()
+        interface.save_session(app, session, response)
+
+    cookie = response.headers["Set-Cookie"]
+    return cookie[cookie.index("=") + 1:cookie.index(";")]
+
+
+# Times opening and saving the session for each scenario, for Flask's signed cookie sessions and for each server-side
+# store, and reports the size of the cookie and of the stored data
+# - Only the session interface is timed, not the rest of the request
+@benchmark.command("session")
+@click.option("--requests", default=5000, help="Requests timed for each backend and scenario.")
+@with_appcontext
+def session_command(requests):
+    app = current_app._get_current_object()
+    cookie_name = app.config["SESSION_COOKIE_NAME"]
+    backends = {
+        "cookie": SecureCookieSessionInterface(),
+        "memory": sessions.ServerSideSessionInterface(sessions.MemorySessionStore()),
+        "sql": sessions.ServerSideSessionInterface(sessions.SqlSessionStore())
+    }
+
+    click.echo("Backend".ljust(10) + "Cookie bytes".rjust(14) + "Stored bytes".rjust(14) +
+               "".join((scenario + " us").rjust(12) for scenario in SESSION_SCENARIOS))
+    for name, interface in backends.items():
+        cookie = _session_cookie(interface, BENCHMARK_SESSION)
+        stored = len(sessions.serialize(BENCHMARK_SESSION)) if name != "cookie" else 0
+
+        timings = []
+        for scenario in SESSION_SCENARIOS.values():
+            elapsed = 0.0
+            for _ in range(requests):
+                with app.test_request_context("/", headers={"Cookie": cookie_name + "=" + cookie}):
+                    start = time.perf_counter()
+                    session = interface.open_session(app, request)
+                    scenario(session)
+                    interface.save_session(app, session, app.response_class())
+                    elapsed += time.perf_counter() - start
+            timings.append(elapsed / requests)
+
+        if name != "cookie":
+            interface.store.delete(cookie)
+
+        click.echo(name.ljust(10) + str(len(cookie_name) + 1 + len(cookie)).rjust(14) + str(stored).rjust(14) +
+                   "".join(str(round(seconds * 1e6, 1)).rjust(12) for seconds in timings))
+
+
+# Requests sent by each client in the concurrency benchmark; the read paths send the logged in user's session cookie
+CONCURRENCY_SCENARIOS = {
+    "dashboard": ("GET", "/dashboard"),
+    "pool_browser": ("GET", "/pool_browser"),
+    "bank_management": ("GET", "/bank_management"),
+    "attempt_login": ("POST", "/attempt_login")
+}
+
+
+# WSGI middleware which records the most requests the app was handling at once
+class InFlightCounter:
+    def __init__(self, app):
+        self.app = app
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            # The response is read here so that the request counts as in flight until its body has been produced
+            return [b"".join(self.app(environ, start_response))]
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+# Sends one request to an ASGI application and returns the response's status code
+async def _asgi_request(application, method, path, body, headers):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"localhost")] + headers, "client": ("127.0.0.1", 0), "server": ("localhost", 80)
+    }
+    finished = asyncio.Event()
+    received = []
+    status = []
+
+    async def receive():
+        if not received:
+            received.append(True)
+            return {"type": "http.request", "body": body, "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+        elif not message.get("more_body"):
+            finished.set()
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+# Runs the clients at once, each sending its requests one after the other, and returns the latencies, the number of
+# errors and the elapsed time
+async def _run_clients(application, clients, requests, method, path, body, headers):
+    latencies = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        for _ in range(requests):
+            start = time.perf_counter()
+            status = await _asgi_request(application, method, path, body, headers)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return latencies, errors, time.perf_counter() - start
+
+
+# Sends the same burst of concurrent requests to the app served by each number of threads; one thread handles one
+# request at a time like a synchronous WSGI worker, and more threads are the ASGI serving mode (see asgi.py)
+# - Requests are made in-process, so only the app and the database are measured, not the network or an ASGI server
+@benchmark.command("concurrency")
+@click.option("--scenario", "scenarios", multiple=True, type=click.Choice(sorted(CONCURRENCY_SCENARIOS)),
+              help="Route to request (default: all of them).")
+@click.option("--clients", default=32, help="Number of clients sending requests at once.")
+@click.option("--requests", default=10, help="Requests sent by each client.")
+@click.option("--threads", "thread_counts", multiple=True, type=int, help="Serving threads (default: 1 and "
+              "ASGI_THREADS).")
+@with_appcontext
+def concurrency_command(scenarios, clients, requests, thread_counts):
+    import asgi
+
+    app = current_app._get_current_object()
+    client = app.test_client()
+    username = "benchmark-" + uuid.uuid4().hex[:12]
+    response = client.post("/attempt_sign_up", data={"first_name_input": "Bench", "last_name_input": "Mark",
+                                                     "username_input": username, "password_input": username})
+    client.get("/adminify")
+    cookie = response.headers["Set-Cookie"].split(";")[0].encode()
+
+    login_body = ("username_input=" + username + "&password_input=" + username).encode()
+    form_headers = [(b"content-type", b"application/x-www-form-urlencoded"),
+                    (b"content-length", str(len(login_body)).encode())]
+
+    counter = InFlightCounter(app.wsgi_app)
+    app.wsgi_app = counter
+    try:
+        click.echo("Route".ljust(18) + "Threads".rjust(8) + "In flight".rjust(11) + "Errors".rjust(8) +
+                   "Req/s".rjust(9) + "p50 ms".rjust(10) + "p95 ms".rjust(10))
+        for scenario in scenarios or sorted(CONCURRENCY_SCENARIOS):
+            method, path = CONCURRENCY_SCENARIOS[scenario]
+            if method == "POST":
+                body, headers = login_body, form_headers
+            else:
+                body, headers = b"", [(b"cookie", cookie)]
+
+            for threads in thread_counts or (1, app.config["ASGI_THREADS"]):
+                application = asgi.create_asgi_app(app, threads)
+                counter.most_in_flight = 0
+                # The event loop runs without this command's app context, as it would under an ASGI server, so that
+                # every request pushes (and tears down) its own
+                latencies, errors, elapsed = contextvars.Context().run(
+                    asyncio.run, _run_clients(application, clients, requests, method, path, body, headers))
+                application.executor.shutdown()
+
+                p50, p95 = numpy.percentile(latencies, [50, 95]) * 1000
+                click.echo(scenario.ljust(18) + str(threads).rjust(8) + str(counter.most_in_flight).rjust(11) +
+                           str(errors).rjust(8) + str(round(len(latencies) / elapsed)).rjust(9) +
+                           str(round(p50, 1)).rjust(10) + str(round(p95, 1)).rjust(10))
+    finally:
+        app.wsgi_app = counter.app
+
+
+# Run in a new interpreter by the startup benchmark; prints the seconds spent importing the app, in create_app() and
+# on the first request
+STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+from __init__ import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+app.test_client().get("/login")
+print(json.dumps([imported - start, created - imported, time.perf_counter() - created]))
+"""
+
+# Lines of "python -X importtime" output: time spent in the module itself | including its imports | name (indented)
+IMPORT_TIME = re.compile(r"import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def _run_startup_script(*options):
+    return subprocess.run([sys.executable] + list(options) + ["-c", STARTUP_SCRIPT], cwd=os.path.dirname(
+        os.path.abspath(__file__)), env=os.environ, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+
+
+# Starts the app in new processes as a web server worker would (importing it and calling create_app(), without the
+# flask command) and times each stage up to its first response, then lists the app's slowest imports according to
+# "python -X importtime"
+@benchmark.command("startup")
+@click.option("--runs", default=5, help="Number of processes started (the median of each figure is reported).")
+@click.option("--imports", default=10, help="Number of the slowest imports listed.")
+@with_appcontext
+def startup_command(runs, imports):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = _run_startup_script()
+        timings.append([time.perf_counter() - start] + json.loads(result.stdout.strip().splitlines()[-1]))
+
+    medians = numpy.median(timings, axis=0) * 1000
+    click.echo("Startup (median of " + str(runs) + " runs)")
+    for label, milliseconds in zip(("new process to first response", "importing the app", "create_app()",
+                                    "first request (/login)"), medians):
+        click.echo(("  " + label).ljust(40) + str(round(milliseconds, 1)).rjust(10) + " ms")
+
+    # A module's imports are listed before it, one level further indented; the app's own imports are the ones listed
+    # at the first level before __init__
+    direct_imports = []
+    imports_so_far = []
+    for line in _run_startup_script("-X", "importtime").stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if not match:
+            continue
+        if not match.group(2):
+            if match.group(3) == "__init__":
+                direct_imports = imports_so_far
+            imports_so_far = []
+        elif len(match.group(2)) == 2:
+            imports_so_far.append((int(match.group(1)), match.group(3)))
+
+    click.echo("Slowest imports (python -X importtime, including their own imports)")
+    for microseconds, name in sorted(direct_imports, reverse=True)[:imports]:
+        click.echo(("  " + name).ljust(40) + str(round(microseconds / 1000, 1)).rjust(10) + " ms")
+
+
+# Inserts count loans approved at random times over the last two years and never accrued, taken from pools chosen at
+# random from pool_ids (or from no pool), and returns the first id
+def _insert_loans(count, rng, now, pool_ids=(None,)):
+    first_id = db.session.query(func.coalesce(func.max(Loan.id), 0)).scalar() + 1
+    for start in range(0, count, 50000):
+        db.session.execute(Loan.__table__.insert(), [{
+            "id": first_id + index,
+            "user_id": 0,
+            "pool_id": rng.choice(pool_ids),
+            "principal_amount": rng.randrange(10000, 1000000),
+            "amount_accrued": 0,
+            "amount_paid": 0,
+            "principal_paid": 0,
+            "amount_due": 0,
+            "date_approved": now - rng.randrange(1, 730) * 86400,
+            "date_due": now + 365 * 86400,
+            "interest_rate": rng.choice((2.0, 3.5, 5.0, 7.5))
+        } for index in range(start, min(start + 50000, count))])
+        db.session.commit()
+    return first_id
+
+
+# Accrues interest on each loan in Python and commits it, as the dashboard did on every page view before the accrual
+# engine (see accrual.py) existed
+def _accrue_one_at_a_time(loans, now):
+    for loan in loans:
+        days = (now - loan.date_approved) // 86400
+        interest = round(loan.principal_amount * loan.interest_rate / 36500 * days) - loan.amount_accrued
+        loan.amount_accrued += interest
+        loan.amount_due = loan.principal_amount + loan.amount_accrued - loan.amount_paid
+        db.session.commit()
+
+
+# For each number of loans, times the one loan at a time loop on a sample of them (extrapolated to all of them, since
+# it commits once per loan) and a run of the batch accrual engine over all of them, then deletes the loans again
+@benchmark.command("accrual")
+@click.option("--loans", "loan_counts", multiple=True, type=int, help="Number of loans (may be repeated; default: "
+              "10000, 100000 and 1000000).")
+@click.option("--loop-sample", default=2000, help="Number of loans the one at a time loop is timed on.")
+@with_appcontext
+def accrual_command(loan_counts, loop_sample):
+    rng = random.Random(0)
+    click.echo("Loans".rjust(10) + "One at a time s".rjust(18) + "Batch s".rjust(10) + "Speed-up".rjust(10))
+    for count in loan_counts or (10000, 100000, 1000000):
+        now = int(time.time())
+        first_id = _insert_loans(count, rng, now)
+        try:
+            sample = Loan.query.filter(Loan.id >= first_id).order_by(Loan.id).limit(min(loop_sample, count)).all()
+            start = time.perf_counter()
+            _accrue_one_at_a_time(sample, now)
+            loop_seconds = (time.perf_counter() - start) / len(sample) * count
+
+            start = time.perf_counter()
+            accrue_interest(now)
+            batch_seconds = time.perf_counter() - start
+        finally:
+            Loan.query.filter(Loan.id >= first_id).delete(synchronize_session=False)
+            db.session.commit()
+
+        click.echo(str(count).rjust(10) + str(round(loop_seconds, 2)).rjust(18) +
+                   str(round(batch_seconds, 2)).rjust(10) + (str(round(loop_seconds / batch_seconds)) + "x").rjust(10))
+
+
+# Returns the fastest of repeat runs of run(), in milliseconds
+def _best_milliseconds(run, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+# Inserts count pools spread over the synthetic data categories and returns the first id
+def _insert_pools(count, rng):
+    first_id = db.session.query(func.coalesce(func.max(Pool.id), 0)).scalar() + 1
+    for start in range(0, count, 50000):
+        db.session.execute(Pool.__table__.insert(), [{
+            "id": first_id + index,
+            "name": "Benchmark Pool " + str(first_id + index),
+            "category": rng.choice(synthetic_data.CATEGORIES),
+            "amount": rng.randrange(100, 10 ** 8)
+        } for index in range(start, min(start + 50000, count))])
+        db.session.commit()
+    return first_id
+
+
+# Times the pool browser's queries the way it used to run them (every category and every pool read into Python, then
+# deduplicated and filtered there) and the way it runs them now (SELECT DISTINCT and WHERE on the indexed category,
+# one page at a time), then the page itself, over the given number of extra pools which are deleted again afterwards
+@benchmark.command("pools")
+@click.option("--pools", default=50000, help="Number of pools added for the benchmark.")
+@click.option("--repeat", default=5, help="Number of times each step is repeated (the fastest is reported).")
+@with_appcontext
+def pools_command(pools, repeat):
+    client = current_app.test_client()
+    _set_up_client(client)
+
+    first_id = _insert_pools(pools, random.Random(0))
+    category = synthetic_data.CATEGORIES[0]
+    last_page = Pool.query.count() // 50
+
+    def old_categories():
+        categories = []
+        for (pool_category,) in Pool.query.with_entities(Pool.category):
+            if pool_category not in categories:
+                categories.append(pool_category)
+        return categories
+
+    def old_filter():
+        return [pool for pool in Pool.query.all() if pool.category == category]
+
+    def new_categories():
+        Pool.invalidate_categories()
+        return Pool.get_categories()
+
+    try:
+        steps = [
+            ("Category list, in Python", old_categories),
+            ("Category list, SELECT DISTINCT", new_categories),
+            ("Category list, cached", Pool.get_categories),
+            ("Pools in a category, in Python", old_filter),
+            ("Pools in a category, one page", lambda: Pool.query.filter(Pool.category == category)
+             .order_by(Pool.name, Pool.id).limit(51).all()),
+            ("Pool browser, category page 1", lambda: client.get("/pool_browser", query_string={
+                "category_list": category})),
+            ("Pool browser, last page of all", lambda: client.get("/pool_browser", query_string={
+                "page": last_page})),
+        ]
+
+        click.echo(str(Pool.query.count()) + " pools")
+        for label, run in steps:
+            click.echo(label.ljust(34) + str(round(_best_milliseconds(run, repeat), 2)).rjust(10) + " ms")
+    finally:
+        Pool.query.filter(Pool.id >= first_id).delete(synchronize_session=False)
+        db.session.commit()
+        Pool.invalidate_categories()
+
+
+# Runs work(number) on each of the given number of threads at once and returns the elapsed time
+def _run_threads(threads, work):
+    workers = [threading.Thread(target=work, args=(number,)) for number in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+# For each bcrypt work factor and number of threads, signs up new users and then logs each of them in again, every
+# thread with its own test client, and reports how many of each the app handled per second
+# - Hashing runs on the PASSWORD_HASHING_WORKERS threads (see passwords.py), so more request threads than that only
+#   queue up for them
+@benchmark.command("login")
+@click.option("--rounds", "rounds_list", multiple=True, type=int, help="bcrypt work factor (may be repeated; "
+              "default: 10 and 12).")
+@click.option("--threads", "thread_counts", multiple=True, type=int, help="Threads sending requests at once (may be "
+              "repeated; default: 1 and 4).")
+@click.option("--requests", default=20, help="Sign-ups, and then logins, sent by each thread.")
+@with_appcontext
+def login_command(rounds_list, thread_counts, requests):
+    app = current_app._get_current_object()
+    configured_rounds = app.config.get("BCRYPT_LOG_ROUNDS")
+
+    click.echo("Rounds".rjust(7) + "Threads".rjust(9) + "Sign-ups/s".rjust(12) + "Logins/s".rjust(10) +
+               "Errors".rjust(8))
+    try:
+        for rounds in rounds_list or (10, 12):
+            app.config["BCRYPT_LOG_ROUNDS"] = rounds
+            for threads in thread_counts or (1, 4):
+                prefix = "benchmark-" + uuid.uuid4().hex[:12] + "-"
+                usernames = [[prefix + str(number) + "-" + str(index) for index in range(requests)]
+                             for number in range(threads)]
+                errors = []
+
+                def sign_up(number):
+                    client = app.test_client()
+                    for username in usernames[number]:
+                        response = client.post("/attempt_sign_up", data={
+                            "first_name_input": "Bench", "last_name_input": "Mark", "username_input": username,
+                            "password_input": username})
+                        if not response.headers.get("Location", "").endswith("/dashboard"):
+                            errors.append(username)
+
+                def log_in(number):
+                    client = app.test_client()
+                    for username in usernames[number]:
+                        response = client.post("/attempt_login", data={"username_input": username,
+                                                                       "password_input": username})
+                        if not response.headers.get("Location", "").endswith("/dashboard"):
+                            errors.append(username)
+
+                sign_up_seconds = _run_threads(threads, sign_up)
+                log_in_seconds = _run_threads(threads, log_in)
+
+                operations = threads * requests
+                click.echo(str(rounds).rjust(7) + str(threads).rjust(9) +
+                           str(round(operations / sign_up_seconds, 1)).rjust(12) +
+                           str(round(operations / log_in_seconds, 1)).rjust(10) + str(len(errors)).rjust(8))
+    finally:
+        app.config["BCRYPT_LOG_ROUNDS"] = configured_rounds
+
+
+# SQLite settings compared by the writes benchmark, as (journal mode, synchronous): SQLite's own defaults, then WAL
+# with and without a sync on every commit, the last being the app's default (see database.py)
+SQLITE_SETTINGS = ("DELETE/FULL", "WAL/FULL", "WAL/NORMAL")
+
+
+# Makes pool contributions through the API from several threads at once, every thread with its own test client and
+# bank account, all into the same pool, once under each SQLite setting (or once with the configured database settings
+# on other backends), and reports the throughput and latency of the writes
+# - The pragmas are read from the environment whenever a connection is opened (see database.set_sqlite_pragmas), so
+#   each setting is applied by changing the environment and closing the open connections
+@benchmark.command("writes")
+@click.option("--setting", "settings", multiple=True, help="SQLite journal mode and synchronous setting, such as "
+              "WAL/NORMAL (may be repeated; default: " + ", ".join(SQLITE_SETTINGS) + ").")
+@click.option("--threads", default=8, help="Threads making contributions at once.")
+@click.option("--requests", default=50, help="Contributions made by each thread.")
+@with_appcontext
+def writes_command(settings, threads, requests):
+    app = current_app._get_current_object()
+    clients = [app.test_client() for _ in range(threads)]
+    # Each client is set up without this command's app context, which its requests would otherwise share, along with
+    # the logged in user kept on flask.g (see auth.py)
+    accounts = [contextvars.Context().run(_set_up_client, client) for client in clients]
+    pool_id = accounts[0][1]
+
+    sqlite = db.engine.dialect.name == "sqlite"
+    if not sqlite:
+        settings = ("configured",)
+    configured = {name: os.environ.get(name) for name in ("SQLITE_JOURNAL_MODE", "SQLITE_SYNCHRONOUS")}
+
+    click.echo("Setting".ljust(14) + "Threads".rjust(8) + "Errors".rjust(8) + "Writes/s".rjust(10) +
+               "p50 ms".rjust(10) + "p95 ms".rjust(10))
+    try:
+        for setting in settings or SQLITE_SETTINGS:
+            if sqlite:
+                os.environ["SQLITE_JOURNAL_MODE"], os.environ["SQLITE_SYNCHRONOUS"] = setting.upper().split("/")
+                db.session.remove()
+                db.engine.dispose()
+
+            latencies = []
+            errors = []
+
+            def contribute(number):
+                bank_account_id = accounts[number][0]
+                for _ in range(requests):
+                    start = time.perf_counter()
+                    response = clients[number].post("/api/v1/contributions", json={
+                        "pool_id": pool_id, "bank_account_id": bank_account_id, "amount": 100})
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code != 201:
+                        errors.append(response.status_code)
+
+            elapsed = _run_threads(threads, contribute)
+
+            p50, p95 = numpy.percentile(latencies, [50, 95]) * 1000
+            click.echo(setting.ljust(14) + str(threads).rjust(8) + str(len(errors)).rjust(8) +
+                       str(round(len(latencies) / elapsed)).rjust(10) + str(round(p50, 1)).rjust(10) +
+                       str(round(p95, 1)).rjust(10))
+    finally:
+        if sqlite:
+            for name, value in configured.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            db.session.remove()
+            db.engine.dispose()
+
+
+# Account type of the ledger benchmark's accounts, so that its entries can never be mistaken for a real account's
+LEDGER_BENCHMARK_ACCOUNT = "benchmark"
+
+
+# Inserts count ledger entries spread evenly over the accounts and over the year before now, with a balance snapshot
+# every SNAPSHOT_INTERVAL entries on each account as ledger.record_transfers() would have written, and returns the
+# balance of every account
+def _insert_ledger_entries(count, accounts, rng, now):
+    first_id = db.session.query(func.coalesce(func.max(LedgerEntry.id), 0)).scalar() + 1
+    start_time = now - 365 * 86400
+    balances = [0] * accounts
+    for start in range(0, count, 50000):
+        entries = []
+        snapshots = []
+        for index in range(start, min(start + 50000, count)):
+            account_id = index % accounts
+            amount = rng.randrange(-5000, 10000)
+            created_at = start_time + index * 365 * 86400 // count
+            balances[account_id] += amount
+            entries.append({"id": first_id + index, "transaction_id": None, "account_type": LEDGER_BENCHMARK_ACCOUNT,
+                            "account_id": account_id, "amount": amount, "memo": "Benchmark",
+                            "created_at": created_at})
+            if (index // accounts + 1) % ledger.SNAPSHOT_INTERVAL == 0:
+                snapshots.append({"account_type": LEDGER_BENCHMARK_ACCOUNT, "account_id": account_id,
+                                  "entry_id": first_id + index, "balance": balances[account_id],
+                                  "created_at": created_at})
+        db.session.execute(LedgerEntry.__table__.insert(), entries)
+        if snapshots:
+            db.session.execute(BalanceSnapshot.__table__.insert(), snapshots)
+        db.session.commit()
+    return balances
+
+
+# Times reading balances (now and a month ago) and statements (of the last month) from a ledger of the given number of
+# entries, against adding up all of an account's entries as a ledger without snapshots would have to, over a sample of
+# the accounts, then deletes the entries again
+@benchmark.command("ledger")
+@click.option("--rows", default=10000000, help="Number of ledger entries added for the benchmark.")
+@click.option("--accounts", default=1000, help="Number of accounts the entries are spread over.")
+@click.option("--sample", default=100, help="Number of accounts each read is timed on (the mean is reported).")
+@with_appcontext
+def ledger_command(rows, accounts, sample):
+    now = int(time.time())
+    month_ago = now - 30 * 86400
+
+    start = time.perf_counter()
+    balances = _insert_ledger_entries(rows, accounts, random.Random(0), now)
+    click.echo(str(rows) + " ledger entries over " + str(accounts) + " accounts inserted in " +
+               str(round(time.perf_counter() - start, 1)) + " s")
+
+    sampled = [(LEDGER_BENCHMARK_ACCOUNT, account_id) for account_id in range(min(sample, accounts))]
+
+    def full_sum(account):
+        return db.session.query(func.coalesce(func.sum(LedgerEntry.amount), 0)) \
+            .filter(LedgerEntry.account_type == account[0], LedgerEntry.account_id == account[1]).scalar()
+
+    try:
+        wrong = [account for account in sampled if ledger.balance(account) != balances[account[1]]]
+        steps = [
+            ("Balance now, every entry added up", full_sum),
+            ("Balance now, from a snapshot", ledger.balance),
+            ("Balance a month ago", lambda account: ledger.balance(account, month_ago)),
+            ("Statement of the last month", lambda account: ledger.statement(account, month_ago, now)),
+        ]
+        for label, read in steps:
+            start = time.perf_counter()
+            for account in sampled:
+                read(account)
+            milliseconds = (time.perf_counter() - start) / len(sampled) * 1000
+            click.echo(label.ljust(36) + str(round(milliseconds, 2)).rjust(10) + " ms")
+        click.echo("Balances differing from the entries: " + str(len(wrong)))
+    finally:
+        BalanceSnapshot.query.filter_by(account_type=LEDGER_BENCHMARK_ACCOUNT).delete(synchronize_session=False)
+        LedgerEntry.query.filter_by(account_type=LEDGER_BENCHMARK_ACCOUNT).delete(synchronize_session=False)
+        db.session.commit()
+
+
+# Inserts count pool contributions of random amounts by the user into pools chosen at random from pool_ids, and returns
+# the first id and their exact total
+def _insert_contributions(count, pool_ids, user_id, rng):
+    first_id = db.session.query(func.coalesce(func.max(PoolContribution.id), 0)).scalar() + 1
+    total = 0
+    for start in range(0, count, 50000):
+        amounts = [rng.randrange(1, 10 ** 6) for _ in range(start, min(start + 50000, count))]
+        total += sum(amounts)
+        db.session.execute(PoolContribution.__table__.insert(), [
+            {"id": first_id + start + index, "user_id": user_id, "pool_id": rng.choice(pool_ids), "amount": amount}
+            for index, amount in enumerate(amounts)
+        ])
+        db.session.commit()
+    return first_id, total
+
+
+# For each number of rows, adds up that many pool contributions as integer cents in SQL (as the money columns are now
+# stored, see money.py), as floating point dollars in SQL and in Python (as they were stored before migration 0011),
+# and reports how long each took and how many cents each was out by, then deletes the contributions again
+@benchmark.command("money")
+@click.option("--rows", "row_counts", multiple=True, type=int, help="Number of contributions added up (may be "
+              "repeated; default: 1000000 and 5000000).")
+@click.option("--repeat", default=3, help="Number of times each sum is repeated (the fastest is reported).")
+@with_appcontext
+def money_command(row_counts, repeat):
+    rng = random.Random(0)
+    pool_id = _insert_pools(1, rng)
+    contributions = PoolContribution.query.filter(PoolContribution.pool_id == pool_id)
+
+    sums = [
+        ("SQL SUM of integer cents", lambda: contributions.with_entities(func.sum(PoolContribution.amount)).scalar()),
+        ("SQL SUM of float dollars", lambda: contributions.with_entities(
+            func.sum(PoolContribution.amount / 100.0)).scalar() * 100),
+        ("Python sum of float dollars", lambda: sum(amount / 100 for (amount,) in contributions.with_entities(
+            PoolContribution.amount)) * 100),
+    ]
+
+    click.echo("Rows".rjust(10) + "  " + "Sum".ljust(30) + "Time ms".rjust(10) + "Cents out".rjust(12))
+    try:
+        for count in row_counts or (1000000, 5000000):
+            first_id, exact_total = _insert_contributions(count, [pool_id], 0, rng)
+            try:
+                for label, run in sums:
+                    result = []
+                    milliseconds = _best_milliseconds(lambda: result.append(run()), repeat)
+                    click.echo(str(count).rjust(10) + "  " + label.ljust(30) + str(round(milliseconds, 1)).rjust(10) +
+                               str(round(abs(result[-1] - exact_total), 4)).rjust(12))
+            finally:
+                PoolContribution.query.filter(PoolContribution.id >= first_id).delete(synchronize_session=False)
+                db.session.commit()
+    finally:
+        Pool.query.filter(Pool.id == pool_id).delete(synchronize_session=False)
+        db.session.commit()
+        Pool.invalidate_categories()
+
+
+# Works out the analytics page's per pool and per contributor figures straight from the loan and pool_contribution
+# tables with GROUP BY, as the page would have to without the running totals in pool_stats and user_stats
+def _analytics_by_group_by():
+    contributions = db.session.query(PoolContribution.pool_id, func.sum(PoolContribution.amount)) \
+        .group_by(PoolContribution.pool_id).all()
+    loans = db.session.query(Loan.pool_id, func.count(Loan.id), func.sum(Loan.principal_amount)) \
+        .filter(Loan.pool_id.isnot(None)) \
+        .group_by(Loan.pool_id).all()
+    contributors = db.session.query(PoolContribution.user_id, func.sum(PoolContribution.amount)) \
+        .group_by(PoolContribution.user_id) \
+        .order_by(func.sum(PoolContribution.amount).desc()) \
+        .limit(analytics.TOP_CONTRIBUTORS).all()
+    return contributions, loans, contributors
+
+
+# For each number of rows, adds that many loans and pool contributions spread over the given number of extra pools and
+# times the analytics (from the running totals, and as the JSON route) against working the same figures out with
+# GROUP BY, then deletes the rows again
+# - The running totals are rebuilt after the rows are added and again after they are deleted, since the rows are
+#   inserted directly rather than through the write paths which keep them up to date
+@benchmark.command("analytics")
+@click.option("--rows", "row_counts", multiple=True, type=int, help="Number of loans, and of contributions (may be "
+              "repeated; default: 100000 and 1000000).")
+@click.option("--pools", default=500, help="Number of pools added for the benchmark.")
+@click.option("--repeat", default=5, help="Number of times each step is repeated (the fastest is reported).")
+@with_appcontext
+def analytics_command(row_counts, pools, repeat):
+    client = current_app.test_client()
+    bank_account_id, _ = _set_up_client(client)
+    user_id = BankAccount.query.get(bank_account_id).user_id
+
+    rng = random.Random(0)
+    first_pool_id = _insert_pools(pools, rng)
+    pool_ids = list(range(first_pool_id, first_pool_id + pools))
+
+    steps = [
+        ("Analytics from running totals", analytics.portfolio_analytics),
+        ("/bank_analytics.json", lambda: client.get("/bank_analytics.json")),
+        ("Same figures by GROUP BY", _analytics_by_group_by),
+    ]
+
+    click.echo("Rows".rjust(10) + "  " + "Step".ljust(32) + "Time ms".rjust(10))
+    try:
+        for count in row_counts or (100000, 1000000):
+            first_loan_id = _insert_loans(count, rng, int(time.time()), pool_ids)
+            first_contribution_id, _ = _insert_contributions(count, pool_ids, user_id, rng)
+            try:
+                analytics.rebuild()
+                for label, run in steps:
+                    click.echo(str(count).rjust(10) + "  " + label.ljust(32) +
+                               str(round(_best_milliseconds(run, repeat), 1)).rjust(10))
+            finally:
+                Loan.query.filter(Loan.id >= first_loan_id).delete(synchronize_session=False)
+                PoolContribution.query.filter(PoolContribution.id >= first_contribution_id) \
+                    .delete(synchronize_session=False)
+                db.session.commit()
+    finally:
+        Pool.query.filter(Pool.id >= first_pool_id).delete(synchronize_session=False)
+        db.session.commit()
+        Pool.invalidate_categories()
+        analytics.rebuild()
@@ -0,0 +1,220 @@
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import Boolean, Float, Integer
+
+from models import db, User, BankAccount, Pool, PoolContribution, Loan
+
+'''
+Bulk import and export of users, bank accounts, pools, pool contributions and loans, for onboarding a whole portfolio
+at once instead of through the forms one row at a time.
+
+Usage (files ending in .csv are read/written as CSV with a header row, anything else as JSON lines):
+    flask bulk import user users.csv
+    flask bulk export loan loans.jsonl
+
+Rows are streamed from the file and inserted in chunks with bulk_insert_mappings, committing after every chunk, so
+memory use stays flat no matter how large the file is. Exports stream rows from the database in the same way.
+
+Column names are the same as the database columns, and amounts of money are whole numbers of cents. When importing
+users, the "password" column holds plain text passwords which are hashed on a pool of processes (unless --hashed is
+given). When importing bank accounts without an "account_number" column, account numbers are allocated as usual.
+
+Rows which cannot be imported (e.g. a user without a password, or a number column holding something else) are
+reported and skipped, and the command exits with status 1 once the other rows have been imported.
+'''
+
+MODELS = {
+    "user": User,
+    "bank_account": BankAccount,
+    "pool": Pool,
+    "pool_contribution": PoolContribution,
+    "loan": Loan
+}
+
+
+def _is_csv(path):
+    return path.lower().endswith(".csv")
+
+
+# Yields the rows of a CSV or JSON lines file as dictionaries, one at a time
+def _read_rows(path):
+    with open(path, newline="") as file:
+        if _is_csv(path):
+            for row in csv.DictReader(file):
+                yield row
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+# Converts the values read from a file to the types of the table's columns (CSV files only contain strings)
+def _convert_row(table, row):
+    converted = {}
+    for column in table.columns:
+        if column.name not in row:
+            continue
+
+        value = row[column.name]
+        if value is None or value == "":
+            converted[column.name] = None
+        elif isinstance(column.type, Boolean):
+            converted[column.name] = bool(value) if isinstance(value, (bool, int)) else \
+                value.lower() in ("1", "true", "yes")
+        elif isinstance(column.type, Integer):
+            converted[column.name] = int(value)
+        elif isinstance(column.type, Float):
+            converted[column.name] = float(value)
+        else:
+            converted[column.name] = value
+
+    return converted
+
+
+# Returns why a converted row cannot be imported into the table, or None if it can
+# - Users must have a username and a password, which login needs and which would otherwise only fail while hashing
+def _invalid_reason(table_name, mapping):
+    if table_name == "user":
+        for column_name in ("username", "password"):
+            value = mapping.get(column_name)
+            if value is None or not str(value).strip():
+                return "missing " + column_name
+    return None
+
+
+# Yields lists of up to size items from an iterable
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Runs in the worker processes used to hash imported passwords
+def _hash_password(args):
+    password, log_rounds = args
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(log_rounds))
+
+
+@click.group("bulk")
+def bulk():
+    """Bulk import and export of users, accounts, pools, contributions and loans."""
+
+
+@bulk.command("import")
+@click.argument("table_name", type=click.Choice(sorted(MODELS)))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--chunk-size", default=5000, show_default=True, help="Rows inserted per commit.")
+@click.option("--hashed", is_flag=True, help="Passwords in the file are already bcrypt hashes.")
+@click.option("--processes", default=os.cpu_count(), show_default=True, help="Processes used to hash passwords.")
+@with_appcontext
+def import_command(table_name, path, chunk_size, hashed, processes):
+    """Import rows from a CSV or JSON lines file."""
+    model = MODELS[table_name]
+    table = model.__table__
+    hash_passwords = table_name == "user" and not hashed
+    log_rounds = current_app.config.get("BCRYPT_LOG_ROUNDS", 12)
+
+    executor = ProcessPoolExecutor(max_workers=processes) if hash_passwords else None
+    imported = 0
+    skipped = 0
+
+    try:
+        for chunk in _chunks(enumerate(_read_rows(path), start=1), chunk_size):
+            # Rows which cannot be imported are reported (numbered from the first row after any header) and left out,
+            # so that one bad row does not stop the rest of the file from being imported
+            mappings = []
+            for number, row in chunk:
+                try:
+                    mapping = _convert_row(table, row)
+                except (ValueError, TypeError) as error:
+                    reason = "invalid value (" + str(error) + ")"
+                else:
+                    reason = _invalid_reason(table_name, mapping)
+
+                if reason is None:
+                    mappings.append(mapping)
+                else:
+                    skipped += 1
+                    click.echo("Skipped row " + str(number) + ": " + reason, err=True)
+
+            if not mappings:
+                continue
+
+            if hash_passwords:
+                passwords = [(mapping["password"], log_rounds) for mapping in mappings]
+                for mapping, password in zip(mappings, executor.map(_hash_password, passwords, chunksize=64)):
+                    mapping["password"] = password
+
+            # Accounts are numbered before anything is written in this chunk's transaction, since the allocator
+            # reserves numbers on its own connection
+            if table_name == "bank_account":
+                for mapping in mappings:
+                    if mapping.get("account_number") is None:
+                        mapping["account_number"] = BankAccount.generateAccountNumber()
+
+            db.session.bulk_insert_mappings(model, mappings)
+            db.session.commit()
+
+            imported += len(mappings)
+            click.echo("Imported " + str(imported) + " row(s)")
+    finally:
+        if executor:
+            executor.shutdown()
+
+        # New pools may be in categories the cached category list does not have yet
+        if table_name == "pool" and imported:
+            Pool.invalidate_categories()
+
+    if skipped:
+        click.echo("Skipped " + str(skipped) + " invalid row(s)", err=True)
+        raise SystemExit(1)
+
+
+@bulk.command("export")
+@click.argument("table_name", type=click.Choice(sorted(MODELS)))
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+@click.option("--chunk-size", default=5000, show_default=True, help="Rows fetched from the database at a time.")
+@with_appcontext
+def export_command(table_name, path, chunk_size):
+    """Export every row of a table to a CSV or JSON lines file."""
+    table = MODELS[table_name].__table__
+    column_names = [column.name for column in table.columns]
+
+    # stream_results asks the driver for a server side cursor where it has one, so rows are not all loaded at once
+    result = db.session.connection(execution_options={"stream_results": True}) \
+        .execute(table.select().order_by(table.c.id))
+
+    exported = 0
+    with open(path, "w", newline="") as file:
+        writer = None
+        if _is_csv(path):
+            writer = csv.writer(file)
+            writer.writerow(column_names)
+
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+
+            for row in rows:
+                values = [value.decode("utf-8") if isinstance(value, bytes) else value for value in row]
+                if writer:
+                    writer.writerow(values)
+                else:
+                    file.write(json.dumps(dict(zip(column_names, values))) + "\n")
+
+            exported += len(rows)
+
+    click.echo("Exported " + str(exported) + " row(s)")
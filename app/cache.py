@@ -0,0 +1,154 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+'''
+Caches used to avoid re-running queries whose results rarely change (such as the list of pool categories or a user's
+dashboard summary). Entries expire after a time-to-live and, for the in-process cache, the least recently used entry
+is evicted once the cache is full.
+
+The in-process cache is private to each worker process, and deleting an entry in one process leaves it in the others
+until its TTL runs out. Setting CACHE_REDIS_URL (e.g. redis://localhost:6379/0) makes the shared and per-user caches
+use a Redis compatible server instead, which all workers share; this requires the optional "redis" package. Neither
+per-user data (such as balances) nor newly created pool categories should be shown stale, so when WORKER_PROCESSES is
+more than one and there is no Redis server, both caches are turned off rather than kept in each process.
+
+Every cache counts its hits and misses (see stats()).
+'''
+
+
+class LocalCache:
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Returns the cached value for the key, or None if it is missing or expired
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            # Mark the entry as most recently used
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # Stores a value under the key, evicting the least recently used entry if the cache is full
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {"backend": "local", "hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+# Cache backed by a Redis compatible server, shared by every worker process
+# - Values are stored as JSON, so only JSON serializable values can be cached
+# - Keys are prefixed so that clear() only removes this cache's entries
+class RedisCache:
+    def __init__(self, url, prefix, ttl=300):
+        import redis
+
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._client.get(self.prefix + key)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, value):
+        self._client.setex(self.prefix + key, self.ttl, json.dumps(value))
+
+    def delete(self, key):
+        self._client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self._client.scan_iter(match=self.prefix + "*"):
+            self._client.delete(key)
+
+    def stats(self):
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses}
+
+
+# Cache which never holds anything, used in place of a per-process cache that other processes could not invalidate
+class NullCache:
+    def __init__(self):
+        self.misses = 0
+
+    def get(self, key):
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {"backend": "none", "hits": 0, "misses": self.misses}
+
+
+# Cache for data that is shared between all users (e.g. the pool category list)
+shared_cache = LocalCache()
+
+# Cache for per-user data (e.g. dashboard summaries)
+user_cache = LocalCache(max_size=10000, ttl=300)
+
+# Cache for rendered template fragments (see templating.py); their keys change whenever the data they show does, so
+# entries only expire to free memory
+fragment_cache = LocalCache(max_size=20000, ttl=3600)
+
+
+# Switches the shared and per-user caches to a Redis compatible server if CACHE_REDIS_URL is configured, or turns them
+# off if the app is served by more than one worker process without one
+# - The fragment cache stays in each process, since its keys change whenever the data they show does
+def init_app(app):
+    global shared_cache, user_cache
+
+    redis_url = app.config.get("CACHE_REDIS_URL")
+    if redis_url:
+        shared_cache = RedisCache(redis_url, "flask-bank:shared:", ttl=shared_cache.ttl)
+        user_cache = RedisCache(redis_url, "flask-bank:user:", ttl=user_cache.ttl)
+    elif app.config.get("WORKER_PROCESSES", 1) > 1:
+        shared_cache = NullCache()
+        user_cache = NullCache()
+
+
+def stats():
+    return {"shared": shared_cache.stats(), "user": user_cache.stats(), "fragment": fragment_cache.stats()}
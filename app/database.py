@@ -0,0 +1,146 @@
+import os
+
+import click
+from flask import current_app
+from flask.cli import ScriptInfo
+from sqlalchemy import event, inspect
+
+import analytics
+import ledger
+from models import db
+
+'''
+Database configuration. The backend and its connection pool are configured through environment variables so that
+the same code can run against the default SQLite file for a single node, or a server database such as PostgreSQL
+when several machines share the data.
+
+Environment variables:
+- DATABASE_URL: SQLAlchemy database URL (default sqlite:///db.sqlite3)
+- DATABASE_POOL_SIZE: connections kept open per worker process (server databases only)
+- DATABASE_MAX_OVERFLOW: extra connections allowed above the pool size when it is exhausted (server databases only)
+- DATABASE_POOL_RECYCLE: seconds after which a connection is replaced, for servers which drop idle connections
+- DATABASE_STATEMENT_TIMEOUT: milliseconds a single statement may run before the server cancels it
+  (PostgreSQL and MySQL)
+- SQLITE_JOURNAL_MODE: SQLite journal mode (default WAL, which lets readers carry on while a write is in progress)
+- SQLITE_SYNCHRONOUS: SQLite synchronous setting (default NORMAL, which is safe in WAL mode and much faster than FULL)
+- SQLITE_BUSY_TIMEOUT: milliseconds SQLite waits for a lock held by another process before giving up (default 5000)
+- SQLITE_MMAP_SIZE: bytes of the database file SQLite may memory map (default 256MB)
+
+The app never changes the schema while starting up, since every worker process would otherwise run the check (and
+possibly the DDL) at once. "flask init-db" creates the schema or upgrades it to the latest migration, and has to be
+run before the app is first started and after deploying new migrations.
+'''
+
+DEFAULT_DATABASE_URL = "sqlite:///db.sqlite3"
+
+# The first migration, which creates the schema as the app created it before migrations were added
+BASELINE_REVISION = "0001"
+
+MIGRATIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def _int_from_environment(name, default=None):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return int(value)
+
+
+# Builds the create_engine() keyword arguments for the configured backend
+def engine_options(database_url):
+    options = {"pool_pre_ping": True}
+    connect_args = {}
+
+    pool_recycle = _int_from_environment("DATABASE_POOL_RECYCLE")
+    if pool_recycle is not None:
+        options["pool_recycle"] = pool_recycle
+
+    statement_timeout = _int_from_environment("DATABASE_STATEMENT_TIMEOUT")
+
+    if database_url.startswith("sqlite"):
+        # SQLite uses its own pool classes which do not accept a size, and has no statement timeout; waiting on
+        # locks is controlled by the busy_timeout pragma instead (see set_sqlite_pragmas)
+        return options
+
+    pool_size = _int_from_environment("DATABASE_POOL_SIZE")
+    if pool_size is not None:
+        options["pool_size"] = pool_size
+
+    max_overflow = _int_from_environment("DATABASE_MAX_OVERFLOW")
+    if max_overflow is not None:
+        options["max_overflow"] = max_overflow
+
+    if statement_timeout is not None:
+        if database_url.startswith("postgresql"):
+            connect_args["options"] = "-c statement_timeout=" + str(statement_timeout)
+        elif database_url.startswith("mysql"):
+            connect_args["init_command"] = "SET SESSION max_execution_time=" + str(statement_timeout)
+
+    if connect_args:
+        options["connect_args"] = connect_args
+
+    return options
+
+
+# Applies the configured pragmas to every new SQLite connection
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=" + os.environ.get("SQLITE_JOURNAL_MODE", "WAL"))
+    cursor.execute("PRAGMA synchronous=" + os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"))
+    cursor.execute("PRAGMA busy_timeout=" + str(_int_from_environment("SQLITE_BUSY_TIMEOUT", 5000)))
+    cursor.execute("PRAGMA mmap_size=" + str(_int_from_environment("SQLITE_MMAP_SIZE", 268435456)))
+    cursor.close()
+
+
+# Configures the database for the app; must be called before db.init_app()
+def configure(app):
+    database_url = os.environ.get("DATABASE_URL", DEFAULT_DATABASE_URL)
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_url)
+
+
+# Registers the connection listeners once the engine has been created; must be called after db.init_app()
+def init_app(app):
+    with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            event.listen(db.engine, "connect", set_sqlite_pragmas)
+
+
+# Registers the versioned migrations in migrations/ with Flask-Migrate (usage: flask db <command>)
+# - Flask-Migrate imports alembic, which takes longer to import than the rest of the app, so it is only imported here
+def init_migrations(app):
+    from flask_migrate import Migrate
+
+    Migrate(app, db, directory=MIGRATIONS_DIRECTORY, render_as_batch=True)
+
+
+# True when the app is being loaded by the flask command, rather than by a web server
+def loaded_by_flask_command():
+    context = click.get_current_context(silent=True)
+    return context is not None and context.find_object(ScriptInfo) is not None
+
+
+# Brings the database schema up to date with the migrations in migrations/ (usage: flask init-db)
+# - A database created by the app with db.create_all() before migrations were added has its tables but no
+#   alembic_version table; it is marked as being at the baseline revision, which is the schema the app created back
+#   then, so that every later migration is run on it
+# - Such a database's balances predate the ledger and its loans and contributions predate the analytics totals, so
+#   once it has been upgraded it is opened in the ledger and its analytics are rebuilt (as "flask open-ledger" and
+#   "flask rebuild-analytics" would)
+def upgrade_schema():
+    import flask_migrate
+
+    if "migrate" not in current_app.extensions:
+        init_migrations(current_app)
+
+    tables = inspect(db.engine).get_table_names()
+    created_before_migrations = "alembic_version" not in tables and "user" in tables
+    if created_before_migrations:
+        flask_migrate.stamp(revision=BASELINE_REVISION)
+
+    flask_migrate.upgrade()
+
+    if created_before_migrations:
+        ledger.open_accounts()
+        analytics.rebuild()
@@ -1,12 +1,16 @@
-import random
 import time
 from datetime import date
 
-from flask import Blueprint, request, url_for, redirect, flash, session
+from flask import Blueprint, request, url_for, redirect, flash, session, current_app
 import re
-import bcrypt
 
-from models import db, User, BankAccount, Pool, PoolContribution, LoanRequest, Loan
+import banking
+import jobs
+import loan_decisions
+from auth import get_current_user, login_required, bank_manager_required
+from passwords import hash_password, check_password, needs_rehash
+from money import parse_currency, format_currency
+from models import db, User, BankAccount, Pool, LoanRequest
 
 # Register the blueprint for this file
 form = Blueprint('form', __name__)
@@ -35,10 +39,16 @@ def attempt_login():
 
     # Check if the password from the database matches the password from the input box on the form
     # If it doesn't, display an error message
-    if not bcrypt.checkpw(password.encode("utf-8"), user.password):
+    if not check_password(password, user.password):
         flash("Your username/password is incorrect - please try again", "attempt_login_error")
         return redirect(url_for("main.login"))
 
+    # If the configured work factor has changed since the password was hashed, rehash it now that the plain text
+    # password is known
+    if needs_rehash(user.password):
+        user.password = hash_password(password)
+        db.session.commit()
+
     # Since the user passed all of the validation checks, give them the session variables required for site navigation
     session["user_id"] = user.id
     session["logged_in"] = True
@@ -67,7 +77,7 @@ def attempt_sign_up():
         return redirect(url_for("main.sign_up"))
 
     # Encrypt the user's password input
-    password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+    password = hash_password(password)
 
     # Create a user model to be possibly put into the database (pending validation)
     user = User(first_name, last_name, username, password)
@@ -76,19 +86,12 @@ def attempt_sign_up():
     db.session.add(user)
     db.session.commit()
 
-    # Query the user from the database so that their ID can be accessed and assigned to the session variable
-    user = User.query.filter_by(username=username).first()
+    # The user's ID is filled in by the database once the user is committed, so it can be assigned to the session
+    # variable without querying for the user again
     session["user_id"] = user.id
     session["logged_in"] = True
 
     # Now that the user is in the database, we will create a default bank account for them (checking)
-    # This loop generates a random account number for the bank account until it is found to be unique
-    # to all others in the database
-    while True:
-        account_number = random.randint(5000000000, 5999999999)
-        if not BankAccount.query.filter_by(account_number=account_number).first():
-            break
-
     # Create the bank account with a balance of 0 and add it to the database
     bank_account = BankAccount(user.id, "Checking", 0)
     db.session.add(bank_account)
@@ -100,18 +103,16 @@ def attempt_sign_up():
 
 # Pool Browser // Contribute to loan pool
 # - Creates a new contribution entry within the database and adds the funds to the pool the user contributed to
+# - The bank account and pool are updated in the database without reading them first (see banking.py), so two
+#   contributions made at the same time cannot overwrite each other
 @form.route("/contribute_to_pool", methods=["POST"])
 def contribute_to_pool():
     # Fetch the user's model from the database
-    user = User.query.filter_by(id=session["user_id"]).first()
+    user = get_current_user()
 
-    # Get the pool from the form
+    # Get the pool and the bank account the user would like to use from the form
     pool_id = request.form.get("pool_id")
-    pool = Pool.query.filter_by(id=pool_id).first()
-
-    # Get the bank account the user would like to use from the form
     bank_account_id = request.form.get("bank_account_select")
-    bank_account = BankAccount.query.filter_by(id=bank_account_id).first()
 
     # Get the amount the user would like to contribute from the text box
     amount_to_contribute = request.form.get("amount_to_contribute_input")
@@ -119,38 +120,33 @@ def contribute_to_pool():
     # Make sure the amountToContribute field is not blank and that the user entered a valid number
     if text_is_blank(amount_to_contribute):
         flash("You must enter an amount to continue.", "pool_form_error")
-        session["temp_pool_id"] = pool.id
+        session["temp_pool_id"] = pool_id
         return redirect(url_for("main.pool_contribution"))
 
     if text_is_not_currency(amount_to_contribute):
         flash("Please enter a valid number to continue.", "pool_form_error")
-        session["temp_pool_id"] = pool.id
+        session["temp_pool_id"] = pool_id
         return redirect(url_for("main.pool_contribution"))
 
-    # Now that checks are complete, convert amountToContribute from string to float
-    amount_to_contribute = float(amount_to_contribute)
-
-    # Make sure the user isn't trying to contribute more than they have in their bank account
-    if amount_to_contribute > bank_account.balance:
-        flash("You attempted to contribute more than you have in your bank account!", "pool_form_error")
-        session["temp_pool_id"] = pool.id
+    # Now that checks are complete, convert amountToContribute from string to cents
+    amount_to_contribute = parse_currency(amount_to_contribute)
+
+    # Move the funds from the bank account to the pool and create a new pool contribution entry
+    # - This fails if the user is trying to contribute more than they have in their bank account
+    try:
+        banking.contribute_to_pool(user.id, bank_account_id, pool_id, amount_to_contribute)
+    except banking.BankingError as error:
+        db.session.rollback()
+        flash(str(error), "pool_form_error")
+        session["temp_pool_id"] = pool_id
         return redirect(url_for("main.pool_contribution"))
 
-    # Add the amount contributed to the loan pool
-    pool.amount += amount_to_contribute
-
-    # Subtract the amount contributed from the user's bank account
-    bank_account.balance -= amount_to_contribute
-
-    # Create a new pool contribution entry
-    pool_contribution = PoolContribution(user.id, pool.id, amount_to_contribute)
-
     # Save all changes to the database
-    db.session.add(pool_contribution)
     db.session.commit()
 
     # Return the the pool browser page with a message of success
-    f_amount_to_contribute = "${:,.2f}".format(amount_to_contribute)
+    pool = Pool.query.filter_by(id=pool_id).first()
+    f_amount_to_contribute = format_currency(amount_to_contribute)
     flash("You have contributed " + f_amount_to_contribute + " to " + pool.name + "!", "pool_form_success")
     return redirect(url_for("main.pool_browser"))
 
@@ -160,7 +156,7 @@ def contribute_to_pool():
 @form.route("/create_loan_request", methods=["POST"])
 def create_loan_request():
     # Fetch the user's model from the database
-    user = User.query.filter_by(id=session["user_id"]).first()
+    user = get_current_user()
 
     # Get the pool from the form
     pool_id = request.form.get("pool_id")
@@ -184,8 +180,8 @@ def create_loan_request():
         session["temp_pool_id"] = pool.id
         return redirect(url_for("main.loan_request"))
 
-    # Now that checks are complete, convert amountToContribute from string to float
-    amount_to_request = float(amount_to_request)
+    # Now that checks are complete, convert amountToRequest from string to cents
+    amount_to_request = parse_currency(amount_to_request)
 
     # Make sure the user isn't trying to contribute more than they have in their bank account
     if amount_to_request > pool.amount:
@@ -196,23 +192,72 @@ def create_loan_request():
     # Create the loan request model
     loan_request = LoanRequest(user.id, bank_account_id, pool_id, amount_to_request)
 
-    # Save the loan request in the database
+    # Save the loan request in the database, along with a job for the background workers to decide on it
+    # (see loan_decisions.py)
     db.session.add(loan_request)
+    if current_app.config["LOAN_DECISION_QUEUE"]:
+        db.session.flush()
+        try:
+            loan_decisions.queue_decision(loan_request.id)
+        except jobs.QueueFull:
+            db.session.rollback()
+            flash("We are receiving a lot of loan requests right now - please try again in a few minutes.",
+                  "pool_form_error")
+            session["temp_pool_id"] = pool.id
+            return redirect(url_for("main.loan_request"))
     db.session.commit()
 
     # Return the the pool browser page with a message of success
-    f_amount_to_request = "${:,.2f}".format(amount_to_request)
+    f_amount_to_request = format_currency(amount_to_request)
     flash("You have requested " + f_amount_to_request + " from " + pool.name + "!", "pool_form_success")
     return redirect(url_for("main.pool_browser"))
 
 
+# Dashboard // Make loan payment
+# - Pays the amount entered towards one of the user's loans from the bank account they chose
+@form.route("/make_loan_payment", methods=["POST"])
+def make_loan_payment():
+    # Fetch the user's model from the database
+    user = get_current_user()
+
+    # Get the loan and the bank account the user would like to pay from from the form
+    loan_id = request.form.get("loan_id")
+    bank_account_id = request.form.get("bank_account_select")
+
+    # Get the amount the user would like to pay from the text box
+    amount_to_pay = request.form.get("amount_to_pay_input")
+
+    # Make sure the field is not blank and that the user entered a valid number
+    if text_is_blank(amount_to_pay) or text_is_not_currency(amount_to_pay):
+        flash("Please enter a valid number to continue.", "loan_payment_error")
+        session["temp_loan_id"] = loan_id
+        return redirect(url_for("main.loan_payment"))
+
+    amount_to_pay = parse_currency(amount_to_pay)
+
+    # Move the funds from the bank account back into the loan's pool and record the payment
+    try:
+        banking.make_loan_payment(user.id, loan_id, bank_account_id, amount_to_pay)
+    except banking.BankingError as error:
+        db.session.rollback()
+        flash(str(error), "loan_payment_error")
+        session["temp_loan_id"] = loan_id
+        return redirect(url_for("main.loan_payment"))
+
+    db.session.commit()
+
+    # Return to the dashboard with a message of success
+    flash("You have paid " + format_currency(amount_to_pay) + " towards your loan!", "loan_payment_success")
+    return redirect(url_for("main.dashboard"))
+
+
 # Account Management // Create new bank account
 # - Creates a new bank account in the database that is linked to the user via a foreign key
 # - Uses the name that the user inputs
 @form.route("/create_new_bank_account", methods=["POST"])
 def create_new_bank_account():
     # Fetch the user's model from the database
-    user = User.query.filter_by(id=session["user_id"]).first()
+    user = get_current_user()
 
     # Fetch the account name from the form
     account_name = request.form.get("bank_account_name_input")
@@ -222,13 +267,6 @@ def create_new_bank_account():
         flash("Please name your account to continue.", "create_new_bank_account_error")
         return redirect(url_for("main.account"))
 
-    # Loop generates random account numbers and checks the database for matching ones until a unique one is found
-    while True:
-        account_number = random.randint(5000000000, 5999999999)
-        account_exists = BankAccount.query.filter_by(account_number=account_number).first()
-        if not account_exists:
-            break
-
     # Create the new bank account starting with $0
     bank_account = BankAccount(user.id, account_name, 0)
 
@@ -251,7 +289,6 @@ def create_new_bank_account():
 def add_funds_to_bank_account():
     # Get the chosen bank account's id from the select element
     bank_account_id = request.form.get("bank_account_select")
-    bank_account = BankAccount.query.filter_by(id=bank_account_id).first()
 
     # Get the amount the user wants to add from the input box
     funds_to_add = request.form.get("add_funds_input")
@@ -261,15 +298,24 @@ def add_funds_to_bank_account():
         flash("Please enter a valid number to continue.", "add_funds_error")
         return redirect(url_for("main.account"))
 
-    # Convert fundsToAdd string to float
-    funds_to_add = float(funds_to_add)
+    # Convert fundsToAdd string to cents
+    funds_to_add = parse_currency(funds_to_add)
 
     # Add the amount to the user's bank account balance and update the database
-    bank_account.balance += funds_to_add
+    try:
+        banking.deposit(bank_account_id, funds_to_add)
+    except banking.BankingError as error:
+        db.session.rollback()
+        flash(str(error), "add_funds_error")
+        return redirect(url_for("main.account"))
+
     db.session.commit()
 
-    f_funds_to_add = "${:,.2f}".format(funds_to_add)
-    f_account_balance = "${:,.2f}".format(bank_account.balance)
+    # Fetch the bank account after the update so that the message shows its new balance
+    bank_account = BankAccount.query.filter_by(id=bank_account_id).first()
+
+    f_funds_to_add = format_currency(funds_to_add)
+    f_account_balance = format_currency(bank_account.balance)
     success_message = "You have added " + f_funds_to_add + " to " + bank_account.account_name + " [" + \
                       str(bank_account.account_number) + "]. It's balance is now " + f_account_balance + "!"
 
@@ -283,7 +329,7 @@ def add_funds_to_bank_account():
 @form.route("/update_user_information", methods=["POST"])
 def update_user_information():
     # Fetch the user's model from the database
-    user = User.query.filter_by(id=session["user_id"]).first()
+    user = get_current_user()
 
     # Get the information from the form
     first_name = request.form.get("first_name_input")
@@ -314,7 +360,7 @@ def update_user_information():
 @form.route("/update_user_password", methods=["POST"])
 def update_user_password():
     # Fetch the user's model from the database
-    user = User.query.filter_by(id=session["user_id"]).first()
+    user = get_current_user()
 
     # Get all fields from the form
     current_password = request.form.get("current_password_input")
@@ -328,7 +374,7 @@ def update_user_password():
 
     # Check if the current password input matches the user's password in the database
     # If it doesn't, send the user an error message
-    if not bcrypt.checkpw(current_password.encode("utf-8"), user.password):
+    if not check_password(current_password, user.password):
         flash("The password you've entered under 'Current Password' is incorrect.", "update_user_password_error")
         return redirect(url_for("main.account"))
 
@@ -338,7 +384,7 @@ def update_user_password():
         return redirect(url_for("main.account"))
 
     # Set the user's new password on the database model and update the database to reflect the changes
-    user.password = bcrypt.hashpw(new_password.encode("utf-8"), bcrypt.gensalt())
+    user.password = hash_password(new_password)
     db.session.commit()
 
     # Let the user know that the operation was successful
@@ -351,6 +397,8 @@ def update_user_password():
 # - Validate them
 # - Create new pool model and commit to database
 @form.route("/create_new_loan_pool", methods=["POST"])
+@login_required
+@bank_manager_required
 def create_new_loan_pool():
     # Get all fields from the form
     pool_name = request.form.get("pool_name_input")
@@ -368,49 +416,51 @@ def create_new_loan_pool():
         return redirect(url_for("main.bank_management"))
 
     # Create pool model and commit to the database
-    pool = Pool(pool_name, pool_category, float(starting_amount))
-    db.session.add(pool)
+    pool = banking.create_pool(pool_name, pool_category, parse_currency(starting_amount))
     db.session.commit()
 
+    # A new pool may have added a new category, so the cached category list has to be rebuilt
+    Pool.invalidate_categories()
+
     # Return with a message of success
-    success_message = "You have created " + pool.name + " [" + pool.category + "] with a starting amount of " + "${:,.2f}".format(
+    success_message = "You have created " + pool.name + " [" + pool.category + "] with a starting amount of " + format_currency(
         pool.amount)
     flash(success_message, "create_new_pool_success")
     return redirect(url_for("main.bank_management"))
 
 
 # Bank Management // Approve loan request
-# -
-@form.route("/approve_loan_request", methods=["GET", "POST"])
+# - Takes the amount of the loan request out of the pool, pays it into the requester's bank account and creates the
+#   loan (see banking.approve_loan_request)
+# - If no interest rate is entered, 2% is used
+@form.route("/approve_loan_request", methods=["POST"])
+@login_required
+@bank_manager_required
 def approve_loan_request():
-    # Fetch the user's model from the database
-    user = User.query.filter_by(id=session["user_id"]).first()
-
-    # Get the loan request id from the hidden input and use it to fetch the loan request model from the database
+    # Get the loan request id from the hidden input
     loan_request_id = request.form.get("loan_request_id")
-    loan_request = LoanRequest.query.filter_by(id=loan_request_id).first()
-
-    # Get the pool id from the hidden input and use it to fetch the loan request model from the database
-    pool_id = request.form.get("pool_id")
-    pool = Pool.query.filter_by(id=pool_id).first()
 
     # Get the interest rate and due date from the input boxes
     interest_rate = request.form.get("interest_rate_input")
     due_date = request.form.get("due_date_input")
 
-    # Convert the due date into an array and use the elements of the array to determine the unix time equivalent
-    due_date_arr = due_date.split("-")
-    d = date(int(due_date_arr[0]), int(due_date_arr[1]), int(due_date_arr[2]))
-    due_date = time.mktime(d.timetuple())
+    if text_is_blank(interest_rate):
+        interest_rate = "2"
+
+    if text_is_not_interest_rate(interest_rate) or text_is_blank(due_date):
+        flash("Please enter a valid interest rate and due date.", "approve_loan_request_error")
+        return redirect(url_for("main.bank_management"))
 
-    # Subtract the amount being loaned from the loan pool
-    pool.amount -= loan_request.amount
+    due_date = date_to_unix_time(due_date)
+
+    # Move the funds, create the loan, delete the loan request from the database, and save changes to the database
+    try:
+        banking.approve_loan_request(loan_request_id, float(interest_rate), due_date)
+    except banking.BankingError as error:
+        db.session.rollback()
+        flash(str(error), "approve_loan_request_error")
+        return redirect(url_for("main.bank_management"))
 
-    # Create the loan model, add it to the database session, delete the loan request from the database, and save
-    # changes to the database
-    loan = Loan(user.id, loan_request.amount, loan_request.amount, due_date, interest_rate)
-    db.session.add(loan)
-    db.session.delete(loan_request)
     db.session.commit()
 
     # Send a success message to the user
@@ -424,6 +474,8 @@ def approve_loan_request():
 # Bank Management // Deny loan request
 # - Deletes the chosen loan request from the database
 @form.route("/deny_loan_request", methods=["POST"])
+@login_required
+@bank_manager_required
 def deny_loan_request():
     # Get the ID for the loan request from the hidden field within the form
     loan_request_id = request.form.get("loan_request_id")
@@ -436,6 +488,61 @@ def deny_loan_request():
     return redirect(url_for("main.bank_management"))
 
 
+# Bank Management // Approve or deny the selected loan requests
+# - Every selected request is approved with the same interest rate and due date (2% if no rate is entered), or denied
+# - All of them are handled in one transaction: if any of them cannot be approved, none of them are
+@form.route("/manage_loan_requests", methods=["POST"])
+@login_required
+@bank_manager_required
+def manage_loan_requests():
+    # Get the ids of the ticked loan requests and whether the approve or the deny button was pressed
+    loan_request_ids = request.form.getlist("loan_request_ids")
+    action = request.form.get("action")
+
+    if not loan_request_ids:
+        flash("Please select at least one loan request.", "approve_loan_request_error")
+        return redirect(url_for("main.bank_management"))
+
+    if action == "deny":
+        denied = banking.deny_loan_requests(loan_request_ids)
+        db.session.commit()
+
+        flash("Denied " + str(denied) + " loan request(s).", "approve_loan_request_success")
+        return redirect(url_for("main.bank_management"))
+
+    # Get the interest rate and due date shared by the loans from the input boxes
+    interest_rate = request.form.get("interest_rate_input")
+    due_date = request.form.get("due_date_input")
+
+    if text_is_blank(interest_rate):
+        interest_rate = "2"
+
+    if text_is_not_interest_rate(interest_rate) or text_is_blank(due_date):
+        flash("Please enter a valid interest rate and due date.", "approve_loan_request_error")
+        return redirect(url_for("main.bank_management"))
+
+    # Move the funds, create the loans and delete the loan requests, then save changes to the database
+    try:
+        approved = banking.approve_loan_requests(loan_request_ids, float(interest_rate), date_to_unix_time(due_date))
+    except banking.BankingError as error:
+        db.session.rollback()
+        flash(str(error), "approve_loan_request_error")
+        return redirect(url_for("main.bank_management"))
+
+    db.session.commit()
+
+    flash("Approved " + str(approved) + " loan request(s)!", "approve_loan_request_success")
+    return redirect(url_for("main.bank_management"))
+
+
+# Converts a date from a date input (YYYY-MM-DD) to the unix time of its start
+def date_to_unix_time(text):
+    # Convert the date into an array and use the elements of the array to determine the unix time equivalent
+    date_arr = text.split("-")
+    d = date(int(date_arr[0]), int(date_arr[1]), int(date_arr[2]))
+    return int(time.mktime(d.timetuple()))
+
+
 # Validation function to check if the text passed is blank
 def text_is_blank(text):
     if text is None or text == "":
@@ -449,3 +556,10 @@ def text_is_not_currency(text):
     if not re.match(r'^[1-9]\d*(\.\d{1,2})?$', text):
         return True
     return False
+
+
+# Validation function to check if the text passed is a valid interest rate
+# - Text must be a number in the same forms as currency, within the bounds every approval is checked against (see
+#   banking.is_valid_interest_rate)
+def text_is_not_interest_rate(text):
+    return text_is_not_currency(text) or not banking.is_valid_interest_rate(float(text))
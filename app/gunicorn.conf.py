@@ -0,0 +1,27 @@
+import os
+
+import warmup
+
+'''
+gunicorn configuration (usage, from this directory: gunicorn). The app is loaded once in the master process and then
+forked into the workers, after being warmed up (see warmup.py). Run "flask init-db" before starting it for the first
+time and after deploying new migrations.
+
+Environment variables:
+- BIND: address to listen on (default 127.0.0.1:8000)
+- WEB_CONCURRENCY: number of worker processes (default 4)
+'''
+
+wsgi_app = "__init__:create_app()"
+bind = os.environ.get("BIND", "127.0.0.1:8000")
+# Kept in the environment so that the app knows it is served by several processes (see cache.py)
+workers = int(os.environ.setdefault("WEB_CONCURRENCY", "4"))
+preload_app = True
+
+
+def when_ready(server):
+    warmup.warm(server.app.wsgi())
+
+
+def post_worker_init(worker):
+    warmup.warm_worker(worker.wsgi)
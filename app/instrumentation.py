@@ -0,0 +1,256 @@
+import hmac
+import logging
+import os
+import threading
+import time
+
+from flask import abort, g, has_request_context, request, current_app
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from auth import get_current_user
+
+'''
+Request instrumentation, switched on through the app's configuration. Everything here is off by default.
+
+SQL_STATEMENT_COUNT: every SQL statement run while handling a request is counted, and the total is logged and returned
+to the client in the X-SQL-Statements header. This makes it easy to spot views which run more queries than they should
+(e.g. lazy loading in a loop).
+
+PERFORMANCE_METRICS: for every endpoint, the wall time of each request, the number of SQL statements and the time
+spent running them, the time spent rendering templates and the time spent hashing passwords (see passwords.py) are
+added up and served in the Prometheus text format at /metrics. The figures are kept in memory by each worker process,
+so each process reports its own. The response also gets a Server-Timing header with the same figures, which browsers
+show in their developer tools. The cost is a few clock reads per statement and per template, plus one short lock per
+request. /metrics is only served to requests sending "Authorization: Bearer <METRICS_TOKEN>" when METRICS_TOKEN is
+set (e.g. for a Prometheus scraper), or otherwise to a logged in bank manager.
+
+SLOW_QUERY_THRESHOLD: statements which take at least this many seconds are written to the slow query log together with
+their bound parameters and the endpoint that ran them. The log goes to the "slow_queries" logger, and also to the file
+named by SLOW_QUERY_LOG if that is set.
+'''
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("slow_queries")
+
+# Upper bounds (in seconds) of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Set by init_app(); statements are only timed when one of these features is on
+_slow_query_threshold = None
+_timing_enabled = False
+
+_lock = threading.Lock()
+_endpoint_metrics = {}
+_slow_query_count = 0
+
+
+# Running totals for the requests handled by one endpoint
+class EndpointMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.duration_buckets = [0] * len(DURATION_BUCKETS)
+        self.duration_seconds = 0.0
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.password_hashing_seconds = 0.0
+
+
+# Counts a SQL statement against the current request (statements run outside of a request are ignored) and starts
+# timing it if statements are being timed
+@event.listens_for(Engine, "before_cursor_execute")
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "sql_statement_count" in g:
+        g.sql_statement_count += 1
+
+    if _timing_enabled:
+        conn.info.setdefault("statement_start_times", []).append(time.perf_counter())
+
+
+# Adds the statement's run time to the current request and logs it if it was slow
+@event.listens_for(Engine, "after_cursor_execute")
+def time_statement(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get("statement_start_times")
+    if not start_times:
+        return
+
+    elapsed = time.perf_counter() - start_times.pop()
+
+    in_request = has_request_context()
+    if in_request and "sql_seconds" in g:
+        g.sql_seconds += elapsed
+
+    if _slow_query_threshold is not None and elapsed >= _slow_query_threshold:
+        _log_slow_query(elapsed, statement, parameters, request.endpoint if in_request else None)
+
+
+# Stops timing a statement which failed, since after_cursor_execute is not called for it
+@event.listens_for(Engine, "handle_error")
+def discard_failed_statement(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("statement_start_times"):
+        connection.info["statement_start_times"].pop()
+
+
+def _log_slow_query(elapsed, statement, parameters, endpoint):
+    global _slow_query_count
+    with _lock:
+        _slow_query_count += 1
+
+    slow_query_logger.warning("%.1f ms [%s] %s | parameters: %r", elapsed * 1000, endpoint or "-",
+                              " ".join(statement.split()), parameters)
+
+
+# Template class used by the app's Jinja environment when metrics are on, which adds its render time to the request
+# - Included templates are rendered as part of the template that includes them, so they are not counted twice
+class TimedTemplate(Template):
+    def render(self, *args, **kwargs):
+        if not (has_request_context() and "template_seconds" in g):
+            return super().render(*args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            g.template_seconds += time.perf_counter() - start
+
+
+# Adds time spent hashing or checking a password to the current request (called by passwords.py)
+def record_password_hashing(seconds):
+    if has_request_context() and "password_hashing_seconds" in g:
+        g.password_hashing_seconds += seconds
+
+
+def start_request():
+    g.sql_statement_count = 0
+
+
+def finish_request(response):
+    if "sql_statement_count" in g:
+        logger.debug("%s %s ran %d SQL statement(s)", request.method, request.path, g.sql_statement_count)
+        response.headers["X-SQL-Statements"] = str(g.sql_statement_count)
+    return response
+
+
+def start_timing_request():
+    g.request_started = time.perf_counter()
+    g.sql_statement_count = 0
+    g.sql_seconds = 0.0
+    g.template_seconds = 0.0
+    g.password_hashing_seconds = 0.0
+
+
+def finish_timing_request(response):
+    if "request_started" not in g:
+        return response
+
+    duration = time.perf_counter() - g.request_started
+    endpoint = request.endpoint or "unknown"
+
+    with _lock:
+        metrics = _endpoint_metrics.get(endpoint)
+        if metrics is None:
+            metrics = _endpoint_metrics[endpoint] = EndpointMetrics()
+
+        metrics.requests += 1
+        metrics.duration_seconds += duration
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if duration <= bound:
+                metrics.duration_buckets[index] += 1
+                break
+        metrics.sql_statements += g.sql_statement_count
+        metrics.sql_seconds += g.sql_seconds
+        metrics.template_seconds += g.template_seconds
+        metrics.password_hashing_seconds += g.password_hashing_seconds
+
+    response.headers["Server-Timing"] = "sql;dur=%.1f, template;dur=%.1f, password;dur=%.1f, total;dur=%.1f" % (
+        g.sql_seconds * 1000, g.template_seconds * 1000, g.password_hashing_seconds * 1000, duration * 1000)
+    return response
+
+
+def _labels(endpoint):
+    return '{endpoint="' + endpoint.replace("\\", "\\\\").replace('"', '\\"') + '"}'
+
+
+# Returns the collected metrics in the Prometheus text exposition format
+def render_metrics():
+    with _lock:
+        snapshot = {endpoint: vars(metrics).copy() for endpoint, metrics in _endpoint_metrics.items()}
+        slow_queries = _slow_query_count
+
+    lines = []
+
+    def counter(name, help_text, field):
+        lines.append("# HELP " + name + " " + help_text)
+        lines.append("# TYPE " + name + " counter")
+        for endpoint, values in sorted(snapshot.items()):
+            lines.append(name + _labels(endpoint) + " " + repr(values[field]))
+
+    lines.append("# HELP flaskbank_request_duration_seconds Wall time of each request")
+    lines.append("# TYPE flaskbank_request_duration_seconds histogram")
+    for endpoint, values in sorted(snapshot.items()):
+        labels = _labels(endpoint)[:-1]
+        cumulative = 0
+        for bound, count in zip(DURATION_BUCKETS, values["duration_buckets"]):
+            cumulative += count
+            lines.append('flaskbank_request_duration_seconds_bucket' + labels + ',le="' + repr(bound) + '"} ' +
+                         str(cumulative))
+        lines.append('flaskbank_request_duration_seconds_bucket' + labels + ',le="+Inf"} ' + str(values["requests"]))
+        lines.append("flaskbank_request_duration_seconds_sum" + _labels(endpoint) + " " +
+                     repr(values["duration_seconds"]))
+        lines.append("flaskbank_request_duration_seconds_count" + _labels(endpoint) + " " + str(values["requests"]))
+
+    counter("flaskbank_sql_statements_total", "SQL statements run", "sql_statements")
+    counter("flaskbank_sql_seconds_total", "Time spent running SQL statements", "sql_seconds")
+    counter("flaskbank_template_seconds_total", "Time spent rendering templates", "template_seconds")
+    counter("flaskbank_password_hashing_seconds_total", "Time spent hashing and checking passwords",
+            "password_hashing_seconds")
+
+    lines.append("# HELP flaskbank_slow_queries_total SQL statements slower than SLOW_QUERY_THRESHOLD")
+    lines.append("# TYPE flaskbank_slow_queries_total counter")
+    lines.append("flaskbank_slow_queries_total " + str(slow_queries))
+
+    return "\n".join(lines) + "\n"
+
+
+# Serves the metrics to a client with the metrics token, or to a bank manager if no token is configured
+def metrics_view():
+    token = current_app.config.get("METRICS_TOKEN")
+    if token:
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), "Bearer " + token):
+            abort(403)
+    else:
+        user = get_current_user()
+        if not (user and user.is_bank_manager):
+            abort(403)
+
+    return current_app.response_class(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+# Turns on the features enabled in the app's configuration
+def init_app(app):
+    global _slow_query_threshold, _timing_enabled
+
+    if app.config.get("SQL_STATEMENT_COUNT"):
+        app.before_request(start_request)
+        app.after_request(finish_request)
+
+    if app.config.get("PERFORMANCE_METRICS"):
+        app.before_request(start_timing_request)
+        app.after_request(finish_timing_request)
+        app.jinja_env.template_class = TimedTemplate
+        app.add_url_rule("/metrics", "metrics", metrics_view)
+
+    _slow_query_threshold = app.config.get("SLOW_QUERY_THRESHOLD")
+    # The logger is shared by every app in the process, so a file it already writes to is not added a second time
+    if _slow_query_threshold is not None and app.config.get("SLOW_QUERY_LOG"):
+        path = os.path.abspath(app.config["SLOW_QUERY_LOG"])
+        if not any(isinstance(handler, logging.FileHandler) and handler.baseFilename == path
+                   for handler in slow_query_logger.handlers):
+            handler = logging.FileHandler(path)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            slow_query_logger.addHandler(handler)
+
+    _timing_enabled = bool(app.config.get("PERFORMANCE_METRICS")) or _slow_query_threshold is not None
@@ -0,0 +1,237 @@
+import json
+import multiprocessing
+import os
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func
+
+from models import db, Job
+
+'''
+Durable background job queue, stored in the "job" table of the app's own database so that it needs no other server.
+
+Jobs are added with enqueue() inside the transaction that creates the work, so a job exists if and only if that
+transaction commits. Workers ("flask jobs work") claim the oldest queued job with a conditional UPDATE, so two workers
+can never claim the same job, then run its handler and mark it done in one transaction: either the handler's changes
+and the "done" status are both saved or neither is. A job whose handler raises is retried up to JOB_MAX_ATTEMPTS
+times, and a job left running by a worker that died is queued again after JOB_TIMEOUT seconds.
+
+Backpressure: once JOB_QUEUE_MAX_DEPTH jobs are waiting, enqueue() raises QueueFull and the caller should ask the
+client to try again later rather than letting the queue grow without bound. Finished jobs are kept, for the metrics,
+until "flask jobs purge" deletes them.
+
+Handlers are registered with register(kind, function); the function receives the job's payload dictionary and may
+return a short string which is saved as the job's result.
+'''
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Job kind -> function run by the workers
+HANDLERS = {}
+
+
+# Raised by enqueue() when the queue already holds JOB_QUEUE_MAX_DEPTH jobs
+class QueueFull(Exception):
+    pass
+
+
+def register(kind, function):
+    HANDLERS[kind] = function
+
+
+# Number of jobs waiting to be claimed by a worker
+def queue_depth():
+    return Job.query.filter(Job.status == QUEUED).count()
+
+
+# Adds a job to the queue as part of the current transaction (the caller commits)
+def enqueue(kind, payload):
+    max_depth = current_app.config.get("JOB_QUEUE_MAX_DEPTH")
+    if max_depth and queue_depth() >= max_depth:
+        raise QueueFull("The job queue is full.")
+
+    job = Job(kind, json.dumps(payload, separators=(",", ":")), time.time())
+    db.session.add(job)
+    return job
+
+
+# Claims the oldest queued job for the worker and returns it, or None if the queue is empty
+# - Returns False if another worker claimed the same job first, in which case the caller should simply try again
+def _claim(worker):
+    job_id = db.session.query(Job.id).filter(Job.status == QUEUED).order_by(Job.id).limit(1).scalar()
+    if job_id is None:
+        db.session.rollback()
+        return None
+
+    claimed = Job.query.filter(Job.id == job_id, Job.status == QUEUED) \
+        .update({Job.status: RUNNING, Job.worker: worker, Job.started_at: time.time(), Job.attempts: Job.attempts + 1},
+                synchronize_session=False)
+    db.session.commit()
+
+    if not claimed:
+        return False
+
+    return Job.query.get(job_id)
+
+
+# Runs the job's handler and saves its changes together with the job's new status
+def _run(job):
+    try:
+        result = HANDLERS[job.kind](json.loads(job.payload))
+        Job.query.filter(Job.id == job.id) \
+            .update({Job.status: DONE, Job.finished_at: time.time(), Job.result: result}, synchronize_session=False)
+        db.session.commit()
+    except Exception as error:
+        db.session.rollback()
+        current_app.logger.exception("Job " + str(job.id) + " (" + job.kind + ") failed")
+
+        failed = job.attempts >= current_app.config.get("JOB_MAX_ATTEMPTS", 3)
+        Job.query.filter(Job.id == job.id).update({
+            Job.status: FAILED if failed else QUEUED,
+            Job.finished_at: time.time() if failed else None,
+            Job.error: str(error)[:500]
+        }, synchronize_session=False)
+        db.session.commit()
+
+
+# Queues jobs again which have been running for longer than JOB_TIMEOUT (their worker most likely died)
+def requeue_stale():
+    timeout = current_app.config.get("JOB_TIMEOUT", 300)
+    requeued = Job.query.filter(Job.status == RUNNING, Job.started_at < time.time() - timeout) \
+        .update({Job.status: QUEUED}, synchronize_session=False)
+    db.session.commit()
+    return requeued
+
+
+# Deletes jobs which finished (done or failed) more than age seconds ago and returns how many there were
+def purge(age):
+    purged = Job.query.filter(Job.status.in_([DONE, FAILED]), Job.finished_at < time.time() - age) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return purged
+
+
+# Claims and runs jobs until the queue is empty (if stop_when_empty) or forever, waiting poll_interval seconds
+# whenever there is nothing to do
+# - Returns the number of jobs run
+def work(worker, stop_when_empty=False, poll_interval=1.0):
+    processed = 0
+    while True:
+        job = _claim(worker)
+        if job is False:
+            continue
+
+        if job is None:
+            if stop_when_empty:
+                return processed
+            requeue_stale()
+            time.sleep(poll_interval)
+            continue
+
+        _run(job)
+        processed += 1
+
+
+# Entry point of each worker process; the app is inherited from the parent process when it forks
+def _worker_process(app, number, stop_when_empty, poll_interval):
+    with app.app_context():
+        # Connections must not be shared with the parent process, so the child opens its own
+        db.engine.dispose()
+        work(str(os.getpid()) + "-" + str(number), stop_when_empty, poll_interval)
+
+
+# Returns the queue's metrics over the last window seconds: the number of jobs in each status, how long the oldest
+# queued job has been waiting, the average and longest wait and run times and the throughput of each worker
+def metrics(window=300):
+    now = time.time()
+
+    counts = dict(db.session.query(Job.status, func.count(Job.id)).group_by(Job.status))
+    oldest_queued = db.session.query(func.min(Job.created_at)).filter(Job.status == QUEUED).scalar()
+
+    wait = Job.started_at - Job.created_at
+    run = Job.finished_at - Job.started_at
+    recent = db.session.query(Job).filter(Job.status == DONE, Job.finished_at >= now - window)
+    count, average_wait, longest_wait, average_run, longest_run = recent.with_entities(
+        func.count(Job.id), func.avg(wait), func.max(wait), func.avg(run), func.max(run)
+    ).one()
+
+    workers = recent.with_entities(Job.worker, func.count(Job.id)).group_by(Job.worker)
+
+    return {
+        "queued": counts.get(QUEUED, 0),
+        "running": counts.get(RUNNING, 0),
+        "done": counts.get(DONE, 0),
+        "failed": counts.get(FAILED, 0),
+        "oldest_queued_age": round(now - oldest_queued, 3) if oldest_queued is not None else 0,
+        "window": window,
+        "completed_in_window": count,
+        "jobs_per_second": round(count / window, 3),
+        "average_wait": round(average_wait or 0, 3),
+        "longest_wait": round(longest_wait or 0, 3),
+        "average_run": round(average_run or 0, 3),
+        "longest_run": round(longest_run or 0, 3),
+        "workers": {worker: round(completed / window, 3) for worker, completed in workers}
+    }
+
+
+'''
+Command line interface (usage: flask jobs <command>)
+    flask jobs work --workers 4      runs a pool of worker processes until stopped
+    flask jobs work --drain          runs jobs until the queue is empty, then exits
+    flask jobs stats                 prints the queue's metrics
+    flask jobs purge --age 604800    deletes jobs which finished more than a week ago
+'''
+
+
+@click.group()
+def jobs():
+    """Runs and inspects the background job queue."""
+
+
+@jobs.command("work")
+@click.option("--workers", default=1, help="Number of worker processes (more than one needs a platform with fork).")
+@click.option("--drain", is_flag=True, help="Exit once the queue is empty instead of waiting for more jobs.")
+@click.option("--poll-interval", default=1.0, help="Seconds to wait between checks of an empty queue.")
+@with_appcontext
+def work_command(workers, drain, poll_interval):
+    requeue_stale()
+
+    if workers == 1:
+        processed = work(str(os.getpid()), drain, poll_interval)
+        print("Ran " + str(processed) + " job(s)")
+        return
+
+    # Close this process's connections so that the workers do not inherit them
+    db.engine.dispose()
+
+    app = current_app._get_current_object()
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_worker_process, args=(app, number, drain, poll_interval))
+                 for number in range(workers)]
+
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+@jobs.command("stats")
+@click.option("--window", default=300, help="Number of seconds the latency and throughput figures cover.")
+@with_appcontext
+def stats_command(window):
+    for name, value in metrics(window).items():
+        print(name + ": " + str(value))
+
+
+@jobs.command("purge")
+@click.option("--age", default=7 * 86400, help="Seconds since finishing after which done and failed jobs are deleted.")
+@with_appcontext
+def purge_command(age):
+    purged = purge(age)
+    print("Deleted " + str(purged) + " finished job(s)")
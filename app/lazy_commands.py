@@ -0,0 +1,25 @@
+import importlib
+
+import click
+
+'''
+Command line commands whose modules are only imported when they are run. Commands such as "flask benchmark" pull in
+modules (and libraries like NumPy) that serving requests never needs, so registering them through LazyCommand keeps
+them out of every web worker's startup.
+'''
+
+
+# Stands in for the click command at import_name ("module:attribute") until it is run
+# - help is shown in the "flask --help" list, which is built without importing the module
+class LazyCommand(click.Command):
+    def __init__(self, name, import_name, help):
+        super().__init__(name, help=help, short_help=help)
+        self.import_name = import_name
+
+    def load(self):
+        module_name, attribute = self.import_name.split(":")
+        return getattr(importlib.import_module(module_name), attribute)
+
+    # The real command parses the arguments, so that the context it returns is the one that gets invoked
+    def make_context(self, info_name, args, parent=None, **extra):
+        return self.load().make_context(info_name, args, parent=parent, **extra)
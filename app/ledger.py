@@ -0,0 +1,126 @@
+import time
+import uuid
+
+from sqlalchemy import func
+
+from models import db, BankAccount, Pool, LedgerEntry, BalanceSnapshot
+
+'''
+Double-entry transaction ledger. Every money movement made through banking.py is also written here as a pair of
+entries which are never changed afterwards, so the history of any bank account or pool can be rebuilt. The balance
+columns on BankAccount and Pool are still kept up to date, and are what the rest of the app reads.
+
+Every SNAPSHOT_INTERVAL entries on an account, the account's balance is written to balance_snapshot. A balance (now or
+at any time in the past) is then the latest snapshot before that time plus the entries written after it, which is at
+most SNAPSHOT_INTERVAL rows no matter how long the account's history is.
+
+Snapshots are consistent because every movement first updates the account's balance row, which locks it until the
+transaction ends, so no other transaction can write entries for the same account while a snapshot is being taken.
+'''
+
+BANK_ACCOUNT = "bank_account"
+POOL = "pool"
+EXTERNAL = "external"  # Money entering or leaving the bank (deposits, opening balances); has no snapshots
+
+SNAPSHOT_INTERVAL = 100
+
+
+# Writes a movement of amount from the debit account to the credit account; accounts are (type, id) tuples
+def record_transfer(debit_account, credit_account, amount, memo):
+    record_transfers([(debit_account, credit_account, amount, memo)])
+
+
+# Writes many movements at once; transfers is a list of (debit account, credit account, amount, memo) tuples
+# - The entries are inserted in one executemany round trip, and then every account they were written to is checked
+#   for a due snapshot, which only reads the entries written since the account's latest snapshot
+def record_transfers(transfers):
+    created_at = int(time.time())
+
+    entries = []
+    accounts = set()
+    for debit_account, credit_account, amount, memo in transfers:
+        transaction_id = uuid.uuid4().hex
+        for account, signed_amount in ((debit_account, -amount), (credit_account, amount)):
+            entries.append({"transaction_id": transaction_id, "account_type": account[0], "account_id": account[1],
+                            "amount": signed_amount, "memo": memo, "created_at": created_at})
+            if account[0] != EXTERNAL:
+                accounts.add(account)
+
+    db.session.bulk_insert_mappings(LedgerEntry, entries)
+
+    for account in sorted(accounts):
+        _snapshot_if_due(account)
+
+
+def _latest_snapshot(account, at=None):
+    query = BalanceSnapshot.query.filter_by(account_type=account[0], account_id=account[1])
+    if at is not None:
+        query = query.filter(BalanceSnapshot.created_at <= at)
+    return query.order_by(BalanceSnapshot.created_at.desc(), BalanceSnapshot.entry_id.desc()).first()
+
+
+# Entries for the account written after the snapshot (or all of them if there is no snapshot)
+def _entries_after(account, snapshot):
+    query = LedgerEntry.query.filter(LedgerEntry.account_type == account[0], LedgerEntry.account_id == account[1])
+    if snapshot is not None:
+        query = query.filter(LedgerEntry.created_at >= snapshot.created_at, LedgerEntry.id > snapshot.entry_id)
+    return query
+
+
+# Writes a snapshot of the account's balance if SNAPSHOT_INTERVAL entries have been written since its latest one
+# - The latest snapshot is found through ix_balance_snapshot_account_time and the entries after it through
+#   ix_ledger_entry_account_time, so this reads at most about SNAPSHOT_INTERVAL rows however long the history is
+def _snapshot_if_due(account):
+    snapshot = _latest_snapshot(account)
+    tail = _entries_after(account, snapshot)
+
+    count, total, last_entry_id, last_created_at = tail.with_entities(
+        func.count(LedgerEntry.id), func.coalesce(func.sum(LedgerEntry.amount), 0),
+        func.max(LedgerEntry.id), func.max(LedgerEntry.created_at)
+    ).one()
+
+    if count >= SNAPSHOT_INTERVAL:
+        opening = snapshot.balance if snapshot else 0
+        db.session.add(BalanceSnapshot(account[0], account[1], last_entry_id, opening + total, last_created_at))
+
+
+# Returns the balance of the account according to the ledger, either now or at the given Unix time
+def balance(account, at=None):
+    snapshot = _latest_snapshot(account, at)
+    tail = _entries_after(account, snapshot)
+    if at is not None:
+        tail = tail.filter(LedgerEntry.created_at <= at)
+
+    total = tail.with_entities(func.coalesce(func.sum(LedgerEntry.amount), 0)).scalar()
+    return (snapshot.balance if snapshot else 0) + total
+
+
+# Returns the account's opening balance and the entries written between the start and end Unix times
+def statement(account, start, end):
+    opening_balance = balance(account, start - 1)
+    entries = LedgerEntry.query \
+        .filter(LedgerEntry.account_type == account[0], LedgerEntry.account_id == account[1],
+                LedgerEntry.created_at >= start, LedgerEntry.created_at <= end) \
+        .order_by(LedgerEntry.created_at, LedgerEntry.id) \
+        .all()
+
+    return opening_balance, entries
+
+
+# Writes an opening balance entry for every bank account and pool which has a balance but no ledger entries yet
+# (i.e. those created before the ledger existed), so that the ledger agrees with the balance columns
+# - Returns the number of accounts that were opened
+def open_accounts():
+    opened = 0
+    for account_type, model, column in ((BANK_ACCOUNT, BankAccount, BankAccount.balance), (POOL, Pool, Pool.amount)):
+        has_entries = db.session.query(LedgerEntry.id) \
+            .filter(LedgerEntry.account_type == account_type, LedgerEntry.account_id == model.id) \
+            .exists()
+
+        rows = db.session.query(model.id, column).filter(column != 0, ~has_entries).all()
+        for account_id, amount in rows:
+            record_transfer((EXTERNAL, 0), (account_type, account_id), amount, "Opening balance")
+            opened += 1
+
+    db.session.commit()
+    return opened
@@ -0,0 +1,62 @@
+import time
+
+from flask import current_app
+from sqlalchemy import func
+
+import banking
+import jobs
+from models import db, Pool, Loan, LoanRequest
+
+'''
+Automatic decisions on loan requests, run by the background workers (see jobs.py) instead of inside the request that
+created the loan request.
+
+- A request for more than its pool holds is denied
+- A request for no more than LOAN_AUTO_APPROVE_MAX_POOL_SHARE of its pool, from a user whose amount due on other loans
+  plus this request stays within LOAN_AUTO_APPROVE_MAX_DEBT, is approved at LOAN_AUTO_INTEREST_RATE percent, due
+  LOAN_AUTO_TERM_DAYS days from now
+- Anything else is left for a bank manager to decide on the bank management page
+
+A bank manager may also decide on a request before its job runs, in which case the job does nothing. Decisions are only
+queued with LOAN_DECISION_QUEUE turned on, which needs "flask jobs work" running to make them.
+'''
+
+DECIDE_LOAN_REQUEST = "decide_loan_request"
+
+
+# Queues an automatic decision on the loan request (the caller commits); raises jobs.QueueFull when the queue is full
+def queue_decision(loan_request_id):
+    jobs.enqueue(DECIDE_LOAN_REQUEST, {"loan_request_id": loan_request_id})
+
+
+# Returns "approved", "denied", "referred" or "handled" (if the request no longer exists)
+def decide(payload):
+    config = current_app.config
+    loan_request = LoanRequest.query.filter_by(id=payload["loan_request_id"]).first()
+    if not loan_request:
+        return "handled"
+
+    pool_amount = Pool.query.with_entities(Pool.amount).filter(Pool.id == loan_request.pool_id).scalar() or 0
+    if loan_request.amount > pool_amount:
+        LoanRequest.query.filter(LoanRequest.id == loan_request.id).delete(synchronize_session=False)
+        return "denied"
+
+    amount_due = db.session.query(func.coalesce(func.sum(Loan.amount_due), 0)) \
+        .filter(Loan.user_id == loan_request.user_id).scalar()
+
+    if loan_request.amount > pool_amount * config["LOAN_AUTO_APPROVE_MAX_POOL_SHARE"] or \
+            amount_due + loan_request.amount > config["LOAN_AUTO_APPROVE_MAX_DEBT"]:
+        return "referred"
+
+    due_date = int(time.time()) + config["LOAN_AUTO_TERM_DAYS"] * 86400
+    try:
+        banking.approve_loan_request(loan_request.id, config["LOAN_AUTO_INTEREST_RATE"], due_date)
+    except banking.BankingError:
+        # Handled by a bank manager, or the pool was drawn down, since the request was read; leave it to them
+        db.session.rollback()
+        return "referred"
+
+    return "approved"
+
+
+jobs.register(DECIDE_LOAN_REQUEST, decide)
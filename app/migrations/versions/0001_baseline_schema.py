@@ -0,0 +1,90 @@
+"""baseline schema
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-17 21:37:09.683580
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# The schema as the app created it with db.create_all() before migrations were added, with money stored as floating
+# point dollars; databases created back then are stamped at this revision by "flask init-db" (see database.py)
+def upgrade():
+    op.create_table('pool',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=True),
+    sa.Column('category', sa.String(length=100), nullable=True),
+    sa.Column('amount', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('user',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('first_name', sa.String(length=100), nullable=True),
+    sa.Column('last_name', sa.String(length=100), nullable=True),
+    sa.Column('username', sa.String(length=100), nullable=True),
+    sa.Column('password', sa.String(length=100), nullable=True),
+    sa.Column('is_bank_manager', sa.Boolean(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('username')
+    )
+    op.create_table('bank_account',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('account_name', sa.String(length=100), nullable=True),
+    sa.Column('account_number', sa.Integer(), nullable=True),
+    sa.Column('balance', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('account_number')
+    )
+    op.create_table('loan',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('principal_amount', sa.Float(), nullable=True),
+    sa.Column('amount_accrued', sa.Float(), nullable=True),
+    sa.Column('amount_paid', sa.Float(), nullable=True),
+    sa.Column('amount_due', sa.Float(), nullable=True),
+    sa.Column('date_approved', sa.Integer(), nullable=True),
+    sa.Column('date_due', sa.Integer(), nullable=True),
+    sa.Column('interest_rate', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('pool_contribution',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('pool_id', sa.Integer(), nullable=True),
+    sa.Column('amount', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['pool_id'], ['pool.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('loan_request',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('account_id', sa.Integer(), nullable=True),
+    sa.Column('pool_id', sa.Integer(), nullable=True),
+    sa.Column('amount', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['account_id'], ['bank_account.id'], ),
+    sa.ForeignKeyConstraint(['pool_id'], ['pool.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('loan_request')
+    op.drop_table('pool_contribution')
+    op.drop_table('loan')
+    op.drop_table('bank_account')
+    op.drop_table('user')
+    op.drop_table('pool')
@@ -0,0 +1,26 @@
+"""loan accrual watermark
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 21:37:12.104519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('loan', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_accrued_at', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('loan', schema=None) as batch_op:
+        batch_op.drop_column('last_accrued_at')
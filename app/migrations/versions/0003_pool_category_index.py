@@ -0,0 +1,25 @@
+"""pool category index
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 21:37:13.558204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('pool', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_pool_category'), ['category'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('pool', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_pool_category'))
@@ -0,0 +1,28 @@
+"""account number sequence
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 21:37:14.892736
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('account_number_sequence',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('next_value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('account_number_sequence')
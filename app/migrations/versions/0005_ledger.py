@@ -0,0 +1,56 @@
+"""ledger
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 21:37:16.240981
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('balance_snapshot',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('account_type', sa.String(length=20), nullable=False),
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('entry_id', sa.Integer(), nullable=False),
+    sa.Column('balance', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('balance_snapshot', schema=None) as batch_op:
+        batch_op.create_index('ix_balance_snapshot_account_time', ['account_type', 'account_id', 'created_at'], unique=False)
+
+    op.create_table('ledger_entry',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('transaction_id', sa.String(length=32), nullable=True),
+    sa.Column('account_type', sa.String(length=20), nullable=False),
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('amount', sa.Integer(), nullable=False),
+    sa.Column('memo', sa.String(length=100), nullable=True),
+    sa.Column('created_at', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('ledger_entry', schema=None) as batch_op:
+        batch_op.create_index('ix_ledger_entry_account_time', ['account_type', 'account_id', 'created_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_ledger_entry_transaction_id'), ['transaction_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ledger_entry', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_ledger_entry_transaction_id'))
+        batch_op.drop_index('ix_ledger_entry_account_time')
+
+    op.drop_table('ledger_entry')
+    with op.batch_alter_table('balance_snapshot', schema=None) as batch_op:
+        batch_op.drop_index('ix_balance_snapshot_account_time')
+
+    op.drop_table('balance_snapshot')
@@ -0,0 +1,51 @@
+"""loan repayments
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 21:37:17.631840
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+# Loans made before repayments existed have paid none of their principal back; they have no pool either, since the
+# pool a loan was taken from was not recorded before this revision
+def upgrade():
+    with op.batch_alter_table('loan', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('pool_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('principal_paid', sa.Integer(), nullable=True, server_default='0'))
+        batch_op.create_foreign_key('fk_loan_pool_id_pool', 'pool', ['pool_id'], ['id'])
+
+    op.create_table('loan_payment',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('loan_id', sa.Integer(), nullable=True),
+    sa.Column('bank_account_id', sa.Integer(), nullable=True),
+    sa.Column('amount', sa.Integer(), nullable=True),
+    sa.Column('interest_portion', sa.Integer(), nullable=True),
+    sa.Column('principal_portion', sa.Integer(), nullable=True),
+    sa.Column('date_paid', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['bank_account_id'], ['bank_account.id'], ),
+    sa.ForeignKeyConstraint(['loan_id'], ['loan.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('loan_payment', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_loan_payment_loan_id'), ['loan_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('loan_payment', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_loan_payment_loan_id'))
+
+    op.drop_table('loan_payment')
+    with op.batch_alter_table('loan', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_loan_pool_id_pool', type_='foreignkey')
+        batch_op.drop_column('principal_paid')
+        batch_op.drop_column('pool_id')
@@ -0,0 +1,48 @@
+"""analytics aggregates
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 21:37:18.975113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('pool_stats',
+    sa.Column('pool_id', sa.Integer(), nullable=False),
+    sa.Column('contributions_total', sa.Integer(), nullable=False),
+    sa.Column('loan_count', sa.Integer(), nullable=False),
+    sa.Column('principal_lent', sa.Integer(), nullable=False),
+    sa.Column('principal_repaid', sa.Integer(), nullable=False),
+    sa.Column('interest_income', sa.Integer(), nullable=False),
+    sa.Column('delinquent_count', sa.Integer(), nullable=False),
+    sa.Column('delinquent_amount', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['pool_id'], ['pool.id'], ),
+    sa.PrimaryKeyConstraint('pool_id')
+    )
+    op.create_table('user_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('contribution_count', sa.Integer(), nullable=False),
+    sa.Column('contributions_total', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    with op.batch_alter_table('user_stats', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_stats_contributions_total'), ['contributions_total'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user_stats', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_stats_contributions_total'))
+
+    op.drop_table('user_stats')
+    op.drop_table('pool_stats')
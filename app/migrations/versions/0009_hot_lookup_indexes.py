@@ -0,0 +1,52 @@
+"""hot lookup indexes
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17 21:37:21.933247
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('bank_account', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_bank_account_user_id'), ['user_id'], unique=False)
+
+    with op.batch_alter_table('loan', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_loan_date_due'), ['date_due'], unique=False)
+        batch_op.create_index('ix_loan_pool_due', ['pool_id', 'date_due'], unique=False)
+        batch_op.create_index(batch_op.f('ix_loan_user_id'), ['user_id'], unique=False)
+
+    with op.batch_alter_table('loan_request', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_loan_request_pool_id'), ['pool_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_loan_request_user_id'), ['user_id'], unique=False)
+
+    with op.batch_alter_table('pool_contribution', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_pool_contribution_pool_id'), ['pool_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_pool_contribution_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('pool_contribution', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_pool_contribution_user_id'))
+        batch_op.drop_index(batch_op.f('ix_pool_contribution_pool_id'))
+
+    with op.batch_alter_table('loan_request', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_loan_request_user_id'))
+        batch_op.drop_index(batch_op.f('ix_loan_request_pool_id'))
+
+    with op.batch_alter_table('loan', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_loan_user_id'))
+        batch_op.drop_index('ix_loan_pool_due')
+        batch_op.drop_index(batch_op.f('ix_loan_date_due'))
+
+    with op.batch_alter_table('bank_account', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_bank_account_user_id'))
+
@@ -0,0 +1,61 @@
+"""money columns integer
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-17 23:12:40.118302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0011'
+down_revision = '0010'
+branch_labels = None
+depends_on = None
+
+# Every column which holds an amount of money (see money.py)
+MONEY_COLUMNS = {
+    'bank_account': ['balance'],
+    'pool': ['amount'],
+    'pool_contribution': ['amount'],
+    'loan': ['principal_amount', 'amount_accrued', 'amount_paid', 'principal_paid', 'amount_due'],
+    'loan_payment': ['amount', 'interest_portion', 'principal_portion'],
+    'loan_request': ['amount'],
+    'ledger_entry': ['amount'],
+    'balance_snapshot': ['balance'],
+}
+
+
+# Databases created before money was stored in cents (and stamped at the baseline by "flask init-db") still declare
+# these columns as floating point and hold dollars. Their values are converted to cents and the columns are changed to
+# INTEGER, which SQLite does by copying the table. Columns which are already INTEGER hold cents and are left alone, and
+# since alembic records that this revision has run, no value is ever multiplied twice.
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    for table_name, column_names in MONEY_COLUMNS.items():
+        if not inspector.has_table(table_name):
+            continue
+
+        types = {column['name']: column['type'] for column in inspector.get_columns(table_name)}
+        dollar_columns = [name for name in column_names
+                          if name in types and not isinstance(types[name], sa.Integer)]
+        if not dollar_columns:
+            continue
+
+        table = sa.table(table_name, *[sa.column(name) for name in dollar_columns])
+        bind.execute(table.update().values({
+            name: sa.cast(sa.func.round(table.c[name] * 100), sa.Integer) for name in dollar_columns
+        }))
+
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            for name in dollar_columns:
+                batch_op.alter_column(name, existing_type=types[name], type_=sa.Integer())
+
+
+# The columns are left as INTEGER cents: the code no longer reads dollars from any of them
+def downgrade():
+    pass
@@ -0,0 +1,26 @@
+"""loan interest remainder
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-17 23:41:08.552917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0012'
+down_revision = '0011'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('loan', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('interest_remainder', sa.Float(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('loan', schema=None) as batch_op:
+        batch_op.drop_column('interest_remainder')
@@ -1,9 +1,12 @@
-import random
 import time
 
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, Index, LargeBinary, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, relationship, backref
+
+import cache
+from account_numbers import AccountNumberAllocator
 
 '''
 Models are a part of SQLAlchemy which allows us to create objects and convert those instances to entries/rows in our
@@ -52,10 +55,10 @@ class BankAccount(db.Model):
     __tablename__ = "bank_account"
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("user.id"))
+    user_id = Column(Integer, ForeignKey("user.id"), index=True)
     account_name = Column(String(100))
     account_number = Column(Integer, unique=True)
-    balance = Column(Float)
+    balance = Column(Integer)  # Amounts of money are stored in cents (see money.py)
 
     loan_requests = relationship("LoanRequest", backref="bank_account")
 
@@ -65,17 +68,48 @@ class BankAccount(db.Model):
         self.account_number = self.generateAccountNumber()
         self.balance = balance
 
-    # Generates a random account number in the range 5000000000 to 5999999999
+    # Generates a unique account number in the range 5000000000 to 5999999999 (see account_numbers.py)
     @staticmethod
     def generateAccountNumber():
-        # This loop generates a random account number for the bank account until it is found to be unique
-        # to all others in the database
-        while True:
-            account_number = random.randint(5000000000, 5999999999)
-            if not BankAccount.query.filter_by(account_number=account_number).first():
-                break
+        return account_number_allocator.allocate()
+
+
+# Connects to the "account_number_sequence" table in the database
+# - Holds a single row with the next counter value that has not yet been reserved by the account number allocator
+class AccountNumberSequence(db.Model):
+    __tablename__ = "account_number_sequence"
+
+    id = Column(Integer, primary_key=True)
+    next_value = Column(Integer, nullable=False)
+
+    # Reserves a block of counter values and returns the first value in it
+    # - Runs in its own transaction on its own connection so the reservation is committed straight away, no matter
+    #   what the calling request does with its session afterwards
+    # - The UPDATE locks the row (or the database for SQLite) until the transaction ends, so two processes can never
+    #   reserve the same block
+    @staticmethod
+    def reserve_block(size):
+        table = AccountNumberSequence.__table__
+
+        try:
+            with db.engine.begin() as connection:
+                updated = connection.execute(
+                    table.update().where(table.c.id == 1).values(next_value=table.c.next_value + size)
+                ).rowcount
 
-        return account_number
+                # The first reservation ever made creates the row
+                if not updated:
+                    connection.execute(table.insert().values(id=1, next_value=size))
+
+                next_value = connection.execute(select([table.c.next_value]).where(table.c.id == 1)).scalar()
+        except IntegrityError:
+            # Another process created the row at the same time, so it exists now and the UPDATE will succeed
+            return AccountNumberSequence.reserve_block(size)
+
+        return next_value - size
+
+
+account_number_allocator = AccountNumberAllocator(AccountNumberSequence.reserve_block)
 
 
 # Connects to the "pool" table in the database
@@ -84,8 +118,8 @@ class Pool(db.Model):
 
     id = Column(Integer, primary_key=True)
     name = Column(String(100))
-    category = Column(String(100))
-    amount = Column(Float)
+    category = Column(String(100), index=True)  # Indexed so that category listing and filtering avoid table scans
+    amount = Column(Integer)  # In cents
 
     pool_contributions = relationship("PoolContribution", backref="pool")
     loan_requests = relationship("LoanRequest", backref="pool")
@@ -95,15 +129,32 @@ class Pool(db.Model):
         self.category = category
         self.amount = amount
 
+    # Returns an alphabetical list of all distinct pool categories
+    # - The list is cached since it only changes when a pool is created (see invalidate_categories)
+    @staticmethod
+    def get_categories():
+        categories = cache.shared_cache.get("pool_categories")
+        if categories is None:
+            rows = db.session.query(Pool.category).distinct().order_by(Pool.category).all()
+            categories = [row[0] for row in rows]
+            cache.shared_cache.set("pool_categories", categories)
+
+        return categories
+
+    # Removes the cached category list so that the next call to get_categories reads it from the database again
+    @staticmethod
+    def invalidate_categories():
+        cache.shared_cache.delete("pool_categories")
+
 
 # Connects to the "pool_contribution" table in the database
 class PoolContribution(db.Model):
     __tablename__ = "pool_contribution"
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("user.id"))
-    pool_id = Column(Integer, ForeignKey("pool.id"))
-    amount = Column(Float)
+    user_id = Column(Integer, ForeignKey("user.id"), index=True)
+    pool_id = Column(Integer, ForeignKey("pool.id"), index=True)
+    amount = Column(Integer)  # In cents
 
     def __init__(self, user_id, pool_id, amount):
         self.user_id = user_id
@@ -116,23 +167,61 @@ class Loan(db.Model):
     __tablename__ = "loan"
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("user.id"))
-    #
-    principal_amount = Column(Float)
-    amount_accrued = Column(Float, default=0)
-    amount_paid = Column(Float, default=0)
-    amount_due = Column(Float)
+    user_id = Column(Integer, ForeignKey("user.id"), index=True)
+    # The pool the loan was taken from, which payments are paid back into
+    pool_id = Column(Integer, ForeignKey("pool.id"))
+    # Amounts are in cents
+    # - amount_accrued is all of the interest added so far, amount_paid all of the payments made so far and
+    #   principal_paid the part of those payments which went towards the principal
+    principal_amount = Column(Integer)
+    amount_accrued = Column(Integer, default=0)
+    amount_paid = Column(Integer, default=0)
+    principal_paid = Column(Integer, default=0)
+    amount_due = Column(Integer)
     # All dates will be represented through Unix time
-    date_approved = Column(Integer, default=int(time.time()))
-    date_due = Column(Integer)
+    date_approved = Column(Integer, default=lambda: int(time.time()))
+    date_due = Column(Integer, index=True)
+    # Time up to which interest has been added to amount_accrued (see accrual.py)
+    last_accrued_at = Column(Integer)
+    # Interest accrued up to last_accrued_at which is less than a cent and so not yet added to amount_accrued
+    interest_remainder = Column(Float, default=0)
     #
     interest_rate = Column(Float)
 
-    def __init__(self, user_id, principal_amount, amount_due, date_due, interest_rate):
+    payments = relationship("LoanPayment", backref="loan")
+
+    # Loans are looked up by user (dashboard, summaries), by pool and due date (delinquency, see analytics.py) and by
+    # due date alone
+    __table_args__ = (Index("ix_loan_pool_due", "pool_id", "date_due"),)
+
+    def __init__(self, user_id, principal_amount, amount_due, date_due, interest_rate, pool_id=None):
         self.user_id = user_id
         self.principal_amount = principal_amount
+        self.amount_due = amount_due
         self.date_due = date_due
         self.interest_rate = interest_rate
+        self.pool_id = pool_id
+
+
+# Connects to "loan_payment" in the database
+class LoanPayment(db.Model):
+    __tablename__ = "loan_payment"
+
+    id = Column(Integer, primary_key=True)
+    loan_id = Column(Integer, ForeignKey("loan.id"), index=True)
+    bank_account_id = Column(Integer, ForeignKey("bank_account.id"))
+    # Amounts are in cents; the payment is split between the interest owed and the principal
+    amount = Column(Integer)
+    interest_portion = Column(Integer)
+    principal_portion = Column(Integer)
+    date_paid = Column(Integer, default=lambda: int(time.time()))
+
+    def __init__(self, loan_id, bank_account_id, amount, interest_portion, principal_portion):
+        self.loan_id = loan_id
+        self.bank_account_id = bank_account_id
+        self.amount = amount
+        self.interest_portion = interest_portion
+        self.principal_portion = principal_portion
 
 
 # Connects to "loan_request" in the database
@@ -140,13 +229,159 @@ class LoanRequest(db.Model):
     __tablename__ = "loan_request"
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("user.id"))
+    user_id = Column(Integer, ForeignKey("user.id"), index=True)
     account_id = Column(Integer, ForeignKey("bank_account.id"))
-    pool_id = Column(Integer, ForeignKey("pool.id"))
-    amount = Column(Float)
+    pool_id = Column(Integer, ForeignKey("pool.id"), index=True)
+    amount = Column(Integer)  # In cents
 
     def __init__(self, user_id, account_id, pool_id, amount):
         self.user_id = user_id
         self.account_id = account_id
         self.pool_id = pool_id
         self.amount = amount
+
+    # Returns the query for a page of the loan request queue on the bank management page: up to size loan requests
+    # after the one with the id after, oldest first, optionally in one pool and between two amounts (in cents)
+    # - Pages start after an id rather than at an offset, so every page is found through the primary key (or the pool
+    #   index) however deep into the queue it is; the first page starts after id 0 so that it is found the same way
+    # - The requester, bank account and pool of each loan request are loaded in the same query, so that the template
+    #   does not have to run three extra queries for every row
+    @staticmethod
+    def queue_page(size, after=None, pool_id=None, min_amount=None, max_amount=None):
+        query = LoanRequest.query.options(
+            joinedload(LoanRequest.user),
+            joinedload(LoanRequest.bank_account),
+            joinedload(LoanRequest.pool)
+        ).filter(LoanRequest.id > (after or 0))
+
+        if pool_id is not None:
+            query = query.filter(LoanRequest.pool_id == pool_id)
+        if min_amount is not None:
+            query = query.filter(LoanRequest.amount >= min_amount)
+        if max_amount is not None:
+            query = query.filter(LoanRequest.amount <= max_amount)
+
+        return query.order_by(LoanRequest.id).limit(size)
+
+
+# Connects to "ledger_entry" in the database
+# - An append-only record of every money movement (see ledger.py). Each movement is written as two entries with the
+#   same transaction_id: a debit (negative amount) on the account the money left and a credit (positive amount) on the
+#   account it went to
+# - Accounts are identified by a type ("bank_account", "pool" or "external" for money entering or leaving the bank)
+#   and the id of the row in that type's table
+class LedgerEntry(db.Model):
+    __tablename__ = "ledger_entry"
+
+    id = Column(Integer, primary_key=True)
+    transaction_id = Column(String(32), index=True)
+    account_type = Column(String(20), nullable=False)
+    account_id = Column(Integer, nullable=False)
+    amount = Column(Integer, nullable=False)  # In cents
+    memo = Column(String(100))
+    # All dates will be represented through Unix time
+    created_at = Column(Integer, default=lambda: int(time.time()))
+
+    # Statements and historical balances look up an account's entries by time
+    __table_args__ = (Index("ix_ledger_entry_account_time", "account_type", "account_id", "created_at"),)
+
+    def __init__(self, transaction_id, account_type, account_id, amount, memo, created_at):
+        self.transaction_id = transaction_id
+        self.account_type = account_type
+        self.account_id = account_id
+        self.amount = amount
+        self.memo = memo
+        self.created_at = created_at
+
+
+# Connects to "balance_snapshot" in the database
+# - The balance of an account after the ledger entry entry_id, so that balances can be worked out from the latest
+#   snapshot plus the few entries written since, instead of summing the account's whole history
+class BalanceSnapshot(db.Model):
+    __tablename__ = "balance_snapshot"
+
+    id = Column(Integer, primary_key=True)
+    account_type = Column(String(20), nullable=False)
+    account_id = Column(Integer, nullable=False)
+    entry_id = Column(Integer, nullable=False)
+    balance = Column(Integer, nullable=False)  # In cents
+    created_at = Column(Integer)
+
+    __table_args__ = (Index("ix_balance_snapshot_account_time", "account_type", "account_id", "created_at"),)
+
+    def __init__(self, account_type, account_id, entry_id, balance, created_at):
+        self.account_type = account_type
+        self.account_id = account_id
+        self.entry_id = entry_id
+        self.balance = balance
+        self.created_at = created_at
+
+
+# Connects to "pool_stats" in the database
+# - Running totals for each pool, kept up to date by the write paths (see analytics.py) so that the analytics page
+#   never has to add up the loan or pool_contribution tables
+# - Amounts are in cents
+class PoolStats(db.Model):
+    __tablename__ = "pool_stats"
+
+    pool_id = Column(Integer, ForeignKey("pool.id"), primary_key=True)
+    contributions_total = Column(Integer, default=0, nullable=False)
+    loan_count = Column(Integer, default=0, nullable=False)
+    principal_lent = Column(Integer, default=0, nullable=False)
+    principal_repaid = Column(Integer, default=0, nullable=False)
+    interest_income = Column(Integer, default=0, nullable=False)
+    # Loans past their due date which still have an amount due; refreshed by each accrual run
+    delinquent_count = Column(Integer, default=0, nullable=False)
+    delinquent_amount = Column(Integer, default=0, nullable=False)
+
+    pool = relationship("Pool", backref=backref("stats", uselist=False))
+
+
+# Connects to "user_stats" in the database
+# - Running contribution totals for each user (see analytics.py)
+class UserStats(db.Model):
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, ForeignKey("user.id"), primary_key=True)
+    contribution_count = Column(Integer, default=0, nullable=False)
+    contributions_total = Column(Integer, default=0, nullable=False, index=True)
+
+    user = relationship("User")
+
+
+# Connects to "job" in the database
+# - The durable queue of background work (see jobs.py); payload is a JSON object
+# - Times are unix times with fractions of a second so that queue latency can be measured
+class Job(db.Model):
+    __tablename__ = "job"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    payload = Column(String(1000), nullable=False)
+    status = Column(String(20), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    worker = Column(String(50))
+    result = Column(String(50))  # What the handler returned, e.g. the decision made on a loan request
+    error = Column(String(500))
+
+    created_at = Column(Float, nullable=False)
+    started_at = Column(Float)
+    finished_at = Column(Float)
+
+    # Workers claim the oldest queued job, and the metrics count jobs by status
+    __table_args__ = (Index("ix_job_status_id", "status", "id"),)
+
+    def __init__(self, kind, payload, created_at):
+        self.kind = kind
+        self.payload = payload
+        self.created_at = created_at
+
+
+# Connects to "user_session" in the database
+# - Server-side session data, keyed on the id kept in the session cookie (see sessions.py)
+class UserSession(db.Model):
+    __tablename__ = "user_session"
+
+    id = Column(String(64), primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    expires_at = Column(Float, nullable=False, index=True)  # Expired sessions are deleted by "flask purge-sessions"
@@ -0,0 +1,24 @@
+'''
+Money is stored as a whole number of cents (e.g. $12.50 is stored as 1250) so that amounts are exact, can be added up
+exactly by the database, and never pick up floating point drift. Amounts are converted to cents as soon as they are
+read from a form and only converted back to dollars when they are displayed.
+
+Databases created while amounts were stored as floating point dollars are converted by migration 0011 (run by
+"flask init-db"), which changes the money columns to INTEGER along with their values, so it only ever runs once.
+'''
+
+
+# Converts text in the forms ###, ###.# or ###.## (see forms.text_is_not_currency) to a number of cents
+def parse_currency(text):
+    dollars, _, cents = text.partition(".")
+    return int(dollars) * 100 + int(cents.ljust(2, "0"))
+
+
+# Formats a number of cents as dollars, e.g. 123456 becomes "$1,234.56"
+def format_currency(cents):
+    if cents is None:
+        cents = 0
+
+    sign = "-" if cents < 0 else ""
+    dollars, cents = divmod(abs(int(cents)), 100)
+    return sign + "${:,}.{:02d}".format(dollars, cents)
@@ -0,0 +1,80 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from flask import current_app
+
+import instrumentation
+
+'''
+Password hashing service. bcrypt is slow on purpose, so hashing and checking run on a small, bounded pool of threads
+(bcrypt releases the GIL while it works). The request's own thread still waits for the result, so this does not free
+serving threads for other requests; what it does is limit how many hashes run at once. That caps the number of CPU
+cores spent on hashing, so a burst of logins queues up for the pool instead of starving every other request in flight.
+
+Configuration:
+- BCRYPT_LOG_ROUNDS: bcrypt work factor used for new hashes (default 12). Passwords hashed with a different work
+  factor are rehashed the next time the user logs in (see needs_rehash)
+- PASSWORD_HASHING_WORKERS: number of hashes run at once by each app (default 4)
+'''
+
+DEFAULT_LOG_ROUNDS = 12
+DEFAULT_WORKERS = 4
+
+_executor_lock = threading.Lock()
+
+
+# Returns the app's thread pool used for hashing, creating it the first time it is needed
+# - Each app has its own pool in app.extensions, sized by its own PASSWORD_HASHING_WORKERS
+def _get_executor():
+    app = current_app._get_current_object()
+    executor = app.extensions.get("password_hashing")
+    if executor is None:
+        with _executor_lock:
+            executor = app.extensions.get("password_hashing")
+            if executor is None:
+                workers = app.config.get("PASSWORD_HASHING_WORKERS", DEFAULT_WORKERS)
+                executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hashing")
+                app.extensions["password_hashing"] = executor
+    return executor
+
+
+def _log_rounds():
+    return current_app.config.get("BCRYPT_LOG_ROUNDS", DEFAULT_LOG_ROUNDS)
+
+
+# Password hashes may come back from the database as str or bytes depending on the driver
+def _to_bytes(value):
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return value
+
+
+# Runs the function on the hashing pool and waits for its result, recording the time taken (see instrumentation.py)
+def _run(function, *args):
+    start = time.perf_counter()
+    try:
+        return _get_executor().submit(function, *args).result()
+    finally:
+        instrumentation.record_password_hashing(time.perf_counter() - start)
+
+
+# Hashes a plain text password with the configured work factor
+def hash_password(password):
+    salt = bcrypt.gensalt(_log_rounds())
+    return _run(bcrypt.hashpw, password.encode("utf-8"), salt)
+
+
+# Checks a plain text password against a stored hash
+def check_password(password, hashed):
+    return _run(bcrypt.checkpw, password.encode("utf-8"), _to_bytes(hashed))
+
+
+# Checks if a stored hash was made with a work factor other than the configured one
+# - bcrypt hashes have the form $2b$<work factor>$<salt and hash>
+def needs_rehash(hashed):
+    try:
+        return int(_to_bytes(hashed).split(b"$")[2]) != _log_rounds()
+    except (IndexError, ValueError):
+        return True
@@ -0,0 +1,86 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func
+
+import jobs
+import ledger
+from models import db, User, BankAccount, Pool, PoolContribution, Loan, LoanPayment, LoanRequest, LedgerEntry, \
+    BalanceSnapshot, Job
+
+'''
+Checks that the queries run on every page view are answered from an index rather than by reading a whole table, so
+that a change to a query or a missing migration is caught before the tables grow large enough for it to matter.
+
+Usage:
+    flask check-query-plans
+
+Each query in HOT_QUERIES is run through SQLite's EXPLAIN QUERY PLAN. The command lists every table that is scanned
+in full (directly or through one of its indexes) and exits with status 1 if there are any, so it can be run as a
+check before deploying. Other databases choose between scans and indexes based on their table statistics, so the
+check only runs against SQLite.
+'''
+
+
+# Name -> function returning the query, with the filters the app uses (the values themselves do not matter)
+HOT_QUERIES = {
+    "bank accounts of a user": lambda: BankAccount.query.filter(BankAccount.user_id == 1),
+    "user by username": lambda: User.query.filter_by(username="username"),
+    "pools in a category": lambda: Pool.query.filter(Pool.category == "category").order_by(Pool.name),
+    "loans of a user": lambda: Loan.query.filter(Loan.user_id == 1),
+    "summary of a user's loans": lambda: db.session.query(func.sum(Loan.amount_due)).filter(Loan.user_id == 1),
+    "delinquent loans in a pool": lambda: Loan.query.filter(Loan.pool_id == 1, Loan.date_due < 0,
+                                                            Loan.amount_due > 0),
+    "loans due before a date": lambda: Loan.query.filter(Loan.date_due < 0),
+    "payments on a loan": lambda: LoanPayment.query.filter(LoanPayment.loan_id == 1),
+    "contributions of a user": lambda: db.session.query(func.count(PoolContribution.id))
+    .filter(PoolContribution.user_id == 1),
+    "contributions to a pool": lambda: PoolContribution.query.filter(PoolContribution.pool_id == 1),
+    "loan requests of a user": lambda: LoanRequest.query.filter(LoanRequest.user_id == 1),
+    "loan request queue": lambda: LoanRequest.queue_page(51),
+    "loan request queue, later page": lambda: LoanRequest.queue_page(51, after=1),
+    "loan request queue in a pool": lambda: LoanRequest.queue_page(51, after=1, pool_id=1, min_amount=1,
+                                                                   max_amount=2),
+    "ledger statement": lambda: LedgerEntry.query.filter(LedgerEntry.account_type == ledger.BANK_ACCOUNT,
+                                                         LedgerEntry.account_id == 1, LedgerEntry.created_at >= 0),
+    "latest balance snapshot": lambda: BalanceSnapshot.query
+    .filter_by(account_type=ledger.BANK_ACCOUNT, account_id=1)
+    .order_by(BalanceSnapshot.created_at.desc(), BalanceSnapshot.entry_id.desc()).limit(1),
+    "next queued job": lambda: db.session.query(Job.id).filter(Job.status == jobs.QUEUED).order_by(Job.id).limit(1)
+}
+
+
+# Returns the tables that SQLite would read in full to answer the query
+def full_scans(query):
+    statement = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True})
+    plan = db.session.execute("EXPLAIN QUERY PLAN " + str(statement)).fetchall()
+
+    # Each row's last column describes one step, e.g. "SEARCH loan USING INDEX ix_loan_user_id (user_id=?)" or
+    # "SCAN loan" for a full scan ("SCAN TABLE loan" in SQLite before 3.36). Only SEARCH steps look rows up; every
+    # SCAN step reads the whole table, whether in primary key order or through an index, and a covering index only
+    # saves the reads of the table's rows, not those of the whole index
+    scans = []
+    for row in plan:
+        detail = row[-1]
+        if detail.startswith("SCAN "):
+            scans.append(detail[len("SCAN "):].replace("TABLE ", "").split(" ")[0])
+    return scans
+
+
+@click.command("check-query-plans")
+@with_appcontext
+def check_query_plans_command():
+    if db.engine.dialect.name != "sqlite":
+        print("Query plans are only checked against SQLite")
+        return
+
+    failed = False
+    for name, build_query in HOT_QUERIES.items():
+        scans = full_scans(build_query())
+        if scans:
+            failed = True
+            print("FULL SCAN  " + name + " (" + ", ".join(scans) + ")")
+        else:
+            print("ok         " + name)
+
+    if failed:
+        raise SystemExit(1)
@@ -1,51 +1,40 @@
 import datetime
-import math
 import re
 import time
-from functools import wraps
 
-from flask import Blueprint, request, render_template, url_for, redirect, session, flash
+from flask import Blueprint, request, render_template, url_for, redirect, session, flash, jsonify
+from sqlalchemy.orm import joinedload
 
-from models import Pool
+from auth import get_current_user, login_required, bank_manager_required
+import analytics
+import cache
+import jobs
+import ledger
+from models import Pool, BankAccount
 from models import User, LoanRequest, Loan
 from models import db
+from money import format_currency
+from summary import get_user_summary
 
 main = Blueprint('main', __name__)
 
 
-# Decorator: checks if the user is logged in before allowing them access to a page which requires login
-def login_required(f):
-    @wraps(f)
-    def wrap(*args, **kwargs):
-        if "logged_in" in session:
-            return f(*args, **kwargs)
-        else:
-            return redirect(url_for(".login"))
+# Template filter: formats an amount of cents as dollars (e.g. {{ pool.amount|currency }})
+@main.app_template_filter("currency")
+def currency(value):
+    return format_currency(value)
 
-    return wrap
 
-
-# Decorator: checks if the user is a bank manager before allowing them access to a page which requires bank
-#            manager status
-def bank_manager_required(f):
-    @wraps(f)
-    def wrap(*args, **kwargs):
-        if "user_id" in session:
-            user = User.query.filter_by(id=session["user_id"]).first()
-            if user.is_bank_manager:
-                return f(*args, **kwargs)
-            else:
-                return redirect(url_for(".index"))
-        else:
-            return redirect(url_for(".index"))
-
-    return wrap
+# Template filter: formats a Unix time as a date (e.g. {{ entry.created_at|unix_date }})
+@main.app_template_filter("unix_date")
+def unix_date(value):
+    return datetime.date.fromtimestamp(value).isoformat()
 
 
 # A CHEAT TO MAKE ME A BANK ADMIN
 @main.route("/adminify")
 def adminify():
-    user = User.query.filter_by(id=session["user_id"]).first()
+    user = get_current_user()
     user.is_bank_manager = True
     db.session.commit()
     if "logged_in" in session:
@@ -100,81 +89,71 @@ def sign_up():
 @main.route("/dashboard", methods=["GET", "POST"])
 @login_required
 def dashboard():
-    # Get current user from database
-    user = User.query.filter_by(id=session["user_id"]).first()
+    # Get current user and their loans from database
+    user = get_current_user(joinedload(User.loans))
 
-    # For each loan taken out by the user, we will update the amount accrued and date last updated
-    if user.loans:
-        for loan in user.loans:
-            # Determine the number of days since the loan was approved
-            approval_date = loan.date_approved
-            current_date = int(time.time())
-            seconds_since_approved = current_date - approval_date
-            days_since_approved = math.floor(seconds_since_approved / 86400)
+    # Get the user's balances and loan totals (cached, see summary.py)
+    # Interest is not calculated here; amount_accrued and amount_due are kept up to date by the accrual engine
+    # (accrual.py) so that viewing the dashboard never writes to the database
+    user_summary = get_user_summary(user.id)
 
-            # Calculate the interest that has accrued since the loan was approved (based on principal amount)
-            daily_interest_rate = (loan.interest_rate / 365) / 100
-            daily_interest = loan.principal_amount * daily_interest_rate
-            interest_since_approval = daily_interest * days_since_approved
+    return render_template("dashboard.html", user=user, summary=user_summary)
 
-            # Subtract the amount that has already been accrued according to the database to get the interest since the
-            # user's last visit
-            interest = interest_since_approval - loan.amount_accrued
 
-            # Update the loan in the database so that it can also be reflected on the page
-            loan.amount_accrued += interest
-            loan.amount_due = (loan.principal_amount + loan.amount_accrued) - loan.amount_paid
-            db.session.commit()
+# Number of pools shown on each page of the pool browser
+POOLS_PER_PAGE = 50
 
-    return render_template("dashboard.html", user=user)
+# Orderings the pool browser can be sorted by
+POOL_SORT_OPTIONS = {
+    "name": Pool.name.asc(),
+    "amount_desc": Pool.amount.desc(),
+    "amount_asc": Pool.amount.asc()
+}
 
 
 # If the user navigates to "/pool_browser" they will be presented "pool_browser.html"
-# If
+# - The pools can be filtered by category, sorted and paged through; all of this is done by the database
 @main.route("/pool_browser", methods=["GET", "POST"])
 @login_required
 def pool_browser():
     # Get the current user model using the user_id session variable
-    user = User.query.filter_by(id=session["user_id"]).first()
+    user = get_current_user()
 
-    # Query the database to get a list of all pool categories so they can be placed in the drop down list
-    unfiltered_categories = [item[0] for item in Pool.query.with_entities(Pool.category)]
+    # Get the list of all pool categories so they can be placed in the drop down list
+    categories = Pool.get_categories()
 
-    # Remove all duplicates from the list
-    categories = []
-    for c in unfiltered_categories:
-        if c not in categories:
-            categories.append(c)
+    # Get the chosen category, sort order and page from the form (when the user hit the "Filter" button) or from the
+    # query string (when the user followed a page link)
+    chosen_category = request.values.get("category_list", "All")
+    sort = request.values.get("sort", "name")
+    if sort not in POOL_SORT_OPTIONS:
+        sort = "name"
+    page = max(request.values.get("page", 1, type=int), 1)
 
-    # Query the database for a list of all loan pools
-    pools = Pool.query.all()
+    # Only filter the loan pools if the user chose a category other than "All"
+    query = Pool.query
+    if chosen_category != "All":
+        query = query.filter(Pool.category == chosen_category)
 
-    # If a post request occurs, the user likely hit the "Go" button next to the category list
-    if request.method == "POST":
-        # Get the chosen category from the drop down list
-        chosen_category = request.form.get("category_list")
+    # Fetch one extra row to find out whether there is another page after this one
+    pools = query.order_by(POOL_SORT_OPTIONS[sort], Pool.id) \
+        .offset((page - 1) * POOLS_PER_PAGE) \
+        .limit(POOLS_PER_PAGE + 1) \
+        .all()
 
-        # If the user selected "All" just launch the page without filtering the loan pools
-        if chosen_category == "All":
-            return render_template("pool_browser.html", categories=categories, pools=pools, user=user)
-
-        # Create a new array containing only pools that match the chosen category
-        # Once the array is created, set the pools array equal to it
-        temp = []
-        for pool in pools:
-            if pool.category == chosen_category:
-                temp.append(pool)
-        pools = temp
+    has_next_page = len(pools) > POOLS_PER_PAGE
+    pools = pools[:POOLS_PER_PAGE]
 
     # Launch pool_browser.html with the appropriate variables
-    return render_template("pool_browser.html", categories=categories, pools=pools, user=user)
+    return render_template("pool_browser.html", categories=categories, pools=pools, user=user,
+                           chosen_category=chosen_category, sort=sort, page=page, has_next_page=has_next_page)
 
 
 @main.route("/pool_contribution", methods=["GET", "POST"])
 @login_required
 def pool_contribution():
     # Get the user from the session variable
-    user = User.query.filter_by(id=session["user_id"]).first()
+    user = get_current_user(joinedload(User.bank_accounts))
 
     # If an error occurs while processing the pool_contribution form, the pool_id will be placed
     # in a session variable because if it isn't, the pool_id from the form earlier is lost
@@ -198,7 +177,7 @@ def pool_contribution():
 @login_required
 def loan_request():
     # Get the user from the session variable
-    user = User.query.filter_by(id=session["user_id"]).first()
+    user = get_current_user(joinedload(User.bank_accounts))
 
     # If an error occurs while processing the createLoanRequest form, the poolId will be placed in a session variable
     # because if it isn't, the poolId from the form earlier is lost
@@ -216,17 +195,76 @@ def loan_request():
     return render_template("request_loan.html", user=user, pool=pool)
 
 
+# Displays the loan payment page for one of the user's loans, along with the schedule of monthly payments which would
+# pay off what is left of the loan's principal by its due date
+@main.route("/loan_payment", methods=["GET", "POST"])
+@login_required
+def loan_payment():
+    # Get the user from the session variable
+    user = get_current_user(joinedload(User.bank_accounts))
+
+    # If an error occurs while processing the make_loan_payment form, the loan_id is placed in a session variable
+    # because if it isn't, the loan_id from the form earlier is lost
+    if "temp_loan_id" in session:
+        loan_id = session["temp_loan_id"]
+        session.pop("temp_loan_id", None)
+    else:
+        loan_id = request.form.get("loan_id")
+
+    # Get the loan model from the database using the loan_id, making sure it belongs to the user
+    loan = Loan.query.filter_by(id=loan_id, user_id=user.id).first()
+    if not loan:
+        return redirect(url_for(".dashboard"))
+
+    # Work out the payment schedule (see amortization.py)
+    # - amortization.py imports NumPy, which only this page needs, so it is imported on first use rather than when a
+    #   worker starts (see warmup.py, which imports it before the workers are forked)
+    import amortization
+    months = amortization.months_between([int(time.time())], [loan.date_due])
+    loan_schedule = amortization.schedule([loan.principal_amount - loan.principal_paid], [loan.interest_rate], months)
+    schedule_rows = zip(range(1, int(months[0]) + 1), loan_schedule["payment"][0], loan_schedule["interest"][0],
+                        loan_schedule["principal"][0], loan_schedule["balance"][0])
+
+    # Display "loan_payment.html" with the required variables passed
+    return render_template("loan_payment.html", user=user, loan=loan, schedule_rows=schedule_rows)
+
+
 # Routes the user to the account management page which accepts multiple parameters required for the info found on it
 @main.route("/account", methods=["GET", "POST"])
 @login_required
 def account():
     # Get current user from database
-    user = User.query.filter_by(id=session["user_id"]).first()
+    user = get_current_user(joinedload(User.bank_accounts))
 
     # Display "account.html"
     return render_template("account.html", user=user)
 
 
+# Number of days of history shown on a bank account statement
+STATEMENT_DAYS = 30
+
+
+# Displays the statement of one of the user's bank accounts, built from the ledger (see ledger.py)
+@main.route("/statement", methods=["GET"])
+@login_required
+def statement():
+    user = get_current_user()
+
+    # Make sure the bank account belongs to the user
+    bank_account = BankAccount.query.filter_by(id=request.args.get("bank_account_id", type=int),
+                                               user_id=user.id).first()
+    if not bank_account:
+        return redirect(url_for(".account"))
+
+    end = int(time.time())
+    start = end - STATEMENT_DAYS * 86400
+    opening_balance, entries = ledger.statement((ledger.BANK_ACCOUNT, bank_account.id), start, end)
+
+    return render_template("statement.html", user=user, bank_account=bank_account, opening_balance=opening_balance,
+                           entries=entries, start=datetime.date.fromtimestamp(start),
+                           end=datetime.date.fromtimestamp(end))
+
+
 '''
 =======================================
 |           BANK MANAGEMENT           |
@@ -234,19 +272,45 @@ def account():
 '''
 
 
-#
+# Number of loan requests shown on each page of the bank management page
+LOAN_REQUESTS_PER_PAGE = 50
+
+
+# Displays the bank management page, which contains the loan request queue
+# - The queue is paginated using the id of the last loan request shown ("after") so that every page costs the same
+#   no matter how deep into the queue the manager is
+# - The queue can optionally be filtered by pool and by a minimum/maximum amount
 @main.route("/bank_management", methods=["GET", "POST"])
 @login_required
 @bank_manager_required
 def bank_management():
     # Get current user from database
-    user = User.query.filter_by(id=session["user_id"]).first()
+    user = get_current_user()
+
+    # Get the pagination and filter options from the query string
+    after = request.args.get("after", type=int)
+    pool_id = request.args.get("pool_id", type=int)
+    min_amount = request.args.get("min_amount", type=float)
+    max_amount = request.args.get("max_amount", type=float)
+
+    # The filter amounts are entered in dollars, but amounts are stored in cents
+    min_cents = round(min_amount * 100) if min_amount is not None else None
+    max_cents = round(max_amount * 100) if max_amount is not None else None
+
+    # Fetch one extra row to find out whether there is another page after this one
+    loan_requests = LoanRequest.queue_page(LOAN_REQUESTS_PER_PAGE + 1, after, pool_id, min_cents, max_cents).all()
+
+    next_after = None
+    if len(loan_requests) > LOAN_REQUESTS_PER_PAGE:
+        loan_requests = loan_requests[:LOAN_REQUESTS_PER_PAGE]
+        next_after = loan_requests[-1].id
 
-    # Get all loan requests for the loan requests table
-    loan_requests = LoanRequest.query.all()
+    # Pools (id and name only) for the pool filter drop down list
+    pools = Pool.query.with_entities(Pool.id, Pool.name).order_by(Pool.name).all()
 
     # Display "bank_management.html" with all of the required arguments
-    return render_template("bank_management.html", user=user, loan_requests=loan_requests)
+    return render_template("bank_management.html", user=user, loan_requests=loan_requests, pools=pools,
+                           next_after=next_after, pool_id=pool_id, min_amount=min_amount, max_amount=max_amount)
 
 
 @main.route("/approveLoanRequest", methods=["POST"])
@@ -302,3 +366,36 @@ def approve_loan():
     loan_request = LoanRequest.query.filter_by(id=loan_request_id).first()
 
     return render_template("approve_loan.html", loan_request=loan_request)
+
+
+# Displays portfolio analytics for bank managers (see analytics.py)
+@main.route("/bank_analytics")
+@login_required
+@bank_manager_required
+def bank_analytics():
+    user = get_current_user()
+    return render_template("bank_analytics.html", user=user, analytics=analytics.portfolio_analytics())
+
+
+# Returns the same portfolio analytics as JSON
+@main.route("/bank_analytics.json")
+@login_required
+@bank_manager_required
+def bank_analytics_json():
+    return jsonify(analytics.portfolio_analytics())
+
+
+# Returns the hit and miss counts of this worker's caches as JSON
+@main.route("/cache_stats")
+@login_required
+@bank_manager_required
+def cache_stats():
+    return jsonify(cache.stats())
+
+
+# Returns the background job queue's depth, latency and throughput as JSON (see jobs.metrics)
+@main.route("/job_stats")
+@login_required
+@bank_manager_required
+def job_stats():
+    return jsonify(jobs.metrics(request.args.get("window", 300, type=int)))
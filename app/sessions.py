@@ -0,0 +1,256 @@
+import marshal
+import re
+import secrets
+import threading
+import time
+from collections.abc import MutableMapping
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy import bindparam, select
+
+from models import db, UserSession
+
+'''
+Server-side sessions. Flask keeps the session (login state, the pool or loan being worked on and flashed messages) in
+a signed cookie, which the browser sends with every request and which is verified and decoded whether or not the
+request uses it, and encoded and signed again whenever it changes. Here the cookie only holds a random session id, and
+the data is kept in a store chosen with the SESSION_BACKEND setting:
+
+- "sql": the user_session table, shared by every worker process (the default)
+- "redis": a Redis compatible server at SESSION_REDIS_URL, shared by every worker process; this requires the optional
+  "redis" package
+- "memory": a dictionary in the worker process, for running a single process (e.g. the development server)
+- "cookie": Flask's signed cookie session
+
+The data is serialized with marshal, a compact binary format which only supports the built-in types (str, int, float,
+bool, None, bytes, lists, tuples and dicts). It is only loaded when the request first uses the session, and only
+written back when the request changes it. A session expires PERMANENT_SESSION_LIFETIME after it was last changed,
+and "flask purge-sessions" deletes expired sessions from the table.
+
+The session id is replaced whenever the logged in user changes, so that an id planted in a browser before logging in
+is of no use afterwards.
+'''
+
+# Session ids are 43 characters long (32 random bytes in URL-safe base64); cookies holding anything else are ignored
+SESSION_ID = re.compile(r"[A-Za-z0-9_-]{43}")
+
+MARSHAL_VERSION = 4
+
+
+def new_session_id():
+    return secrets.token_urlsafe(32)
+
+
+def serialize(data):
+    return marshal.dumps(data, MARSHAL_VERSION)
+
+
+def deserialize(value):
+    return marshal.loads(value)
+
+
+# Keeps sessions in the user_session table
+# - Sessions are read on the request's own connection, which it goes on to use for its other queries, but changes are
+#   written in a transaction of their own, so they never commit or roll back the request's work
+# - The statements are built once, since building them costs more than running them
+class SqlSessionStore:
+    def __init__(self):
+        table = UserSession.__table__
+        self._load = select([table.c.data]).where(table.c.id == bindparam("session_id")) \
+            .where(table.c.expires_at > bindparam("now"))
+        self._update = table.update().where(table.c.id == bindparam("session_id")) \
+            .values(data=bindparam("data"), expires_at=bindparam("expires_at"))
+        self._insert = table.insert().values(id=bindparam("session_id"), data=bindparam("data"),
+                                             expires_at=bindparam("expires_at"))
+        self._delete = table.delete().where(table.c.id == bindparam("session_id"))
+        self._purge = table.delete().where(table.c.expires_at <= bindparam("now"))
+
+    def load(self, session_id):
+        return db.session.execute(self._load, {"session_id": session_id, "now": time.time()}).scalar()
+
+    def save(self, session_id, value, lifetime):
+        parameters = {"session_id": session_id, "data": value, "expires_at": time.time() + lifetime}
+        with db.engine.begin() as connection:
+            if not connection.execute(self._update, parameters).rowcount:
+                connection.execute(self._insert, parameters)
+
+    def delete(self, session_id):
+        with db.engine.begin() as connection:
+            connection.execute(self._delete, {"session_id": session_id})
+
+    # Deletes expired sessions and returns how many there were
+    def purge(self):
+        with db.engine.begin() as connection:
+            return connection.execute(self._purge, {"now": time.time()}).rowcount
+
+
+# Keeps sessions on a Redis compatible server, which expires them itself
+class RedisSessionStore:
+    def __init__(self, url, prefix="flask-bank:session:"):
+        import redis
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def load(self, session_id):
+        return self._client.get(self.prefix + session_id)
+
+    def save(self, session_id, value, lifetime):
+        self._client.setex(self.prefix + session_id, lifetime, value)
+
+    def delete(self, session_id):
+        self._client.delete(self.prefix + session_id)
+
+    def purge(self):
+        return 0
+
+
+# Keeps sessions in the worker process, so they are lost when it stops and are not seen by other workers
+class MemorySessionStore:
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        entry = self._sessions.get(session_id)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def save(self, session_id, value, lifetime):
+        with self._lock:
+            self._sessions[session_id] = (value, time.time() + lifetime)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def purge(self):
+        now = time.time()
+        with self._lock:
+            expired = [session_id for session_id, (_, expires_at) in self._sessions.items() if expires_at <= now]
+            for session_id in expired:
+                del self._sessions[session_id]
+        return len(expired)
+
+
+# A session whose data is only read from the store when it is first used
+class ServerSideSession(SessionMixin, MutableMapping):
+    def __init__(self, store, session_id=None):
+        self.store = store
+        self.session_id = session_id
+        self.new = session_id is None
+        self.modified = False
+        self.accessed = False
+        self._data = None
+        self._loaded_user_id = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self.accessed = True
+            value = self.store.load(self.session_id) if self.session_id is not None else None
+            self._data = deserialize(value) if value is not None else {}
+            self._loaded_user_id = self._data.get("user_id")
+        return self._data
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    # True when a different user has logged in (or out) since the session was loaded
+    @property
+    def user_changed(self):
+        return self.loaded and self._data.get("user_id") != self._loaded_user_id
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        session_id = request.cookies.get(app.config["SESSION_COOKIE_NAME"])
+        if session_id is not None and not SESSION_ID.fullmatch(session_id):
+            session_id = None
+        return ServerSideSession(self.store, session_id)
+
+    def save_session(self, app, session, response):
+        name = app.config["SESSION_COOKIE_NAME"]
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+        if not session.modified:
+            return
+
+        # An emptied session (e.g. after logging out) is deleted rather than saved
+        if not session:
+            if session.session_id is not None:
+                self.store.delete(session.session_id)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        session_id = session.session_id
+        if session_id is None or session.user_changed:
+            if session_id is not None:
+                self.store.delete(session_id)
+            session_id = new_session_id()
+
+        lifetime = int(app.permanent_session_lifetime.total_seconds())
+        self.store.save(session_id, serialize(dict(session)), lifetime)
+
+        # The cookie only has to be sent when it holds a new id, or to push back the expiry of a permanent session
+        if session_id != session.session_id or session.permanent:
+            response.set_cookie(name, session_id, expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+        session.session_id = session_id
+
+
+# Returns the session store for the app's SESSION_BACKEND setting (None for cookie sessions)
+def create_store(app):
+    backend = app.config.get("SESSION_BACKEND", "sql")
+    if backend == "sql":
+        return SqlSessionStore()
+    if backend == "redis":
+        return RedisSessionStore(app.config["SESSION_REDIS_URL"])
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "cookie":
+        return None
+    raise ValueError("Unknown SESSION_BACKEND: " + backend)
+
+
+@click.command("purge-sessions")
+@with_appcontext
+def purge_sessions_command():
+    store = getattr(current_app.session_interface, "store", None)
+    purged = store.purge() if store is not None else 0
+    print("Deleted " + str(purged) + " expired session(s)")
+
+
+def init_app(app):
+    store = create_store(app)
+    if store is not None:
+        app.session_interface = ServerSideSessionInterface(store)
@@ -0,0 +1,70 @@
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+import cache
+from models import db, BankAccount, PoolContribution, Loan
+
+'''
+Per-user account summary shown on the dashboard. The summary is built with a few aggregate queries and then kept in
+the per-user cache (see cache.py) until something that changes it is committed.
+
+Code that changes a user's money calls mark_user_changed(user_id) before committing. The cached summaries of those
+users are dropped once the transaction commits (and kept if it rolls back), so a summary can never be cached from
+data that was not saved.
+'''
+
+
+def _cache_key(user_id):
+    return "summary:" + str(user_id)
+
+
+# Returns a dictionary with the user's total balance, outstanding principal, accrued interest, amount due and number
+# of pool contributions
+def get_user_summary(user_id):
+    summary = cache.user_cache.get(_cache_key(user_id))
+    if summary is not None:
+        return summary
+
+    total_balance = db.session.query(func.coalesce(func.sum(BankAccount.balance), 0)) \
+        .filter(BankAccount.user_id == user_id).scalar()
+
+    outstanding_principal, accrued_interest, amount_due = db.session.query(
+        func.coalesce(func.sum(Loan.principal_amount - Loan.principal_paid), 0),
+        func.coalesce(func.sum(Loan.amount_accrued - (Loan.amount_paid - Loan.principal_paid)), 0),
+        func.coalesce(func.sum(Loan.amount_due), 0)
+    ).filter(Loan.user_id == user_id).one()
+
+    contribution_count = db.session.query(func.count(PoolContribution.id)) \
+        .filter(PoolContribution.user_id == user_id).scalar()
+
+    summary = {
+        "total_balance": total_balance,
+        "outstanding_principal": outstanding_principal,
+        "accrued_interest": accrued_interest,
+        "amount_due": amount_due,
+        "contribution_count": contribution_count
+    }
+    cache.user_cache.set(_cache_key(user_id), summary)
+
+    return summary
+
+
+# Records that the user's summary will be out of date once the current transaction is committed
+def mark_user_changed(user_id):
+    db.session.info.setdefault("changed_user_ids", set()).add(int(user_id))
+
+
+# Drops every cached summary (used after changes which affect many users, such as an accrual run)
+def invalidate_all_summaries():
+    cache.user_cache.clear()
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop("changed_user_ids", ()):
+        cache.user_cache.delete(_cache_key(user_id))
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_users(session):
+    session.info.pop("changed_user_ids", None)
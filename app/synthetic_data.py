@@ -0,0 +1,140 @@
+import random
+import time
+
+from sqlalchemy import func
+
+import analytics
+import ledger
+from models import db, User, BankAccount, Pool, PoolContribution, LoanRequest, Loan
+from passwords import hash_password
+
+'''
+Synthetic data generator for load testing and benchmarks (see benchmark.py). Generates users with bank accounts,
+pools, contributions, loan requests and loans in realistic proportions, from a seed so that the same data can be
+generated again on another machine.
+
+Rows are given explicit ids following the largest id already in each table and are inserted in chunks with
+bulk_insert_mappings, so it can be run against a database which already holds data. Every generated user has the
+username PREFIX-<number> and the password PASSWORD; the first one is a bank manager.
+
+Once the rows are in, opening balances are written to the ledger (see ledger.open_accounts) and the analytics tables
+are rebuilt, so the rest of the app sees consistent data.
+'''
+
+PREFIX = "synthetic"
+PASSWORD = "password"
+
+CATEGORIES = ["Auto", "Business", "Education", "Home", "Medical", "Personal", "Travel", "Wedding"]
+
+CHUNK_SIZE = 5000
+
+
+def username(number):
+    return PREFIX + "-" + str(number)
+
+
+def _next_id(model):
+    return db.session.query(func.coalesce(func.max(model.id), 0)).scalar() + 1
+
+
+def _insert(model, rows):
+    for start in range(0, len(rows), CHUNK_SIZE):
+        db.session.bulk_insert_mappings(model, rows[start:start + CHUNK_SIZE])
+        db.session.commit()
+
+
+# Generates the data and returns the number of rows created for each table
+# - contributions, loan_requests and loans are the average number per user
+def generate(users, pools, contributions=5, loan_requests=1, loans=2, seed=0):
+    rng = random.Random(seed)
+    now = int(time.time())
+
+    # Every user gets the same password, so it only has to be hashed once
+    password = hash_password(PASSWORD)
+    first_user_id = _next_id(User)
+    first_number = db.session.query(func.count(User.id)).filter(User.username.like(PREFIX + "-%")).scalar()
+
+    user_rows = [{
+        "id": first_user_id + index,
+        "first_name": "Synthetic",
+        "last_name": "User " + str(first_number + index),
+        "username": username(first_number + index),
+        "password": password,
+        "is_bank_manager": index == 0
+    } for index in range(users)]
+
+    # One to three bank accounts per user, the first of them a checking account
+    first_account_id = _next_id(BankAccount)
+    account_rows = []
+    user_accounts = {}
+    for user in user_rows:
+        for number in range(rng.choice((1, 1, 2, 3))):
+            account_rows.append({
+                "id": first_account_id + len(account_rows),
+                "user_id": user["id"],
+                "account_name": "Checking" if number == 0 else "Savings " + str(number),
+                "account_number": BankAccount.generateAccountNumber(),
+                "balance": int(rng.lognormvariate(11, 1.2))  # A median of about $600
+            })
+            user_accounts.setdefault(user["id"], []).append(account_rows[-1]["id"])
+
+    first_pool_id = _next_id(Pool)
+    pool_rows = [{
+        "id": first_pool_id + index,
+        "name": "Synthetic Pool " + str(first_pool_id + index),
+        "category": rng.choice(CATEGORIES),
+        "amount": int(rng.lognormvariate(15, 1))  # A median of about $33,000
+    } for index in range(pools)]
+    pool_ids = [pool["id"] for pool in pool_rows]
+    user_ids = [user["id"] for user in user_rows]
+
+    contribution_rows = [{
+        "user_id": user_id,
+        "pool_id": rng.choice(pool_ids),
+        "amount": int(rng.lognormvariate(9, 1))  # A median of about $80
+    } for user_id in (rng.choice(user_ids) for _ in range(users * contributions))]
+
+    loan_request_rows = []
+    for _ in range(users * loan_requests):
+        user_id = rng.choice(user_ids)
+        loan_request_rows.append({
+            "user_id": user_id,
+            "account_id": rng.choice(user_accounts[user_id]),
+            "pool_id": rng.choice(pool_ids),
+            "amount": int(rng.lognormvariate(11, 1))
+        })
+
+    loan_rows = []
+    for _ in range(users * loans):
+        principal = int(rng.lognormvariate(12, 1))  # A median of about $1,600
+        paid = int(principal * rng.random() * 0.8)
+        approved = now - rng.randint(0, 730) * 86400
+        loan_rows.append({
+            "user_id": rng.choice(user_ids),
+            "pool_id": rng.choice(pool_ids),
+            "principal_amount": principal,
+            "amount_accrued": 0,
+            "amount_paid": paid,
+            "principal_paid": paid,
+            "amount_due": principal - paid,
+            "date_approved": approved,
+            "date_due": approved + rng.choice((180, 365, 730)) * 86400,
+            "last_accrued_at": now,
+            "interest_rate": rng.choice((2.0, 3.5, 5.0, 7.5))
+        })
+
+    for model, rows in ((User, user_rows), (BankAccount, account_rows), (Pool, pool_rows),
+                        (PoolContribution, contribution_rows), (LoanRequest, loan_request_rows), (Loan, loan_rows)):
+        _insert(model, rows)
+
+    ledger.open_accounts()
+    analytics.rebuild()
+
+    return {
+        "user": len(user_rows),
+        "bank_account": len(account_rows),
+        "pool": len(pool_rows),
+        "pool_contribution": len(contribution_rows),
+        "loan_request": len(loan_request_rows),
+        "loan": len(loan_rows)
+    }
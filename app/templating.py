@@ -0,0 +1,85 @@
+import os
+import tempfile
+
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+
+import cache
+
+'''
+Template rendering speed-ups.
+
+Bytecode cache: compiled templates are saved to JINJA_BYTECODE_CACHE_DIR (by default a directory in the system's
+temporary directory), so a newly started worker loads them instead of compiling every template again on its first
+requests. Jinja checks each template's source file for changes as usual, so edited templates are still picked up.
+
+Fragment cache: a part of a template can be wrapped in a cache tag, which renders it once and then serves it from
+cache.fragment_cache for as long as its key stays the same:
+
+    {% cache "pool_card", pool %}
+        ...
+    {% endcache %}
+
+The key is the fragment's name followed by any number of values. Model instances are keyed on their column values, so
+the fragment is rendered again as soon as any of them changes (e.g. a pool's amount), and a list of models is keyed on
+all of them. Anything that the fragment uses must be part of its key. Fragment caching can be turned off with the
+FRAGMENT_CACHE config setting, in which case the tag renders its body every time.
+'''
+
+
+# Model class -> names of its columns, looked up once per class since keys are built for every fragment rendered
+_column_names = {}
+
+
+# Returns a hashable value that changes whenever the value (or, for models, any of its columns) changes
+def _key_part(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_key_part(item) for item in value)
+
+    model = type(value)
+    names = _column_names.get(model)
+    if names is None:
+        if not hasattr(model, "__table__"):
+            return value
+        names = _column_names[model] = tuple(column.key for column in model.__table__.columns)
+
+    return (model.__name__,) + tuple(getattr(value, name) for name in names)
+
+
+class FragmentCacheExtension(Extension):
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache_enabled=True)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            key.append(parser.parse_expression())
+
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        return nodes.CallBlock(self.call_method("_render", [nodes.List(key)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        if not self.environment.fragment_cache_enabled:
+            return caller()
+
+        cache_key = _key_part(key)
+        fragment = cache.fragment_cache.get(cache_key)
+        if fragment is None:
+            fragment = caller()
+            cache.fragment_cache.set(cache_key, fragment)
+        return fragment
+
+
+def init_app(app):
+    directory = app.config.get("JINJA_BYTECODE_CACHE_DIR") or \
+        os.path.join(tempfile.gettempdir(), "flask-bank-jinja-cache")
+    os.makedirs(directory, exist_ok=True)
+
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache_enabled = app.config.get("FRAGMENT_CACHE", True)
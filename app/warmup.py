@@ -0,0 +1,45 @@
+import gc
+import importlib
+
+from sqlalchemy.pool import QueuePool
+
+from models import db
+
+'''
+Warms up the app in a pre-forking server's master process, so that each worker starts ready to serve and shares the
+warmed up memory with the master (copy-on-write) instead of building its own copy. See gunicorn.conf.py, which calls
+warm() once the app is loaded and before the workers are forked, and warm_worker() in each worker after it is forked.
+
+Database connections are the exception: a connection must only ever be used by one process, so the master closes its
+connections before forking and each worker opens its own pool of connections instead.
+'''
+
+# Modules which the app only imports when a request first needs them (e.g. amortization.py and NumPy)
+LAZY_MODULES = ("amortization",)
+
+
+def warm(app):
+    for name in LAZY_MODULES:
+        importlib.import_module(name)
+
+    # Compiles every template into the Jinja environment's cache
+    for name in app.jinja_env.list_templates(filter_func=lambda name: name.endswith(".html")):
+        app.jinja_env.get_template(name)
+
+    # Creates the engine, whose dialect is set up on its first connection, and then closes every connection
+    with app.app_context():
+        db.engine.connect().close()
+        db.engine.dispose()
+
+    # Keeps the garbage collector away from everything created so far; a collection in a worker would otherwise write
+    # to the objects it inspects, and so copy the pages it shares with the master
+    gc.freeze()
+
+
+# Fills the worker's connection pool (server databases only; SQLite opens connections as they are needed)
+def warm_worker(app):
+    with app.app_context():
+        if isinstance(db.engine.pool, QueuePool):
+            connections = [db.engine.connect() for _ in range(db.engine.pool.size())]
+            for connection in connections:
+                connection.close()
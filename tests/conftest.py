@@ -0,0 +1,58 @@
+import os
+import sys
+
+import pytest
+
+# The app's modules import each other by their plain names (e.g. "import banking"), as they do when run from app/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+import cache  # noqa: E402
+import database  # noqa: E402
+from __init__ import create_app  # noqa: E402
+
+'''
+Shared fixtures. Every test gets its own app on a new SQLite database file, brought up to date with the migrations in
+the same way as "flask init-db", and the in-process caches emptied so that nothing carries over between tests.
+'''
+
+# Settings used by every test app; a low bcrypt work factor keeps signing up and logging in fast
+TEST_CONFIG = {
+    "TESTING": True,
+    "BCRYPT_LOG_ROUNDS": 4,
+    "SQL_STATEMENT_COUNT": True
+}
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "sqlite:///" + str(tmp_path / "test.db"))
+    app = create_app(TEST_CONFIG)
+
+    with app.app_context():
+        database.upgrade_schema()
+
+    for test_cache in (cache.shared_cache, cache.user_cache, cache.fragment_cache):
+        test_cache.clear()
+
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+# Signs up a new user on the client (which stays logged in as them), optionally makes them a bank manager, and returns
+# the id of their checking account
+def sign_up(client, username, bank_manager=False):
+    client.post("/attempt_sign_up", data={"first_name_input": "Test", "last_name_input": "User",
+                                          "username_input": username, "password_input": username})
+    if bank_manager:
+        client.get("/adminify")
+
+    return client.get("/api/v1/accounts").get_json()["accounts"][0]["id"]
+
+
+# Number of SQL statements the request ran (counted by instrumentation.py)
+def statement_count(response):
+    return int(response.headers["X-SQL-Statements"])
@@ -0,0 +1,41 @@
+import cache
+from models import db, Pool
+
+'''
+The pool category list is kept in the shared cache. A pool created by one worker process must show up in every other
+worker straight away, which the per-process cache cannot promise, and bulk imports must not leave the list stale.
+'''
+
+
+def test_shared_cache_is_off_with_several_workers(app, monkeypatch):
+    # The caches are module globals, so they are put back as they were after the test
+    monkeypatch.setattr(cache, "shared_cache", cache.shared_cache)
+    monkeypatch.setattr(cache, "user_cache", cache.user_cache)
+
+    app.config["WORKER_PROCESSES"] = 2
+    cache.init_app(app)
+    assert isinstance(cache.shared_cache, cache.NullCache)
+    assert isinstance(cache.user_cache, cache.NullCache)
+
+    with app.app_context():
+        assert Pool.get_categories() == []
+
+        # Another worker creates a pool, so this process's invalidate_categories() is never called
+        db.session.execute(Pool.__table__.insert().values(name="Pool", category="Cars", amount=100))
+        db.session.commit()
+        assert Pool.get_categories() == ["Cars"]
+
+
+def test_bulk_pool_import_invalidates_categories(app, tmp_path):
+    with app.app_context():
+        db.session.add(Pool("Pool", "Cars", 100))
+        db.session.commit()
+        assert Pool.get_categories() == ["Cars"]
+
+    path = tmp_path / "pools.csv"
+    path.write_text("name,category,amount\nImported,Boats,500\n")
+    result = app.test_cli_runner().invoke(args=["bulk", "import", "pool", str(path)])
+    assert result.exit_code == 0, result.output
+
+    with app.app_context():
+        assert Pool.get_categories() == ["Boats", "Cars"]
@@ -0,0 +1,107 @@
+import threading
+
+from sqlalchemy import func
+
+import ledger
+from models import db, BankAccount, Pool, PoolContribution, Loan, LedgerEntry
+from tests.conftest import sign_up
+
+'''
+Stress test for the money movements in banking.py: many threads contribute to the same pool, each trying to spend more
+than it has, while a bank manager approves loans out of that pool. Every movement is a conditional UPDATE, so no update
+may be lost, no account or pool may go below zero, and every cent must still be accounted for afterwards.
+'''
+
+CONTRIBUTORS = 8
+DEPOSIT = 1000
+CONTRIBUTION = 100
+# Each contributor tries to contribute half as much again as it deposited
+ATTEMPTS = DEPOSIT * 3 // 2 // CONTRIBUTION
+
+POOL_START = 500
+LOAN_REQUESTS = 20
+LOAN_AMOUNT = 150
+
+
+def _run_threads(targets):
+    errors = []
+
+    def run(target):
+        try:
+            target()
+        except Exception as error:  # Reported by the main thread, since pytest does not see errors raised in threads
+            errors.append(error)
+
+    threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+
+
+def test_concurrent_contributions_and_approvals_conserve_money(app):
+    manager = app.test_client()
+    manager_account_id = sign_up(manager, "manager", bank_manager=True)
+    pool_id = manager.post("/api/v1/pools", json={"name": "Shared", "category": "Stress",
+                                                  "amount": POOL_START}).get_json()["id"]
+
+    contributors = []
+    for number in range(CONTRIBUTORS):
+        client = app.test_client()
+        bank_account_id = sign_up(client, "contributor-" + str(number))
+        assert client.post("/api/v1/accounts/" + str(bank_account_id) + "/deposits",
+                           json={"amount": DEPOSIT}).status_code == 201
+        contributors.append((client, bank_account_id))
+
+    loan_request_ids = [
+        manager.post("/api/v1/loan_requests", json={"bank_account_id": manager_account_id, "pool_id": pool_id,
+                                                    "amount": LOAN_AMOUNT}).get_json()["id"]
+        for _ in range(LOAN_REQUESTS)
+    ]
+
+    contributed = []
+    approved = []
+
+    def contribute(client, bank_account_id):
+        for _ in range(ATTEMPTS):
+            response = client.post("/api/v1/contributions", json={
+                "pool_id": pool_id, "bank_account_id": bank_account_id, "amount": CONTRIBUTION
+            })
+            assert response.status_code in (201, 409), response.get_json()
+            if response.status_code == 201:
+                contributed.append(CONTRIBUTION)
+
+    def approve():
+        for loan_request_id in loan_request_ids:
+            response = manager.post("/api/v1/loan_requests/" + str(loan_request_id) + "/approve",
+                                    json={"date_due": 2 ** 31 - 1})
+            assert response.status_code in (201, 409), response.get_json()
+            if response.status_code == 201:
+                approved.append(LOAN_AMOUNT)
+
+    _run_threads([lambda c=client, b=bank_account_id: contribute(c, b) for client, bank_account_id in contributors] +
+                 [approve])
+
+    # Contributors could only spend what they deposited, and every successful contribution was saved
+    assert sum(contributed) == CONTRIBUTORS * DEPOSIT
+    assert approved
+
+    with app.app_context():
+        balances = dict(db.session.query(BankAccount.id, BankAccount.balance))
+        pool_amount = db.session.query(Pool.amount).filter(Pool.id == pool_id).scalar()
+
+        for _, bank_account_id in contributors:
+            assert balances[bank_account_id] == 0
+        assert balances[manager_account_id] == sum(approved)
+        assert pool_amount == POOL_START + sum(contributed) - sum(approved) >= 0
+
+        assert db.session.query(func.sum(PoolContribution.amount)).scalar() == sum(contributed)
+        assert db.session.query(func.sum(Loan.principal_amount)).scalar() == sum(approved)
+
+        # The ledger balances out and agrees with the balance columns
+        assert db.session.query(func.sum(LedgerEntry.amount)).scalar() == 0
+        for bank_account_id, balance in balances.items():
+            assert ledger.balance((ledger.BANK_ACCOUNT, bank_account_id)) == balance
+        assert ledger.balance((ledger.POOL, pool_id)) == pool_amount
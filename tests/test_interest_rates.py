@@ -0,0 +1,67 @@
+import pytest
+
+from models import db, Loan, LoanRequest
+from tests.conftest import sign_up
+
+'''
+Loans are approved through the forms on the bank management page and through the JSON API, which must both accept
+the same interest rates (see banking.is_valid_interest_rate).
+'''
+
+INVALID_RATES = (0, 0.5, 100.01, 101, 2.555)
+VALID_RATES = (1, 7.25, 100)
+
+
+# Signs up a bank manager with a pool and a loan request against it, and returns the loan request's id
+def _loan_request(client):
+    bank_account_id = sign_up(client, "manager", bank_manager=True)
+    pool = client.post("/api/v1/pools", json={"name": "Pool", "category": "Cars", "amount": 10 ** 6}).get_json()
+    return client.post("/api/v1/loan_requests", json={"bank_account_id": bank_account_id, "pool_id": pool["id"],
+                                                      "amount": 100}).get_json()["id"]
+
+
+@pytest.mark.parametrize("interest_rate", INVALID_RATES)
+def test_api_refuses_interest_rates_out_of_bounds(app, client, interest_rate):
+    loan_request_id = _loan_request(client)
+
+    response = client.post("/api/v1/loan_requests/" + str(loan_request_id) + "/approve",
+                           json={"date_due": 2 ** 31 - 1, "interest_rate": interest_rate})
+    assert response.status_code == 400, response.get_json()
+
+    response = client.post("/api/v1/loan_requests/approve", json={"loan_request_ids": [loan_request_id],
+                                                                  "date_due": 2 ** 31 - 1,
+                                                                  "interest_rate": interest_rate})
+    assert response.status_code == 400, response.get_json()
+
+    with app.app_context():
+        assert db.session.query(LoanRequest.id).count() == 1
+
+
+@pytest.mark.parametrize("interest_rate", INVALID_RATES)
+def test_form_refuses_interest_rates_out_of_bounds(app, client, interest_rate):
+    loan_request_id = _loan_request(client)
+
+    client.post("/approve_loan_request", data={"loan_request_id": loan_request_id,
+                                               "interest_rate_input": str(interest_rate),
+                                               "due_date_input": "2030-01-01"})
+
+    with app.app_context():
+        assert db.session.query(LoanRequest.id).count() == 1
+
+
+@pytest.mark.parametrize("interest_rate", VALID_RATES)
+def test_api_and_form_accept_the_same_interest_rates(app, client, interest_rate):
+    loan_request_id = _loan_request(client)
+    response = client.post("/api/v1/loan_requests/" + str(loan_request_id) + "/approve",
+                           json={"date_due": 2 ** 31 - 1, "interest_rate": interest_rate})
+    assert response.status_code == 201, response.get_json()
+
+    loan_request_id = client.post("/api/v1/loan_requests", json={
+        "bank_account_id": client.get("/api/v1/accounts").get_json()["accounts"][0]["id"],
+        "pool_id": client.get("/api/v1/pools").get_json()["pools"][0]["id"], "amount": 100}).get_json()["id"]
+    client.post("/approve_loan_request", data={"loan_request_id": loan_request_id,
+                                               "interest_rate_input": str(interest_rate),
+                                               "due_date_input": "2030-01-01"})
+
+    with app.app_context():
+        assert [rate for (rate,) in db.session.query(Loan.interest_rate)] == [interest_rate, interest_rate]
@@ -0,0 +1,145 @@
+import sqlite3
+
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from sqlalchemy import inspect
+
+import database
+import ledger
+from __init__ import create_app
+from models import db, BankAccount, Pool, PoolContribution, Loan, LoanRequest
+from tests.conftest import TEST_CONFIG
+
+'''
+Upgrades of databases created by the app before migrations were added, whose schema was made by db.create_all() from
+the original models and which have no alembic_version table. "flask init-db" stamps them at the baseline revision and
+runs every later migration on them, which has to leave them with the same schema as a new database and with their
+amounts of money converted from dollars to cents.
+'''
+
+# The schema db.create_all() made from the original models, with money stored as floating point dollars
+BASELINE_SCHEMA = """
+CREATE TABLE user (
+    id INTEGER NOT NULL,
+    first_name VARCHAR(100),
+    last_name VARCHAR(100),
+    username VARCHAR(100),
+    password VARCHAR(100),
+    is_bank_manager BOOLEAN,
+    PRIMARY KEY (id),
+    UNIQUE (username)
+);
+CREATE TABLE pool (
+    id INTEGER NOT NULL,
+    name VARCHAR(100),
+    category VARCHAR(100),
+    amount FLOAT,
+    PRIMARY KEY (id)
+);
+CREATE TABLE bank_account (
+    id INTEGER NOT NULL,
+    user_id INTEGER,
+    account_name VARCHAR(100),
+    account_number INTEGER,
+    balance FLOAT,
+    PRIMARY KEY (id),
+    FOREIGN KEY(user_id) REFERENCES user (id),
+    UNIQUE (account_number)
+);
+CREATE TABLE pool_contribution (
+    id INTEGER NOT NULL,
+    user_id INTEGER,
+    pool_id INTEGER,
+    amount FLOAT,
+    PRIMARY KEY (id),
+    FOREIGN KEY(user_id) REFERENCES user (id),
+    FOREIGN KEY(pool_id) REFERENCES pool (id)
+);
+CREATE TABLE loan (
+    id INTEGER NOT NULL,
+    user_id INTEGER,
+    principal_amount FLOAT,
+    amount_accrued FLOAT,
+    amount_paid FLOAT,
+    amount_due FLOAT,
+    date_approved INTEGER,
+    date_due INTEGER,
+    interest_rate FLOAT,
+    PRIMARY KEY (id),
+    FOREIGN KEY(user_id) REFERENCES user (id)
+);
+CREATE TABLE loan_request (
+    id INTEGER NOT NULL,
+    user_id INTEGER,
+    account_id INTEGER,
+    pool_id INTEGER,
+    amount FLOAT,
+    PRIMARY KEY (id),
+    FOREIGN KEY(user_id) REFERENCES user (id),
+    FOREIGN KEY(account_id) REFERENCES bank_account (id),
+    FOREIGN KEY(pool_id) REFERENCES pool (id)
+);
+"""
+
+
+# Creates a database with the baseline schema (and any rows given as SQL), then returns an app using it
+def _baseline_app(tmp_path, monkeypatch, rows=""):
+    path = tmp_path / "baseline.db"
+    connection = sqlite3.connect(str(path))
+    connection.executescript(BASELINE_SCHEMA + rows)
+    connection.close()
+
+    monkeypatch.setenv("DATABASE_URL", "sqlite:///" + str(path))
+    return create_app(TEST_CONFIG)
+
+
+def test_baseline_database_is_upgraded_to_the_current_schema(tmp_path, monkeypatch):
+    app = _baseline_app(tmp_path, monkeypatch)
+
+    with app.app_context():
+        database.upgrade_schema()
+
+        tables = inspect(db.engine).get_table_names()
+        assert "alembic_version" in tables and "ledger_entry" in tables and "job" in tables
+
+        with db.engine.connect() as connection:
+            assert compare_metadata(MigrationContext.configure(connection), db.metadata) == []
+
+        # Running it again finds nothing left to do
+        database.upgrade_schema()
+
+
+# Rows saved by the original app, with amounts in dollars
+DOLLAR_ROWS = """
+INSERT INTO user VALUES (1, 'Test', 'User', 'test', 'hash', 0);
+INSERT INTO pool VALUES (1, 'Savings', 'General', 1050.75);
+INSERT INTO bank_account VALUES (1, 1, 'Checking', 5000000001, 12.34);
+INSERT INTO pool_contribution VALUES (1, 1, 1, 19.99);
+INSERT INTO loan VALUES (1, 1, 1000.5, 12.35, 0.1, 1012.75, 1600000000, 1700000000, 5.0);
+INSERT INTO loan_request VALUES (1, 1, 1, 1, 250.1);
+"""
+
+
+def test_baseline_dollar_amounts_are_converted_to_cents(tmp_path, monkeypatch):
+    app = _baseline_app(tmp_path, monkeypatch, DOLLAR_ROWS)
+
+    with app.app_context():
+        database.upgrade_schema()
+
+        assert db.session.query(BankAccount.balance).scalar() == 1234
+        assert db.session.query(Pool.amount).scalar() == 105075
+        assert db.session.query(PoolContribution.amount).scalar() == 1999
+        assert db.session.query(Loan.principal_amount, Loan.amount_accrued, Loan.amount_paid, Loan.amount_due,
+                                Loan.principal_paid).one() == (100050, 1235, 10, 101275, 0)
+        assert db.session.query(LoanRequest.amount).scalar() == 25010
+
+        # The columns hold whole numbers of cents, not floating point values which happen to be whole
+        assert db.session.execute(db.text("SELECT typeof(balance) FROM bank_account")).scalar() == "integer"
+
+        # The balances were opened in the ledger in cents
+        assert ledger.balance((ledger.BANK_ACCOUNT, 1)) == 1234
+        assert ledger.balance((ledger.POOL, 1)) == 105075
+
+        # Upgrading again does not convert the amounts a second time
+        database.upgrade_schema()
+        assert db.session.query(BankAccount.balance).scalar() == 1234
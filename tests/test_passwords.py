@@ -0,0 +1,23 @@
+import passwords
+from __init__ import create_app
+from tests.conftest import TEST_CONFIG
+
+'''
+Every app hashes passwords on its own pool of threads, sized by its own configuration.
+'''
+
+
+def test_each_app_has_its_own_hashing_pool(app):
+    other_app = create_app(dict(TEST_CONFIG, PASSWORD_HASHING_WORKERS=1))
+
+    with app.app_context():
+        hashed = passwords.hash_password("secret")
+        assert passwords.check_password("secret", hashed)
+    with other_app.app_context():
+        assert passwords.check_password("secret", hashed)
+
+    executor = app.extensions["password_hashing"]
+    other_executor = other_app.extensions["password_hashing"]
+    assert executor is not other_executor
+    assert executor._max_workers == 4
+    assert other_executor._max_workers == 1
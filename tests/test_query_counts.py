@@ -0,0 +1,92 @@
+import uuid
+
+import cache
+from tests.conftest import sign_up, statement_count
+
+'''
+The busiest pages must run the same number of SQL statements however many rows they show, so that a relationship
+loaded lazily in a template loop (one query per row) is caught here rather than in production.
+'''
+
+
+def _create_pools(client, count, category="Cars"):
+    for number in range(count):
+        client.post("/api/v1/pools", json={"name": "Pool " + str(number), "category": category, "amount": 10 ** 6})
+
+
+# Each loan request comes from a different borrower and pool, so that the page has different rows to load for each
+def _create_loan_requests(app, count):
+    for _ in range(count):
+        borrower = app.test_client()
+        bank_account_id = sign_up(borrower, "borrower-" + uuid.uuid4().hex[:12], bank_manager=True)
+        pool = borrower.post("/api/v1/pools", json={"name": "Pool", "category": "Cars", "amount": 10 ** 6}).get_json()
+        borrower.post("/api/v1/loan_requests", json={"bank_account_id": bank_account_id, "pool_id": pool["id"],
+                                                     "amount": 100})
+
+
+# The caches are emptied before each request being compared, so that every one of them is rendered in full
+def _uncached_get(client, url):
+    for test_cache in (cache.shared_cache, cache.user_cache, cache.fragment_cache):
+        test_cache.clear()
+    return client.get(url)
+
+
+def test_bank_management_queries_do_not_grow_with_loan_requests(app, client):
+    sign_up(client, "manager", bank_manager=True)
+
+    _create_loan_requests(app, 2)
+    few = _uncached_get(client, "/bank_management")
+
+    _create_loan_requests(app, 10)
+    many = _uncached_get(client, "/bank_management")
+
+    assert few.status_code == many.status_code == 200
+    assert statement_count(many) == statement_count(few)
+
+
+def test_bank_management_pages_run_the_same_queries(app, client):
+    sign_up(client, "manager", bank_manager=True)
+    _create_loan_requests(app, 12)
+
+    first_page = _uncached_get(client, "/bank_management")
+    filtered_page = _uncached_get(client, "/bank_management?after=4&min_amount=0.5&max_amount=5")
+
+    assert statement_count(filtered_page) == statement_count(first_page)
+
+
+# Takes out count loans, each from a new pool, and approves them (the client's user must be a bank manager)
+def _borrow(client, bank_account_id, count):
+    for _ in range(count):
+        pool = client.post("/api/v1/pools", json={"name": "Pool", "category": "Cars", "amount": 10 ** 6}).get_json()
+        loan_request = client.post("/api/v1/loan_requests", json={
+            "bank_account_id": bank_account_id, "pool_id": pool["id"], "amount": 100
+        }).get_json()
+        client.post("/api/v1/loan_requests/" + str(loan_request["id"]) + "/approve", json={"date_due": 2 ** 31 - 1})
+
+
+def test_dashboard_queries_do_not_grow_with_loans(client):
+    bank_account_id = sign_up(client, "borrower", bank_manager=True)
+
+    _borrow(client, bank_account_id, 1)
+    few = _uncached_get(client, "/dashboard")
+
+    _borrow(client, bank_account_id, 10)
+    many = _uncached_get(client, "/dashboard")
+
+    assert few.status_code == many.status_code == 200
+    assert statement_count(many) == statement_count(few)
+
+
+def test_pool_browser_queries_do_not_grow_with_pools(client):
+    sign_up(client, "browser", bank_manager=True)
+
+    _create_pools(client, 2)
+    few = _uncached_get(client, "/pool_browser")
+
+    _create_pools(client, 60, category="Homes")
+    many = _uncached_get(client, "/pool_browser")
+    filtered = _uncached_get(client, "/pool_browser?category_list=Homes&sort=amount_desc&page=2")
+
+    assert few.status_code == many.status_code == filtered.status_code == 200
+    assert statement_count(many) == statement_count(few)
+    assert statement_count(filtered) == statement_count(few)
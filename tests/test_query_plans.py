@@ -0,0 +1,35 @@
+import itertools
+
+import pytest
+
+from models import db, Pool, LoanRequest
+from query_plans import HOT_QUERIES, full_scans
+
+'''
+The queries run on every page view must be answered from an index (see query_plans.py and "flask check-query-plans"),
+against the schema created by the migrations rather than by db.create_all(), so that a missing migration fails too.
+'''
+
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+def test_hot_query_uses_an_index(app, name):
+    with app.app_context():
+        assert full_scans(HOT_QUERIES[name]()) == []
+
+
+def test_full_scans_detects_a_table_scan(app):
+    with app.app_context():
+        assert full_scans(Pool.query.filter(Pool.name == "name")) == ["pool"]
+
+
+# Reading a whole index is still a full scan, even when the index holds every column the query needs
+def test_full_scans_detects_a_covering_index_scan(app):
+    with app.app_context():
+        assert full_scans(db.session.query(LoanRequest.pool_id).order_by(LoanRequest.pool_id)) == ["loan_request"]
+
+
+# Every page of the bank management loan request queue, with any combination of its filters, is found by SEARCH
+@pytest.mark.parametrize("after, pool_id, min_amount, max_amount", itertools.product((None, 1), repeat=4))
+def test_loan_request_queue_never_scans(app, after, pool_id, min_amount, max_amount):
+    with app.app_context():
+        assert full_scans(LoanRequest.queue_page(51, after, pool_id, min_amount, max_amount)) == []